@@ -0,0 +1,254 @@
+# batch_cli.py
+"""
+Unattended batch analysis of many videos, one process per worker.
+
+    python batch_cli.py /data/clips --out-dir outputs/nightly --workers 4
+    python batch_cli.py "/data/2024-*/cam1_*.mp4" manifest.csv --camera cab_front_1080p
+
+Inputs are directories (searched recursively for VIDEO_EXTS), glob patterns,
+single files, or manifests (.txt: one path per line; .csv: a `path` column and
+optional `speed`, `rolling_stock`, `camera` and `telemetry` columns). Every
+video is processed by run_inference in its own output dir
+`<out-dir>/<stem>-<hash>`, named after the SHA-256 of its content. A video
+whose dir already has a successful result.json for the same settings is
+skipped, so a re-run only processes new or failed inputs (interrupted ones
+resume from their checkpoint). Largest files are scheduled first. Each worker
+process loads its own model and gets an equal share of the CPU threads and of
+the frame-memory budget. The consolidated report goes to
+`<out-dir>/summary.json` and `summary.csv`.
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import importlib.util
+import json
+import multiprocessing as mp
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+VIDEO_EXTS = {".mp4", ".avi", ".mov", ".mkv", ".m4v", ".ts"}
+RESULT_FILE = "result.json"
+HASH_CHUNK = 4 * 1024 * 1024
+REQUIRED_MODULES = ("cv2", "numpy", "pandas", "torch", "ultralytics")
+MODEL_INPUT = 640  # inference_object.IMG_SIZE (not imported here: the parent never loads the model stack)
+
+
+# ---------------- inputs ----------------
+def _manifest(path):
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                p = row.pop("path")
+                yield _resolve(path.parent, p), {k: v for k, v in row.items() if v not in (None, "")}
+    else:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield _resolve(path.parent, line), {}
+
+
+def _resolve(base, p):
+    p = Path(p).expanduser()
+    return p if p.is_absolute() else base / p
+
+
+def collect_inputs(specs):
+    """[(video Path, per-video overrides)] for directories, globs, files and manifests (first mention wins)."""
+    found = {}
+    for spec in specs:
+        p = Path(spec)
+        if p.is_dir():
+            items = ((v, {}) for v in sorted(p.rglob("*")) if v.suffix.lower() in VIDEO_EXTS)
+        elif p.is_file() and p.suffix.lower() in (".txt", ".csv"):
+            items = _manifest(p)
+        elif p.is_file():
+            items = [(p, {})]
+        else:
+            items = ((Path(v), {}) for v in sorted(glob.glob(spec, recursive=True))
+                     if Path(v).suffix.lower() in VIDEO_EXTS)
+        for video, overrides in items:
+            found.setdefault(str(video.resolve()), overrides)
+    return [(Path(v), o) for v, o in found.items()]
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ---------------- worker ----------------
+def _init_worker(threads, frame_budget_mb):
+    # before torch / cv2 / frame_pool are imported in this process
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["TRACKGUARD_FRAME_BUDGET_MB"] = str(frame_budget_mb)
+    # cv2 and torch are in REQUIRED_MODULES, checked by the parent before the pool starts
+    import cv2 # type: ignore
+    import torch # type: ignore
+    cv2.setNumThreads(threads)
+    torch.set_num_threads(threads)
+
+
+def missing_modules():
+    """
+    Pipeline dependencies that cannot be imported on this host (ultralytics needs torch, so
+    there is no torch-free mode); checked once in the parent so a missing one is one clear
+    error rather than a broken pool.
+    """
+    return [m for m in REQUIRED_MODULES if importlib.util.find_spec(m) is None]
+
+
+def process_video(video, out_root, settings):
+    """Run one video (or skip it if already done); returns its summary row."""
+    t0 = time.perf_counter()
+    row = {"input": str(video), "status": "error", "out_dir": None, "sha256": None, "error": None}
+    try:
+        digest = file_hash(video)
+        out_dir = Path(out_root) / f"{video.stem}-{digest[:12]}"
+        row.update(sha256=digest, out_dir=str(out_dir))
+        result_path = out_dir / RESULT_FILE
+        if result_path.exists():
+            with open(result_path) as f:
+                done = json.load(f)
+            if done.get("settings") == settings:
+                return {**done["summary"], "status": "skipped", "seconds": round(time.perf_counter() - t0, 2)}
+
+        import inference_object as pipeline
+        out_dir.mkdir(parents=True, exist_ok=True)
+        paths = pipeline.run_inference(
+            str(video), float(settings["speed"]), settings["device"], out_dir=str(out_dir),
+            trace_path=str(out_dir / "trace.jsonl"), rolling_stock=settings["rolling_stock"],
+            telemetry=settings.get("telemetry"), camera=settings.get("camera"),
+            detection_log=bool(settings.get("detection_log")))
+        row.update(status="ok", seconds=round(time.perf_counter() - t0, 2), **_alert_counts(paths["csv"]))
+        tmp = result_path.with_suffix(".part")
+        with open(tmp, "w") as f:
+            json.dump({"settings": settings, "paths": paths, "summary": row}, f, indent=2)
+        os.replace(tmp, result_path)
+    except Exception as e:
+        row.update(error=f"{type(e).__name__}: {e}", seconds=round(time.perf_counter() - t0, 2))
+        traceback.print_exc()
+    return row
+
+
+def _alert_counts(alerts_csv):
+    import pandas as pd # type: ignore
+    from risk_engine import DECISIONS
+
+    df = pd.read_csv(alerts_csv)
+    counts = df["decision"].value_counts().to_dict() if "decision" in df.columns else {}
+    return {"alerts": int(sum(counts.values())), **{d: int(counts.get(d, 0)) for d in DECISIONS[1:]}}
+
+
+def frame_memory_needed(videos):
+    """
+    Smallest frame budget (bytes) a worker needs for the largest of `videos`: run_inference
+    keeps at least two full-size frames plus their model-size copies.
+    """
+    import cv2 # type: ignore
+
+    largest = 0
+    for video in videos:
+        cap = cv2.VideoCapture(str(video))
+        w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        largest = max(largest, w * h)
+    return 2 * 3 * (largest + MODEL_INPUT * MODEL_INPUT)
+
+
+# ---------------- driver ----------------
+def run_batch(inputs, out_root, workers, defaults, frame_budget_mb=1024):
+    """
+    Process [(video, overrides)] on `workers` processes; returns the summary rows in input order.
+    The worker count is lowered if `frame_budget_mb` split that many ways is too small for the largest video.
+    """
+    need = frame_memory_needed(v for v, _ in inputs)
+    fit = frame_budget_mb * 1024 * 1024 // need
+    if fit < 1:
+        raise MemoryError(f"--frame-budget-mb {frame_budget_mb} is below the {need / 1024**2:.0f} MB "
+                          f"one worker needs for the largest input")
+    if fit < workers:
+        print(f"frame budget fits {fit} worker(s) at this resolution; using {fit} instead of {workers}", flush=True)
+        workers = fit
+    os.makedirs(out_root, exist_ok=True)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    jobs = []
+    for video, overrides in inputs:
+        settings = {**defaults, **overrides}
+        if settings.get("telemetry"):
+            settings["telemetry"] = str(_resolve(video.parent, settings["telemetry"]))
+        jobs.append((video, settings))
+    order = sorted(range(len(jobs)), key=lambda i: -jobs[i][0].stat().st_size)  # longest first
+
+    rows = [None] * len(jobs)
+    ctx = mp.get_context("spawn")  # fresh interpreters: no forked CUDA / thread state
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(threads, frame_budget_mb // workers)) as pool:
+        futures = {pool.submit(process_video, jobs[i][0], out_root, jobs[i][1]): i for i in order}
+        for n, fut in enumerate(as_completed(futures), 1):
+            i = futures[fut]
+            try:
+                rows[i] = fut.result()
+            except BrokenProcessPool as e:  # a worker died (OOM kill, segfault in a codec, ...)
+                rows[i] = {"input": str(jobs[i][0]), "status": "error", "error": f"worker died: {e}"}
+            print(f"[{n}/{len(jobs)}] {rows[i]['status']:7s} {rows[i]['input']}", flush=True)
+    return rows
+
+
+def write_summary(rows, out_root, seconds):
+    statuses = [r["status"] for r in rows]
+    summary = {"videos": len(rows), "ok": statuses.count("ok"), "skipped": statuses.count("skipped"),
+               "errors": statuses.count("error"), "wall_s": round(seconds, 1),
+               "alerts": sum(r.get("alerts", 0) for r in rows), "results": rows}
+    with open(os.path.join(out_root, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    fields = []
+    for r in rows:
+        fields += [k for k in r if k not in fields]
+    with open(os.path.join(out_root, "summary.csv"), "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fields)
+        w.writeheader()
+        w.writerows(rows)
+    return summary
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Analyse a directory, glob or manifest of videos in parallel")
+    ap.add_argument("inputs", nargs="+", help="directories, glob patterns, video files or .txt/.csv manifests")
+    ap.add_argument("--out-dir", default="outputs/batch")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 4),
+                    help="parallel processes (each loads its own model)")
+    ap.add_argument("--speed", type=float, default=80.0)
+    ap.add_argument("--rolling-stock", default="default")
+    ap.add_argument("--camera", default=None)
+    ap.add_argument("--device", default="cpu")
+    ap.add_argument("--detection-log", action="store_true", help="keep raw detections for rescore.py")
+    ap.add_argument("--frame-budget-mb", type=int,
+                    default=int(float(os.environ.get("TRACKGUARD_FRAME_BUDGET_MB", "1024"))),
+                    help="frame memory for the whole batch, split across workers")
+    args = ap.parse_args()
+
+    missing = missing_modules()
+    if missing:
+        raise SystemExit(f"missing dependencies: {', '.join(missing)}")
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        raise SystemExit("no videos found")
+    defaults = {"speed": args.speed, "rolling_stock": args.rolling_stock, "camera": args.camera,
+                "device": args.device, "detection_log": args.detection_log}
+    t0 = time.perf_counter()
+    try:
+        rows = run_batch(inputs, args.out_dir, min(args.workers, len(inputs)), defaults, args.frame_budget_mb)
+    except MemoryError as e:
+        raise SystemExit(str(e))
+    summary = write_summary(rows, args.out_dir, time.perf_counter() - t0)
+    print(json.dumps({k: v for k, v in summary.items() if k != "results"}))
+    raise SystemExit(1 if summary["errors"] else 0)
@@ -0,0 +1,139 @@
+# batching.py
+"""
+Latency-aware batching for detector calls.
+
+`AdaptiveBatcher` collects frames and decides at runtime how many to send per
+predict() call. It keeps a running estimate of inference time as a function of
+batch size (fixed overhead + per-frame cost, refit after every batch) and of the
+frame arrival interval, and picks the largest batch whose first frame still
+gets its result within `latency_budget_s`:
+
+    (size - 1) * arrival_interval + predict_time(size) <= latency_budget_s
+
+A batch is also released early once its oldest frame could no longer make the
+budget (the timeout): `add()` checks it when a frame arrives, and a consumer that
+waits for frames should wait at most `wait_s()` and then call `poll()`, so a
+stalled source does not hold a partial batch back. `flush()` hands out whatever
+is left at the end of a stream, which goes through the same code path as any
+other partial batch.
+
+`autotune_batch_size` measures throughput per batch size on this host and
+returns the best one (used as the starting size / upper bound).
+"""
+import time
+
+import numpy as np # type: ignore
+
+
+class AdaptiveBatcher:
+    def __init__(self, latency_budget_s=0.5, min_size=1, max_size=16, initial_size=6, smoothing=0.3,
+                 clock=time.perf_counter):
+        self.latency_budget_s = latency_budget_s
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = max(min_size, min(max_size, initial_size))
+        self.smoothing = smoothing
+        self.clock = clock
+        self.items = []
+        self._first_at = None
+        self._last_arrival = None
+        self._interval = None          # EWMA of seconds between frames
+        self._cost = {}                # batch size -> EWMA predict seconds
+        self._fit = None               # (overhead s, per-frame s), refit in record()
+
+    # ---------------- collecting ----------------
+    def add(self, item):
+        """Queue one item; returns the batch to run now (a list) or None."""
+        now = self.clock()
+        if self._last_arrival is not None:
+            gap = now - self._last_arrival
+            self._interval = gap if self._interval is None else self._ewma(self._interval, gap)
+        self._last_arrival = now
+        if not self.items:
+            self._first_at = now
+        self.items.append(item)
+        if len(self.items) >= self.size or self._timed_out(now):
+            return self._take()
+        return None
+
+    def poll(self):
+        """Batch to run if the oldest queued item is about to miss its budget, else None."""
+        if self.items and self._timed_out(self.clock()):
+            return self._take()
+        return None
+
+    def wait_s(self):
+        """Seconds until poll() would release the queued items (None when nothing is queued)."""
+        if not self.items:
+            return None
+        deadline = (self._first_at + self.latency_budget_s - (self._interval or 0.0)
+                    - self.predict_time(len(self.items) + 1))
+        return max(0.0, deadline - self.clock())
+
+    def flush(self):
+        """Everything still queued (end of stream); may be empty."""
+        return self._take()
+
+    def _timed_out(self, now):
+        # waiting for one more frame would push the oldest one past the budget
+        waited = now - self._first_at
+        return waited + (self._interval or 0.0) + self.predict_time(len(self.items) + 1) > self.latency_budget_s
+
+    def _take(self):
+        batch, self.items, self._first_at = self.items, [], None
+        return batch
+
+    # ---------------- cost model ----------------
+    def _ewma(self, old, new):
+        return (1.0 - self.smoothing) * old + self.smoothing * new
+
+    def record(self, batch_len, seconds):
+        """Report how long predict() took for a batch of `batch_len` and retarget the size."""
+        if batch_len <= 0:
+            return
+        old = self._cost.get(batch_len)
+        self._cost[batch_len] = seconds if old is None else self._ewma(old, seconds)
+        sizes = np.fromiter(self._cost.keys(), dtype=np.float64)
+        costs = np.fromiter(self._cost.values(), dtype=np.float64)
+        if len(sizes) == 1:
+            self._fit = (0.0, float(costs[0] / sizes[0]))  # assume cost proportional to size
+        else:
+            per_frame, overhead = np.polyfit(sizes, costs, 1)
+            self._fit = (max(0.0, float(overhead)), max(float(per_frame), 1e-6))
+        self.size = self.target_size()
+
+    def predict_time(self, size):
+        """Estimated predict() seconds for `size` frames (0 before the first measurement)."""
+        if self._fit is None:
+            return 0.0
+        overhead, per_frame = self._fit
+        return overhead + per_frame * size
+
+    def target_size(self):
+        """Largest size in [min_size, max_size] whose first frame meets the latency budget."""
+        interval = self._interval or 0.0
+        best = self.min_size
+        for size in range(self.min_size, self.max_size + 1):
+            if (size - 1) * interval + self.predict_time(size) <= self.latency_budget_s:
+                best = size
+            else:
+                break
+        return best
+
+
+def autotune_batch_size(detector, sample_frames, sizes=(1, 2, 4, 6, 8, 12, 16), device="cpu", imgsz=640,
+                        repeats=3):
+    """
+    Throughput-optimal batch size for `detector` on this host.
+    Runs predict() `repeats` times per size on `sample_frames` (cycled as needed) and returns
+    (best_size, {size: frames_per_second}).
+    """
+    fps = {}
+    detector.predict([sample_frames[0]], imgsz=imgsz, verbose=False, device=device)  # warm-up
+    for size in sizes:
+        batch = [sample_frames[i % len(sample_frames)] for i in range(size)]
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            detector.predict(batch, imgsz=imgsz, verbose=False, device=device)
+        fps[size] = round(size * repeats / (time.perf_counter() - t0), 2)
+    return max(fps, key=fps.get), fps
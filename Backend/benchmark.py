@@ -0,0 +1,468 @@
+# benchmark.py
+"""
+End-to-end benchmarks for TrackGuard on synthetic rail-scene videos.
+
+    python benchmark.py --out bench.json                      # stub detector, default cases
+    python benchmark.py --model yolov8n.pt --sizes 1280x720   # real (tiny) model
+    python benchmark.py --baseline bench_baseline.json        # fail on regressions
+    python benchmark.py --save-baseline bench_baseline.json
+
+Each case runs in a fresh process so peak RSS is per case. The report (JSON)
+has frames/sec, latency percentiles per pipeline stage (from metrics.JobTracer), peak RSS and output sizes.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2 # type: ignore
+import numpy as np # type: ignore
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = ["640x360", "1280x720", "1920x1080"]
+DEFAULT_SECONDS = [5]
+DEFAULT_FPS = 25
+OBSTACLE_BGR = (255, 0, 255)  # the stub detector looks for this colour
+
+
+# ---------------- synthetic rail videos ----------------
+def make_rail_video(path, width, height, seconds, fps=DEFAULT_FPS, seed=0):
+    """Write a synthetic rail scene: converging rails, sleepers and an obstacle that gets closer."""
+    rng = np.random.default_rng(seed)
+    n_frames = int(seconds * fps)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    horizon = int(height * 0.35)
+    vx = width // 2
+
+    background = np.zeros((height, width, 3), dtype=np.uint8)
+    background[:horizon] = (200, 170, 120)                      # sky
+    background[horizon:] = (60, 90, 70)                         # ground
+    noise = rng.integers(0, 25, size=(height - horizon, width, 1), dtype=np.uint8)
+    background[horizon:] = cv2.add(background[horizon:], np.repeat(noise, 3, axis=2))
+    for left, right in [(0.30, 0.34), (0.66, 0.70)]:
+        cv2.line(background, (vx, horizon), (int(width * left), height), (170, 170, 170), 3)
+        cv2.line(background, (vx, horizon), (int(width * right), height), (170, 170, 170), 3)
+
+    for i in range(n_frames):
+        frame = background.copy()
+        # sleepers scroll towards the camera
+        for k in range(12):
+            t = ((k + i * 0.15) % 12) / 12.0
+            y = int(horizon + (height - horizon) * t * t)
+            half = int(width * 0.22 * t) + 2
+            cv2.line(frame, (vx - half, y), (vx + half, y), (40, 60, 90), max(1, int(6 * t)))
+        # obstacle grows as it gets closer (appears after the first second)
+        if i >= fps:
+            p = (i - fps) / max(1, n_frames - fps)
+            ob_h = int(height * (0.05 + 0.30 * p))
+            ob_w = int(ob_h * 0.6)
+            bottom = int(horizon + (height - horizon) * (0.25 + 0.6 * p))
+            cv2.rectangle(frame, (vx - ob_w // 2, bottom - ob_h), (vx + ob_w // 2, bottom), OBSTACLE_BGR, -1)
+        writer.write(frame)
+    writer.release()
+    return n_frames
+
+
+# ---------------- stub detector ----------------
+class _Array:
+    """Minimal stand-in for a torch tensor: .cpu().numpy(), iteration, int()/float()."""
+
+    def __init__(self, a):
+        self._a = np.asarray(a)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._a
+
+    def __len__(self):
+        return len(self._a)
+
+    def __iter__(self):
+        return (_Array(x) for x in self._a)
+
+    def __int__(self):
+        return int(self._a)
+
+    def __float__(self):
+        return float(self._a)
+
+
+class _Boxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy, self.cls, self.conf = _Array(xyxy), _Array(cls), _Array(conf)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+
+class _Result:
+    def __init__(self, boxes, names, orig_shape):
+        self.boxes = boxes
+        self.names = names
+        self.orig_shape = orig_shape
+
+
+class StubModel:
+    """YOLO-compatible detector that finds the synthetic obstacle by colour (no weights needed)."""
+
+    names = {0: "person", 1: "cow"}
+
+    def predict(self, frames, imgsz=640, conf=0.25, verbose=False, device="cpu", **kwargs):
+        if isinstance(frames, np.ndarray):
+            frames = [frames]
+        results = []
+        for f in frames:
+            mask = cv2.inRange(f, (200, 0, 200), (255, 60, 255))
+            boxes = []
+            if cv2.countNonZero(mask):
+                x, y, w, h = cv2.boundingRect(mask)
+                boxes.append([x, y, x + w, y + h])
+            xyxy = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+            results.append(_Result(_Boxes(xyxy, np.zeros(len(xyxy)), np.full(len(xyxy), 0.9)), self.names,
+                                   f.shape[:2]))
+        return results
+
+
+# ---------------- helpers ----------------
+def stage_latencies(tracer):
+    return {stage: percentiles(samples) for stage, samples in sorted(tracer.samples.items())}
+
+
+def percentiles(samples_s):
+    if not samples_s:
+        return None
+    ms = np.asarray(samples_s) * 1000.0
+    stats = {f"p{q}": round(float(np.percentile(ms, q)), 3) for q in (50, 90, 99)}
+    stats.update(mean=round(float(ms.mean()), 3), n=int(ms.size))
+    return stats
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # bytes on macOS
+        kb /= 1024
+    return round(kb / 1024.0, 1)
+
+
+def file_sizes(paths):
+    sizes = {}
+    for name, p in paths.items():
+        if not p or not isinstance(p, str) or not os.path.exists(p):
+            continue
+        if os.path.isdir(p):
+            sizes[name] = sum(f.stat().st_size for f in Path(p).rglob("*") if f.is_file())
+        else:
+            sizes[name] = os.path.getsize(p)
+    return sizes
+
+
+def make_detector(model_spec):
+    if model_spec == "stub":
+        return StubModel()
+    from ultralytics import YOLO # type: ignore
+    return YOLO(model_spec)
+
+
+# ---------------- cases (each runs in its own process) ----------------
+def bench_inference(video_path, n_frames, model_spec, work_dir, decoder="auto", max_side=None):
+    import inference_object
+    from metrics import JobTracer
+
+    tracer = JobTracer("bench", "obstacle", keep_samples=True)
+    t0 = time.perf_counter()
+    paths = inference_object.run_inference(str(video_path), sim_speed=80.0, device="cpu",
+                                           out_dir=str(work_dir), detector=make_detector(model_spec),
+                                           tracer=tracer, decoder=decoder, max_side=max_side)
+    wall = time.perf_counter() - t0
+    return {
+        "frames": n_frames,
+        "decoder": decoder,
+        "fps": round(n_frames / wall, 2),
+        "wall_s": round(wall, 3),
+        "latency_ms": stage_latencies(tracer),
+        "peak_rss_mb": peak_rss_mb(),
+        "output_bytes": file_sizes(paths),
+    }
+
+
+def bench_track_yolo(video_path, n_frames, model_spec, work_dir):
+    import track_yolo
+    from metrics import JobTracer
+
+    tracer = JobTracer("bench", "track_fault", keep_samples=True)
+    t0 = time.perf_counter()
+    paths = track_yolo.analyze_media(str(video_path), detector=make_detector(model_spec),
+                                     out_dir=str(work_dir), tracer=tracer)
+    wall = time.perf_counter() - t0
+    return {
+        "frames": n_frames,
+        "fps": round(n_frames / wall, 2),
+        "wall_s": round(wall, 3),
+        "latency_ms": stage_latencies(tracer),
+        "peak_rss_mb": peak_rss_mb(),
+        "output_bytes": file_sizes(paths),
+    }
+
+
+def bench_scenarios(n_scenarios):
+    from scenario_engine import scenario_grid, simulate_fault_approach, simulate_head_on
+
+    side = max(2, int(round(n_scenarios ** 0.25)))
+    grid = scenario_grid(speed=np.linspace(1.0, 8.0, side), decel=np.linspace(0.2, 1.0, side),
+                         gap=np.linspace(100.0, 400.0, side), reaction_time=np.linspace(0.0, 2.0, side))
+    n = grid["speed"].size
+    t0 = time.perf_counter()
+    simulate_fault_approach(**grid)
+    fault_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    simulate_head_on(grid["gap"], grid["speed"], decel=grid["decel"], reaction_time=grid["reaction_time"])
+    head_on_s = time.perf_counter() - t0
+    return {
+        "scenarios": n,
+        "fault_scenarios_per_s": round(n / fault_s, 1),
+        "head_on_scenarios_per_s": round(n / head_on_s, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_cascade(video_path, n_frames, model_spec, screen_spec, work_dir=None):
+    """Full model on every sampled frame vs. the screening cascade: speed, escalation rate, agreement."""
+    import inference_object
+    from cascade import CascadeDetector, agreement
+
+    cap = cv2.VideoCapture(str(video_path))
+    frames, i = [], 0
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        i += 1
+        if i % inference_object.FRAME_SKIP == 0:
+            frames.append(cv2.resize(frame, (640, 640)))
+    cap.release()
+
+    full_model = make_detector(model_spec)
+    cascade = CascadeDetector(make_detector(screen_spec), full_model, inference_object.has_candidates,
+                              inference_object.SCREEN_CONF)
+    bs = inference_object.BATCH_SIZE
+    batches = [frames[k:k + bs] for k in range(0, len(frames), bs)]
+    t0 = time.perf_counter()
+    full = [r for b in batches for r in full_model.predict(b, imgsz=640, conf=0.30, verbose=False)]
+    full_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    casc = [r for b in batches for r in cascade.predict(b, imgsz=640, conf=0.30, verbose=False)]
+    cascade_s = time.perf_counter() - t0
+    return {
+        "frames": len(frames),
+        "fps": round(len(frames) / cascade_s, 2),
+        "full_model_fps": round(len(frames) / full_s, 2),
+        "speedup": round(full_s / cascade_s, 2),
+        **cascade.stats(),
+        **agreement(full, casc, inference_object.has_candidates),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_batch(model_spec, width=1280, height=720):
+    """Throughput per detector batch size (batching.autotune_batch_size) on synthetic frames."""
+    from batching import autotune_batch_size
+
+    rng = np.random.default_rng(0)
+    frames = [cv2.resize(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (640, 640)) for _ in range(4)]
+    best, fps = autotune_batch_size(make_detector(model_spec), frames)
+    return {"best_batch_size": best, "fps_by_batch_size": fps, "fps": fps[best]}
+
+
+def bench_render(fps):
+    import train_fault_3dsimulation as sim
+
+    demo = sim.TrainSafetyDemo()
+    demo.reset(record=False, fixed_dt=1.0 / fps)
+    steps = 0
+    t0 = time.perf_counter()
+    while not demo.finished:
+        demo.taskMgr.step()
+        steps += 1
+    wall = time.perf_counter() - t0
+    return {"frames": steps, "fps": round(steps / wall, 2), "sim_time_s": round(demo.sim_time, 2),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def _legacy_scores(dists, confs, classes, speed_kmph, profile):
+    """Reference: the per-detection scalar path the services used before risk_engine."""
+    from risk_engine import CLASS_WEIGHT
+
+    out = []
+    for dist, conf, cls in zip(dists, confs, classes):
+        v = speed_kmph / 3.6
+        safe_stop = v * profile["reaction_time"] + (v ** 2) / (2 * profile["decel"])
+        ttc = dist / max(0.1, v)
+        d_norm = np.clip(1.0 - (dist / 500.0), 0.0, 1.0)
+        c_norm = np.clip(conf, 0.0, 1.0)
+        s_norm = np.clip(speed_kmph / 200.0, 0.0, 1.0)
+        score = float(np.clip((0.6 * d_norm + 0.25 * c_norm + 0.15 * s_norm) * 100.0 * CLASS_WEIGHT.get(cls, 1.0), 0, 100))
+        if dist <= safe_stop * 0.8 or ttc <= profile["ttc_brake"]:
+            decision = "BRAKE_EMERGENCY"
+        elif dist <= safe_stop * 1.5:
+            decision = "SLOW_DOWN"
+        elif dist <= profile["warning_dist"]:
+            decision = "CAUTION"
+        else:
+            decision = "CLEAR"
+        out.append((score, decision))
+    return out
+
+
+def bench_risk(n_frames=2000, dets_per_frame=(1, 8, 32, 128)):
+    """Per-frame decision cost: scalar Python loop vs risk_engine arrays."""
+    import risk_engine
+
+    rng = np.random.default_rng(0)
+    profile = risk_engine.get_profile("default")
+    names = list(risk_engine.CLASS_WEIGHT)
+    report = {}
+    for k in dets_per_frame:
+        frames = [(rng.uniform(2, 300, k), rng.uniform(0.4, 1.0, k), [names[i] for i in rng.integers(0, len(names), k)])
+                  for _ in range(n_frames)]
+        t0 = time.perf_counter()
+        legacy = [_legacy_scores(d, c, cls, 80.0, profile) for d, c, cls in frames]
+        legacy_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        vectorized = [risk_engine.score_detections(d, c, cls, 80.0, profile) for d, c, cls in frames]
+        engine_s = time.perf_counter() - t0
+        agree = all(
+            [dec for _, dec in old] == [risk_engine.DECISIONS[c] for c in codes]
+            for old, (_, codes, _) in zip(legacy, vectorized))
+        report[f"{k}_dets"] = {
+            "loop_us_per_frame": round(legacy_s / n_frames * 1e6, 2),
+            "engine_us_per_frame": round(engine_s / n_frames * 1e6, 2),
+            "speedup": round(legacy_s / engine_s, 2),
+            "decisions_match": agree,
+        }
+    return {"frames": n_frames, "per_detection_count": report}
+
+
+def _run_case(kind, kwargs):
+    fn = {"inference": bench_inference, "track_yolo": bench_track_yolo,
+          "scenarios": bench_scenarios, "render": bench_render, "risk": bench_risk, "batch": bench_batch,
+          "cascade": bench_cascade}[kind]
+    return fn(**kwargs)
+
+
+def run_isolated(kind, **kwargs):
+    with mp.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_run_case, (kind, kwargs))
+
+
+# ---------------- regression check ----------------
+def compare(current, baseline, tolerance):
+    """Return human-readable regressions of `current` against `baseline` (fps and peak RSS)."""
+    regressions = []
+    base_cases = {c["name"]: c for c in baseline.get("cases", [])}
+    for case in current["cases"]:
+        base = base_cases.get(case["name"])
+        if not base or "error" in case or "error" in base:
+            continue
+        for metric in ("fps", "fault_scenarios_per_s", "head_on_scenarios_per_s"):
+            if metric in case and metric in base and case[metric] < base[metric] * (1 - tolerance):
+                regressions.append(f"{case['name']}: {metric} {case[metric]} < baseline {base[metric]}")
+        if case.get("peak_rss_mb") and base.get("peak_rss_mb") and \
+                case["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{case['name']}: peak_rss_mb {case['peak_rss_mb']} > baseline {base['peak_rss_mb']}")
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="TrackGuard benchmark suite")
+    ap.add_argument("--model", default="stub", help="'stub' (no weights) or a YOLO weights path/name")
+    ap.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="WxH video resolutions")
+    ap.add_argument("--seconds", nargs="+", type=float, default=DEFAULT_SECONDS, help="video lengths")
+    ap.add_argument("--fps", type=int, default=DEFAULT_FPS)
+    ap.add_argument("--suites", nargs="+", default=["inference", "track_yolo", "scenarios", "risk"],
+                    choices=["inference", "track_yolo", "scenarios", "render", "risk", "batch", "cascade"])
+    ap.add_argument("--screen-model", default="stub", help="screening model for the cascade suite")
+    ap.add_argument("--decoder", default="auto", choices=["auto", "pyav", "ffmpeg", "opencv"],
+                    help="video_decoder backend for the inference suite")
+    ap.add_argument("--max-side", type=int, default=None, help="decode the inference suite's frames at this long side")
+    ap.add_argument("--scenarios", type=int, default=10000, help="scenario count for the sweep benchmark")
+    ap.add_argument("--work-dir", default=None, help="where videos/outputs go (default: temp dir)")
+    ap.add_argument("--out", default=None, help="write the JSON report here (default: stdout)")
+    ap.add_argument("--baseline", default=None, help="compare against this report and fail on regressions")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+    ap.add_argument("--save-baseline", default=None, help="also store this run as a baseline")
+    args = ap.parse_args(argv)
+
+    work_root = Path(args.work_dir or tempfile.mkdtemp(prefix="trackguard-bench-"))
+    work_root.mkdir(parents=True, exist_ok=True)
+    report = {
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "model": args.model,
+        "cases": [],
+    }
+
+    for size in args.sizes:
+        w, h = (int(v) for v in size.lower().split("x"))
+        for seconds in args.seconds:
+            video = work_root / f"synthetic_{w}x{h}_{seconds:g}s.mp4"
+            n_frames = make_rail_video(video, w, h, seconds, fps=args.fps)
+            for suite in ("inference", "track_yolo", "cascade"):
+                if suite not in args.suites:
+                    continue
+                name = f"{suite}_{w}x{h}_{seconds:g}s"
+                out_dir = work_root / name
+                out_dir.mkdir(exist_ok=True)
+                extra = {"decoder": args.decoder, "max_side": args.max_side} if suite == "inference" else \
+                    {"screen_spec": args.screen_model} if suite == "cascade" else {}
+                try:
+                    case = run_isolated(suite, video_path=str(video), n_frames=n_frames,
+                                        model_spec=args.model, work_dir=str(out_dir), **extra)
+                except Exception as e:
+                    case = {"error": repr(e)}
+                report["cases"].append({"name": name, **case})
+                print(f"{name}: {case.get('fps', case.get('error'))}", file=sys.stderr)
+
+    if "scenarios" in args.suites:
+        case = run_isolated("scenarios", n_scenarios=args.scenarios)
+        report["cases"].append({"name": f"scenarios_{case['scenarios']}", **case})
+    if "risk" in args.suites:
+        report["cases"].append({"name": "risk_engine", **run_isolated("risk")})
+    if "batch" in args.suites:
+        report["cases"].append({"name": "batch_autotune", **run_isolated("batch", model_spec=args.model)})
+    if "render" in args.suites:
+        try:
+            case = run_isolated("render", fps=args.fps)
+        except Exception as e:
+            case = {"error": repr(e)}
+        report["cases"].append({"name": f"render_{args.fps}fps", **case})
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(text)
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# calibration.py
+"""
+Per-camera distance calibration compiled into lookup tables.
+
+A camera profile gives the intrinsics (vertical focal length `fy` and principal
+row `cy`, in pixels at `image_height`), the mounting height above the rail
+(`height_m`) and the downward pitch (`pitch_deg`), plus optional per-class
+real-world heights on top of CLASS_HEIGHT_M. For a given frame size a profile
+is compiled once into two tables:
+
+    ground[row]          distance (m) of the ground point seen at that image row
+    height[class, h_px]  distance (m) of an object of that class that is h_px tall
+
+so distances for all detections of a frame are two array gathers. The ground
+(bottom-row) estimate is used where the row lies below the horizon and is
+closer than `ground_max_m`; beyond that the class-height estimate takes over,
+since a pixel row covers many metres far away.
+
+Profiles live in CAMERA_PROFILES; a JSON file of more profiles can be added with
+TRACKGUARD_CAMERAS.
+
+    python calibration.py cab_front_1080p --frame 1280x720   # print the tables
+"""
+import argparse
+import json
+import math
+import os
+
+import numpy as np # type: ignore
+
+# typical object heights (m) per detector class; unknown classes use DEFAULT_HEIGHT_M
+CLASS_HEIGHT_M = {
+    "person": 1.7, "car": 1.5, "truck": 3.2, "motorcycle": 1.2, "bicycle": 1.1,
+    "cow": 1.4, "buffalo": 1.5, "dog": 0.6, "sheep": 0.8, "goat": 0.8,
+    "elephant": 2.8, "train": 4.0, "animal": 1.2,
+}
+DEFAULT_HEIGHT_M = 1.5
+
+CAMERA_PROFILES = {
+    # cab-front camera, 1080p, ~45 deg vertical field of view
+    "cab_front_1080p": {"fy": 1300.0, "cy": 540.0, "image_height": 1080, "height_m": 2.6, "pitch_deg": 2.0,
+                        "ground_max_m": 80.0},
+    # locomotive roof mount, 720p, longer lens
+    "roof_720p": {"fy": 1450.0, "cy": 360.0, "image_height": 720, "height_m": 4.2, "pitch_deg": 1.0,
+                  "ground_max_m": 120.0},
+}
+if os.environ.get("TRACKGUARD_CAMERAS"):
+    with open(os.environ["TRACKGUARD_CAMERAS"]) as f:
+        CAMERA_PROFILES.update(json.load(f))
+
+_DEFAULTS = {"pitch_deg": 0.0, "ground_max_m": 80.0, "class_height_m": {}}
+
+
+def get_camera(camera):
+    """Resolve a camera profile name (or a full profile dict)."""
+    if isinstance(camera, dict):
+        return {**_DEFAULTS, **camera}
+    try:
+        return {**_DEFAULTS, **CAMERA_PROFILES[camera]}
+    except KeyError:
+        raise ValueError(f"Unknown camera profile {camera!r}; known: {sorted(CAMERA_PROFILES)}")
+
+
+class DistanceLUT:
+    """Distance tables of one camera profile for one frame size (see module docstring)."""
+
+    def __init__(self, camera, frame_shape, min_cap=2.0, max_cap=300.0):
+        p = get_camera(camera)
+        h = int(frame_shape[0])
+        self.shape = (h, int(frame_shape[1]))
+        # intrinsics are for image_height rows; frames may be decoded at another size
+        s = h / float(p["image_height"])
+        fy, cy = p["fy"] * s, p["cy"] * s
+
+        rows = np.arange(h, dtype=np.float64) + 0.5
+        angle = math.radians(p["pitch_deg"]) + np.arctan((rows - cy) / fy)  # below the horizon when > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ground = np.where(angle > 0, p["height_m"] / np.tan(angle), np.inf)
+        self.ground_max_m = float(p["ground_max_m"])
+        self.ground = np.clip(ground, min_cap, np.inf).astype(np.float32)
+
+        heights = {**CLASS_HEIGHT_M, **p["class_height_m"]}
+        self.classes = {c: i for i, c in enumerate(heights)}  # unknown classes -> last row
+        real_h = np.array([*heights.values(), DEFAULT_HEIGHT_M], dtype=np.float64)
+        px = np.maximum(np.arange(h + 1, dtype=np.float64), 1.0)
+        self.height = np.clip(fy * real_h[:, None] / px[None, :], min_cap, max_cap).astype(np.float32)
+        self.max_cap = max_cap
+
+    def distances(self, bboxes, classes):
+        """Distance (m) for an (N, 4) array of xyxy boxes in frame pixels and their class names."""
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        h = self.shape[0]
+        cls = np.fromiter((self.classes.get(c, len(self.classes)) for c in classes), dtype=np.intp,
+                          count=len(bboxes))
+        px = np.clip(np.rint(bboxes[:, 3] - bboxes[:, 1]).astype(np.intp), 1, h)
+        by_height = self.height[cls, px]
+        by_ground = self.ground[np.clip(bboxes[:, 3].astype(np.intp), 0, h - 1)]
+        d = np.where(by_ground <= self.ground_max_m, by_ground, by_height)
+        return np.minimum(d, self.max_cap).astype(np.float64)
+
+
+_LUTS = {}
+
+
+def get_lut(camera, frame_shape):
+    """Compiled DistanceLUT for `camera` at `frame_shape`, built once per profile and size."""
+    key = (json.dumps(get_camera(camera), sort_keys=True), int(frame_shape[0]), int(frame_shape[1]))
+    lut = _LUTS.get(key)
+    if lut is None:
+        lut = _LUTS[key] = DistanceLUT(camera, frame_shape)
+    return lut
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Print the distance tables of a camera profile")
+    ap.add_argument("camera", choices=sorted(CAMERA_PROFILES))
+    ap.add_argument("--frame", default=None, help="WxH (default: the profile's calibration size)")
+    ap.add_argument("--step", type=int, default=40, help="print every STEP rows")
+    args = ap.parse_args()
+
+    p = get_camera(args.camera)
+    shape = (p["image_height"], 0) if not args.frame else tuple(int(v) for v in args.frame.lower().split("x"))[::-1]
+    lut = get_lut(args.camera, shape)
+    print("row  ground_m")
+    for row in range(0, lut.shape[0], args.step):
+        print(f"{row:4d}  {lut.ground[row]:8.1f}")
+    print("bbox_h_px  " + "  ".join(f"{c:>8s}" for c in lut.classes))
+    for px in (20, 40, 80, 160, 320):
+        if px <= lut.shape[0]:
+            print(f"{px:9d}  " + "  ".join(f"{lut.height[i, px]:8.1f}" for i in lut.classes.values()))
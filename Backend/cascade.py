@@ -0,0 +1,107 @@
+# cascade.py
+"""
+Two-tier detection: a small screening model looks at every frame and only
+frames where it sees a candidate (as decided by `is_candidate`, e.g. a
+whitelisted class near the rail ROI) are sent to the full model.
+
+`CascadeDetector` has the same predict() signature as a YOLO model, so it can
+be passed anywhere a detector is accepted. Frames that are not escalated keep
+the screening model's result. Escalation counts go to the /metrics endpoint and
+`stats()`; `agreement()` compares cascade output with running the full model on
+every frame (benchmark.py's "cascade" suite reports both).
+"""
+import time
+
+import numpy as np # type: ignore
+
+from metrics import CASCADE_FRAMES
+
+
+class CascadeDetector:
+    def __init__(self, screen_model, full_model, is_candidate, screen_conf=0.15):
+        self.screen_model = screen_model
+        self.full_model = full_model
+        self.is_candidate = is_candidate
+        self.screen_conf = screen_conf
+        self.frames = 0
+        self.escalated = 0
+        self.screen_s = 0.0
+        self.full_s = 0.0
+
+    def predict(self, frames, imgsz=640, conf=0.25, verbose=False, device="cpu", **kwargs):
+        if isinstance(frames, np.ndarray):
+            frames = [frames]
+        t0 = time.perf_counter()
+        results = list(self.screen_model.predict(frames, imgsz=imgsz, conf=min(conf, self.screen_conf),
+                                                 verbose=verbose, device=device, **kwargs))
+        self.screen_s += time.perf_counter() - t0
+        escalate = [i for i, r in enumerate(results) if self.is_candidate(r)]
+        if escalate:
+            t0 = time.perf_counter()
+            full = self.full_model.predict([frames[i] for i in escalate], imgsz=imgsz, conf=conf,
+                                           verbose=verbose, device=device, **kwargs)
+            self.full_s += time.perf_counter() - t0
+            for i, r in zip(escalate, full):
+                results[i] = r
+        self.frames += len(frames)
+        self.escalated += len(escalate)
+        CASCADE_FRAMES.inc(len(frames) - len(escalate), tier="screen_only")
+        CASCADE_FRAMES.inc(len(escalate), tier="escalated")
+        return results
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "escalated": self.escalated,
+            "escalation_rate": round(self.escalated / self.frames, 4) if self.frames else 0.0,
+            "screen_ms_per_frame": round(self.screen_s / max(1, self.frames) * 1000, 3),
+            "full_ms_per_escalated_frame": round(self.full_s / max(1, self.escalated) * 1000, 3),
+        }
+
+
+def _boxes(r):
+    if getattr(r, "boxes", None) is None or len(r.boxes) == 0:
+        return np.zeros((0, 4)), []
+    names = r.names
+    cls_ids = r.boxes.cls.cpu().numpy().astype(int)
+    return r.boxes.xyxy.cpu().numpy(), [names.get(int(c), str(c)).lower() for c in cls_ids]
+
+
+def _iou(a, b):
+    x1, y1 = np.maximum(a[0], b[:, 0]), np.maximum(a[1], b[:, 1])
+    x2, y2 = np.minimum(a[2], b[:, 2]), np.minimum(a[3], b[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = lambda x: (x[..., 2] - x[..., 0]) * (x[..., 3] - x[..., 1])
+    return inter / np.maximum(area(a) + area(b) - inter, 1e-9)
+
+
+def agreement(full_results, cascade_results, is_candidate, iou=0.5):
+    """
+    How much the cascade loses against the full model on the same frames:
+    frame recall = frames the full model flags (is_candidate) that the cascade also flags;
+    box recall = full-model boxes on those frames matched by a cascade box of the same class.
+    """
+    flagged = hit_frames = boxes = hit_boxes = 0
+    for full, casc in zip(full_results, cascade_results):
+        if not is_candidate(full):
+            continue
+        flagged += 1
+        hit_frames += bool(is_candidate(casc))
+        fb, fc = _boxes(full)
+        cb, cc = _boxes(casc)
+        for box, name in zip(fb, fc):
+            boxes += 1
+            same = [i for i, n in enumerate(cc) if n == name]
+            if same and np.max(_iou(box, cb[same])) >= iou:
+                hit_boxes += 1
+    return {
+        "flagged_frames": flagged,
+        "frame_recall": round(hit_frames / flagged, 4) if flagged else 1.0,
+        "box_recall": round(hit_boxes / boxes, 4) if boxes else 1.0,
+    }
+
+
+def export_int8(weights="yolov8n.pt", fmt="openvino", data="coco128.yaml"):
+    """Export a screening model with INT8 post-training quantization; returns the exported path."""
+    from ultralytics import YOLO # type: ignore
+    return YOLO(weights).export(format=fmt, int8=True, data=data)
@@ -0,0 +1,164 @@
+# checkpoint.py
+"""
+Checkpoint / resume for long run_inference jobs.
+
+The annotated video is written as a series of segments (`SegmentWriter`); at
+every checkpoint the current segment is closed, so it is a complete MP4 on
+disk, and checkpoint.json records the last processed frame, the finished
+segments and the per-video state (persistence, alerts, counters). A restarted
+job with the same input and settings loads the checkpoint, seeks the decoder
+past the last processed frame and keeps appending segments; at the end the
+segments are joined with ffmpeg's concat demuxer (stream copy). Checkpoints are
+only taken between batches, so the saved state is always consistent.
+The HUD thumbnail strip is not checkpointed and restarts empty.
+"""
+import json
+import os
+import subprocess
+import time
+
+import cv2 # type: ignore
+
+CHECKPOINT_FILE = "checkpoint.json"
+SEGMENT_DIR = "segments"
+
+
+def input_signature(path, **params):
+    """Identifies a job: the input file (size + mtime) and every setting that changes the output."""
+    st = os.stat(path)
+    return {"input": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+            "params": {k: params[k] for k in sorted(params)}}
+
+
+class SegmentWriter:
+    """cv2.VideoWriter that can be closed and reopened as the next numbered segment."""
+
+    def __init__(self, seg_dir, fps, size, fourcc="avc1", segments=()):
+        self.seg_dir = seg_dir
+        self.fps = fps
+        self.size = size
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.segments = list(segments)
+        self._writer = None
+        self._current = None
+        self._frames = 0
+        os.makedirs(seg_dir, exist_ok=True)
+        # drop segments written after the checkpoint we resume from
+        keep = {os.path.basename(p) for p in self.segments}
+        for name in os.listdir(seg_dir):
+            if name.startswith("seg_") and name not in keep:
+                os.remove(os.path.join(seg_dir, name))
+
+    def write(self, frame):
+        if self._writer is None:
+            self._current = os.path.join(self.seg_dir, f"seg_{len(self.segments):05d}.mp4")
+            self._writer = cv2.VideoWriter(self._current, self.fourcc, self.fps, self.size)
+            self._frames = 0
+        self._writer.write(frame)
+        self._frames += 1
+
+    def rotate(self):
+        """Close the current segment (if it has frames) and add it to `segments`."""
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+            if self._frames:
+                self.segments.append(self._current)
+            else:
+                os.remove(self._current)
+
+    def release(self):
+        self.rotate()
+
+    def join(self, dest):
+        """Write all segments to `dest` (renamed when there is only one)."""
+        if not self.segments:
+            raise RuntimeError("no frames were written")
+        if len(self.segments) == 1:
+            os.replace(self.segments[0], dest)
+        else:
+            list_file = os.path.join(self.seg_dir, "concat.txt")
+            with open(list_file, "w") as f:
+                for p in self.segments:
+                    f.write(f"file '{os.path.abspath(p)}'\n")
+            subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0",
+                            "-i", list_file, "-c", "copy", dest], check=True)
+            os.remove(list_file)
+            for p in self.segments:
+                os.remove(p)
+        self.segments = []
+
+
+class Checkpointer:
+    def __init__(self, out_dir, signature, interval_s=120.0):
+        self.path = os.path.join(out_dir, CHECKPOINT_FILE)
+        self.signature = signature
+        self.interval_s = interval_s
+        self.saves = 0
+        self.save_s = 0.0
+        self._last = time.perf_counter()
+
+    def load(self):
+        """The saved checkpoint if it belongs to this job, else None."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("signature") != self.signature:
+            return None
+        self.save_s = data.get("checkpoint_s", 0.0)
+        self.saves = data.get("checkpoints", 0)
+        return data
+
+    def due(self):
+        return self.interval_s is not None and time.perf_counter() - self._last >= self.interval_s
+
+    def save(self, last_frame, state, writer):
+        """Close the current segment and record progress up to `last_frame` (atomic replace)."""
+        t0 = time.perf_counter()
+        writer.rotate()
+        data = {
+            "signature": self.signature,
+            "last_frame": last_frame,
+            "segments": [os.path.basename(p) for p in writer.segments],
+            "state": dump_state(state),
+            "checkpoints": self.saves + 1,
+            # total time spent checkpointing so far (overhead), carried across restarts
+            "checkpoint_s": round(self.save_s + time.perf_counter() - t0, 6),
+        }
+        tmp = self.path + ".part"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+        self.saves += 1
+        self._last = time.perf_counter()
+        elapsed = self._last - t0
+        self.save_s += elapsed
+        return elapsed
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+# ---------------- state (de)serialisation ----------------
+def dump_state(state):
+    return {
+        "persistence": [[cls, gx, gy, st["count"], st["last"]] for (cls, gx, gy), st in state["persistence"].items()],
+        "alerts": state["alerts"],
+        "written": state["written"],
+        "thumb_count": state.get("thumb_count", 0),
+        "elapsed_s": time.time() - state["start_t"],
+    }
+
+
+def restore_state(state, saved):
+    state["persistence"] = {(cls, gx, gy): {"count": count, "last": last}
+                            for cls, gx, gy, count, last in saved["persistence"]}
+    state["alerts"] = saved["alerts"]
+    state["written"] = saved["written"]
+    state["thumb_count"] = saved["thumb_count"]
+    state["start_t"] = time.time() - saved["elapsed_s"]
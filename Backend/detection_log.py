@@ -0,0 +1,138 @@
+# detection_log.py
+"""
+Columnar log of the detector's raw per-frame output.
+
+While a job runs, `DetectionLogWriter` appends fixed-width records to two flat
+files: one row per processed frame (frame number, output-video position,
+speed, position) and one row per raw detection (frame number, box in model
+coordinates, class id, confidence). `finalize()` turns them into plain .npy
+files next to a meta.json (class names, frame size, fps, rolling stock), so
+`load_log()` can memory-map hours of footage without reading it into RAM.
+rescore.py replays filtering, persistence, risk and alerts from the log with
+different thresholds, without running the detector again.
+
+    outputs/<job>/detections/{frames.npy, detections.npy, meta.json}
+"""
+import json
+import os
+import shutil
+
+import numpy as np # type: ignore
+
+LOG_DIR = "detections"
+
+FRAME_DTYPE = np.dtype([("frame", "<i4"), ("written", "<i4"), ("speed_kmph", "<f8"),
+                        ("lat", "<f8"), ("lon", "<f8")])
+DET_DTYPE = np.dtype([("frame", "<i4"), ("xyxy", "<f4", (4,)), ("cls", "<i2"), ("conf", "<f4")])
+
+_TABLES = (("frames", FRAME_DTYPE), ("detections", DET_DTYPE))
+
+
+class DetectionLogWriter:
+    """
+    Appends raw detections to `log_dir`. With `resume_frame` an interrupted log is
+    continued: rows after that frame (written after the last checkpoint) are dropped.
+    """
+
+    def __init__(self, log_dir, meta, resume_frame=None):
+        self.log_dir = log_dir
+        self.meta = dict(meta)
+        self.names = []
+        os.makedirs(log_dir, exist_ok=True)
+        if resume_frame is not None:
+            try:
+                with open(self._path("meta.json")) as f:
+                    self.names = json.load(f).get("names", [])
+            except (OSError, ValueError):
+                resume_frame = None
+        self._ids = {n: i for i, n in enumerate(self.names)}
+        self._files = {}
+        for table, dtype in _TABLES:
+            raw = self._path(f"{table}.bin")
+            if resume_frame is not None and os.path.exists(raw):
+                _truncate_after(raw, dtype, resume_frame)
+                self._files[table] = open(raw, "ab")
+            else:
+                self._files[table] = open(raw, "wb")
+
+    def _path(self, name):
+        return os.path.join(self.log_dir, name)
+
+    def _class_id(self, name):
+        cid = self._ids.get(name)
+        if cid is None:
+            cid = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return cid
+
+    def append(self, frame_idx, written, speed_kmph, gps, xyxy, cls_names, confs):
+        """One processed frame: its raw detections (model coords) and navigation."""
+        lat, lon = gps
+        row = np.array([(frame_idx, written, speed_kmph, lat, lon)], dtype=FRAME_DTYPE)
+        self._files["frames"].write(row.tobytes())
+        if len(cls_names):
+            rows = np.empty(len(cls_names), dtype=DET_DTYPE)
+            rows["frame"] = frame_idx
+            rows["xyxy"] = xyxy
+            rows["cls"] = [self._class_id(n) for n in cls_names]
+            rows["conf"] = confs
+            self._files["detections"].write(rows.tobytes())
+
+    def flush(self):
+        """Make everything appended so far durable (called at checkpoints)."""
+        for f in self._files.values():
+            f.flush()
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp = self._path("meta.json.part")
+        with open(tmp, "w") as f:
+            json.dump({**self.meta, "names": self.names}, f)
+        os.replace(tmp, self._path("meta.json"))
+
+    def close(self):
+        """Close the raw files, leaving them in place for a resumed run."""
+        for f in self._files.values():
+            f.close()
+        if self._files:
+            self._write_meta()
+        self._files = {}
+
+    def finalize(self):
+        """Close and convert the raw files to .npy; returns the log directory."""
+        self.close()
+        for table, dtype in _TABLES:
+            raw = self._path(f"{table}.bin")
+            _raw_to_npy(raw, self._path(f"{table}.npy"), dtype)
+            os.remove(raw)
+        return self.log_dir
+
+
+def _truncate_after(raw, dtype, last_frame):
+    # rows are in frame order; a torn record at the end is dropped with the rest
+    n = os.path.getsize(raw) // dtype.itemsize
+    keep = 0
+    if n:
+        frames = np.memmap(raw, dtype=dtype, mode="r", shape=(n,))["frame"]
+        keep = int(np.searchsorted(frames, last_frame, side="right"))
+        del frames
+    os.truncate(raw, keep * dtype.itemsize)
+
+
+def _raw_to_npy(raw, dest, dtype):
+    n = os.path.getsize(raw) // dtype.itemsize
+    tmp = dest + ".part"
+    with open(raw, "rb") as src, open(tmp, "wb") as out:
+        np.lib.format.write_array_header_1_0(
+            out, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (n,)})
+        shutil.copyfileobj(src, out)
+    os.replace(tmp, dest)
+
+
+def load_log(log_dir):
+    """(meta, frames, detections) of a finished log; both tables are memory-mapped, in frame order."""
+    with open(os.path.join(log_dir, "meta.json")) as f:
+        meta = json.load(f)
+    frames = np.load(os.path.join(log_dir, "frames.npy"), mmap_mode="r")
+    dets = np.load(os.path.join(log_dir, "detections.npy"), mmap_mode="r")
+    return meta, frames, dets
@@ -0,0 +1,127 @@
+# event_clips.py
+"""
+Short review clips around alert events.
+
+`alert_windows` turns the alert timeline from run_inference into merged time
+windows (pre/post roll around every SLOW_DOWN / BRAKE_EMERGENCY alert), and
+`extract_event_clips` cuts one clip per window. Clips are stream-copied from
+the nearest keyframe at or before the window start, so nothing is re-encoded;
+only when that keyframe is further back than `max_preroll_s` is the single clip
+re-encoded from the exact start. An index.json next to the clips lists them.
+"""
+import bisect
+import json
+import logging
+import os
+import shutil
+import subprocess
+
+CLIP_DECISIONS = ("SLOW_DOWN", "BRAKE_EMERGENCY")
+
+log = logging.getLogger(__name__)
+_SEVERITY = {"CLEAR": 0, "CAUTION": 1, "SLOW_DOWN": 2, "BRAKE_EMERGENCY": 3}
+
+
+def alert_time(alert, time_key="pts_s", fps=None):
+    """Timestamp (s) of an alert: `time_key` if present, else its frame number over `fps`."""
+    if alert.get(time_key) is not None:
+        return float(alert[time_key])
+    if fps and alert.get("frame") is not None:
+        return (int(alert["frame"]) - 1) / float(fps)
+    return None
+
+
+def alert_windows(alerts, pre_s=3.0, post_s=3.0, merge_gap_s=1.0, decisions=CLIP_DECISIONS,
+                  time_key="pts_s", fps=None, duration_s=None):
+    """
+    Merged [start_s, end_s] windows around the alerts whose decision is in `decisions`.
+    Windows closer than `merge_gap_s` are joined; each keeps its worst decision and alert count.
+    """
+    events = sorted(
+        (t, a["decision"]) for a in alerts if a.get("decision") in decisions
+        for t in [alert_time(a, time_key, fps)] if t is not None)
+    windows = []
+    for t, decision in events:
+        start = max(0.0, t - pre_s)
+        end = t + post_s if duration_s is None else min(duration_s, t + post_s)
+        if windows and start <= windows[-1]["end_s"] + merge_gap_s:
+            w = windows[-1]
+            w["end_s"] = max(w["end_s"], end)
+            w["alerts"] += 1
+            if _SEVERITY[decision] > _SEVERITY[w["decision"]]:
+                w["decision"] = decision
+        else:
+            windows.append({"start_s": start, "end_s": end, "decision": decision, "alerts": 1})
+    return windows
+
+
+def probe_keyframes(video_path):
+    """(sorted keyframe times, duration) of the first video stream, read from packet flags (no decoding)."""
+    out = subprocess.run([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", str(video_path),
+    ], capture_output=True, text=True, check=True).stdout
+    keyframes, last = [], 0.0
+    for line in out.splitlines():
+        pts, _, flags = line.partition(",")
+        try:
+            t = float(pts)
+        except ValueError:
+            continue
+        last = max(last, t)
+        if "K" in flags:
+            keyframes.append(t)
+    keyframes.sort()
+    return keyframes, last
+
+
+def _cut(src, dest, start_s, end_s, copy):
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-ss", f"{start_s:.3f}", "-i", str(src),
+           "-t", f"{max(0.0, end_s - start_s):.3f}", "-map", "0:v:0"]
+    if copy:
+        cmd += ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+    else:
+        cmd += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p"]
+    cmd += ["-movflags", "+faststart", str(dest)]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def extract_event_clips(video_path, alerts, out_dir, pre_s=3.0, post_s=3.0, merge_gap_s=1.0,
+                        max_preroll_s=4.0, time_key="pts_s", fps=None, decisions=CLIP_DECISIONS):
+    """
+    Cut one clip per alert window from `video_path` into `out_dir`.
+    `time_key` names the alert field that holds times in this video's timeline.
+    Returns the clip list (also written to out_dir/index.json); empty when there are no
+    qualifying alerts or ffmpeg/ffprobe are not installed. A window whose cut fails is
+    logged and listed under "failed" in index.json instead of failing the job.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(out_dir):  # clips of a previous run in the same directory
+        if name.startswith("clip_") and name.endswith(".mp4"):
+            os.remove(os.path.join(out_dir, name))
+    clips, failed = [], []
+    if shutil.which("ffmpeg") and shutil.which("ffprobe"):
+        keyframes, duration = probe_keyframes(video_path)
+        windows = alert_windows(alerts, pre_s, post_s, merge_gap_s, decisions, time_key, fps,
+                                duration_s=duration or None)
+        for i, w in enumerate(windows):
+            k = bisect.bisect_right(keyframes, w["start_s"] + 1e-3) - 1
+            kf = keyframes[k] if k >= 0 else 0.0
+            copy = w["start_s"] - kf <= max_preroll_s
+            start = kf if copy else w["start_s"]
+            name = f"clip_{i:03d}_{w['decision'].lower()}_{w['start_s']:.1f}s.mp4"
+            try:
+                _cut(video_path, os.path.join(out_dir, name), start, w["end_s"], copy)
+            except (subprocess.CalledProcessError, OSError) as e:
+                err = (getattr(e, "stderr", None) or b"").decode(errors="replace").strip() or str(e)
+                log.warning("clip %s from %s failed: %s", name, video_path, err)
+                failed.append({**w, "start_s": round(start, 3), "end_s": round(w["end_s"], 3),
+                               "file": name, "method": "copy" if copy else "encode", "error": err})
+                if os.path.exists(os.path.join(out_dir, name)):
+                    os.remove(os.path.join(out_dir, name))
+                continue
+            clips.append({**w, "start_s": round(start, 3), "end_s": round(w["end_s"], 3),
+                          "file": name, "method": "copy" if copy else "encode"})
+    with open(os.path.join(out_dir, "index.json"), "w") as f:
+        json.dump({"source": os.path.basename(str(video_path)), "clips": clips, "failed": failed}, f, indent=2)
+    return clips
@@ -0,0 +1,155 @@
+# file_serving.py
+"""
+Artifact responses for the download endpoints.
+
+`serve_file` answers conditional requests (If-None-Match -> 304), single byte
+ranges (Range / If-Range -> 206, so players can seek without fetching the whole
+video) and, for text artifacts, hands out a gzip/brotli copy stored next to the
+original when the client accepts it. `precompress` writes those copies once
+after an analysis finishes, so nothing is compressed per request.
+"""
+import gzip
+import mimetypes
+import os
+import shutil
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+try:
+    import brotli # type: ignore
+except ImportError:  # optional; gzip copies are always written
+    brotli = None
+
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# suffix, Content-Encoding, Accept-Encoding token; in order of preference
+_ENCODINGS = ((".br", "br", "br"), (".gz", "gzip", "gzip"))
+
+
+def iterfile(path, start=0, end=None):
+    """Stream bytes [start, end] (inclusive) of a file in chunks."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def etag_for(st):
+    """Strong validator from mtime + size (artifacts are rewritten in place under fixed names)."""
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def precompress(path, level=9):
+    """Write `path`.gz (and `path`.br when brotli is installed) unless they are already up to date."""
+    path = str(path)
+    src_mtime = os.stat(path).st_mtime
+    for suffix, _, _ in _ENCODINGS:
+        dest = path + suffix
+        if suffix == ".br" and brotli is None:
+            continue
+        if os.path.exists(dest) and os.stat(dest).st_mtime >= src_mtime:
+            continue
+        tmp = dest + ".part"
+        if suffix == ".gz":
+            with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=level) as out:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+        else:
+            with open(path, "rb") as src, open(tmp, "wb") as out:
+                out.write(brotli.compress(src.read(), quality=11))
+        os.replace(tmp, dest)
+
+
+def _accepts(header, token):
+    for part in header.split(","):
+        name, *params = part.strip().split(";")
+        if name.strip().lower() not in (token, "*"):
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        return q > 0
+    return False
+
+
+def _precompressed(path, st, accept_encoding):
+    """(path, stat, Content-Encoding) of the preferred fresh compressed copy, or None."""
+    for suffix, encoding, token in _ENCODINGS:
+        if not _accepts(accept_encoding, token):
+            continue
+        try:
+            cst = os.stat(path + suffix)
+        except FileNotFoundError:
+            continue
+        if cst.st_mtime >= st.st_mtime:
+            return path + suffix, cst, encoding
+    return None
+
+
+def _parse_range(header, size):
+    """(start, end) for a single 'bytes=' range, None to ignore the header, or 'unsatisfiable'."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # multipart ranges are not worth it here; send the full file
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if end < start:
+        return None  # invalid range (RFC 9110 14.2): ignore the header and send the full file
+    if start >= size:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+def serve_file(request, path, media_type=None, filename=None):
+    """Response for GET `path` honouring If-None-Match, Range/If-Range and Accept-Encoding."""
+    path = str(path)
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    st = os.stat(path)
+    range_header = request.headers.get("range")
+    # a compressed body has its own byte offsets, so Range requests always get the original
+    encoded = None if range_header else _precompressed(path, st, request.headers.get("accept-encoding", ""))
+    etag = etag_for(encoded[1] if encoded else st)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    if encoded is not None:
+        headers["Content-Encoding"] = encoded[2]
+        return FileResponse(encoded[0], media_type=media_type, headers=headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    if range_header:
+        if_range = request.headers.get("if-range")
+        byte_range = _parse_range(range_header, st.st_size) if not if_range or if_range.strip() == etag else None
+        if byte_range == "unsatisfiable":
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(iterfile(path, start, end), status_code=206,
+                                     media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
@@ -0,0 +1,95 @@
+# frame_pool.py
+"""
+Preallocated frame buffers under a process-wide memory budget.
+
+A `FramePool` allocates `count` arrays of one shape up front and hands them out
+with `acquire()` / `release()`, so a job's decode, resize and HUD drawing reuse
+the same memory for its whole run. Every pool reserves its bytes from a
+`MemoryBudget` before allocating; when concurrent jobs would exceed the budget
+a new job waits for others to finish instead of pushing the node into swap.
+The budget (TRACKGUARD_FRAME_BUDGET_MB, default 1024) is therefore the ceiling
+for frame memory, whatever the number of jobs.
+"""
+import os
+import queue
+import threading
+import time
+
+import numpy as np # type: ignore
+
+from metrics import FRAME_POOL_BYTES
+
+FRAME_BUDGET_BYTES = int(float(os.environ.get("TRACKGUARD_FRAME_BUDGET_MB", "1024")) * 1024 * 1024)
+
+
+class MemoryBudget:
+    def __init__(self, limit_bytes):
+        self.limit = int(limit_bytes)
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def reserve(self, nbytes, timeout=None):
+        """Block until `nbytes` fit (MemoryError if they never can or `timeout` expires)."""
+        if nbytes > self.limit:
+            raise MemoryError(f"{nbytes / 1024**2:.0f} MB of frame buffers exceeds the "
+                              f"{self.limit / 1024**2:.0f} MB budget")
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.used + nbytes <= self.limit, timeout):
+                raise MemoryError("timed out waiting for frame buffer memory")
+            self.used += nbytes
+            FRAME_POOL_BYTES.set(self.used)
+
+    def release(self, nbytes):
+        with self._cond:
+            self.used -= nbytes
+            FRAME_POOL_BYTES.set(self.used)
+            self._cond.notify_all()
+
+
+BUDGET = MemoryBudget(FRAME_BUDGET_BYTES)
+
+
+def frame_bytes(shape, dtype=np.uint8):
+    return int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+
+class FramePool:
+    """`budget=None` for pools whose bytes the caller has already reserved (e.g. in one go for several pools)."""
+
+    def __init__(self, shape, count, dtype=np.uint8, budget=BUDGET, timeout=None):
+        self.shape = tuple(shape)
+        self.count = count
+        self.nbytes = count * frame_bytes(shape, dtype)
+        self.budget = budget
+        self.wait_s = 0.0  # total time acquire() blocked because every buffer was in use
+        if budget is not None:
+            budget.reserve(self.nbytes, timeout)
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(np.empty(self.shape, dtype=dtype))
+
+    def acquire(self):
+        """A free buffer (contents undefined); blocks while all are in use."""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            t0 = time.perf_counter()
+            buf = self._free.get()
+            self.wait_s += time.perf_counter() - t0
+            return buf
+
+    def release(self, buf):
+        self._free.put(buf)
+
+    def close(self):
+        if self.budget is not None:
+            self.budget.release(self.nbytes)
+            self.budget = None
+        self._free = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
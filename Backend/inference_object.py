@@ -3,6 +3,8 @@ import os
 import time
 import uuid
 import math
+import queue
+import threading
 from pathlib import Path
 
 import cv2 # type: ignore
@@ -13,40 +15,71 @@ from ultralytics import YOLO # type: ignore
 
 import subprocess
 
-def convert_to_avc1(input_path, output_path):
-    """Re-encode video with ffmpeg to ensure browser-compatible AVC1 codec."""
+import risk_engine
+from metrics import JobTracer, QUEUE_DEPTH
+from risk_engine import CLASS_WEIGHT
+from telemetry import Telemetry
+from video_decoder import open_decoder
+from event_clips import extract_event_clips
+from batching import AdaptiveBatcher
+from cascade import CascadeDetector
+from vocab_cache import apply_vocabulary, is_world_model
+from frame_pool import BUDGET, FramePool, frame_bytes
+from checkpoint import SEGMENT_DIR, Checkpointer, SegmentWriter, input_signature, restore_state
+from detection_log import LOG_DIR, DetectionLogWriter
+from calibration import get_camera, get_lut
+
+def convert_to_avc1(input_path, output_path, keyint=None):
+    """
+    Re-encode video with ffmpeg to ensure browser-compatible AVC1 codec.
+    `keyint` caps the GOP length (frames), which keeps stream-copied event clips tight.
+    """
+    gop = ["-g", str(int(keyint))] if keyint else []
     subprocess.run([
         "ffmpeg", "-y", "-i", str(input_path),
-        "-c:v", "libx264", "-preset", "fast", "-crf", "23",
-        "-pix_fmt", "yuv420p",
+        "-c:v", "libx264", "-preset", "fast", "-crf", "23", *gop,
+        "-pix_fmt", "yuv420p", "-movflags", "+faststart",
         str(output_path)
     ], check=True)
 
 # ---------------- CONFIG ----------------
 MODEL_PATH = r"C:\Users\SAPTARSHI MONDAL\SnakeGame\Model\yolov8m-worldv2.pt"
+# optional screening model for the detection cascade (e.g. "yolov8n.pt" or an INT8
+# export from cascade.export_int8); None sends every frame to MODEL_PATH
+SCREEN_MODEL_PATH = None
+SCREEN_CONF = 0.15
 OUT_DIR = "outputs"
 os.makedirs(OUT_DIR, exist_ok=True)
 
 # performance
 FRAME_SKIP = 2
-BATCH_SIZE = 6
+BATCH_SIZE = 6            # starting batch size; AdaptiveBatcher retunes it per job
+MAX_BATCH_SIZE = 16
+LATENCY_BUDGET_S = 0.5    # first frame of a batch -> its detections
+CHECKPOINT_INTERVAL_S = 120.0  # wall-clock seconds between checkpoints (None disables them)
+DETECTION_LOG = False     # opt in per job to keep raw detections in out_dir/detections for rescore.py
 IMG_SIZE = 640
 FORGET_FRAMES = 12
-
-# braking / risk (used in scoring/decision)
-K_CALIB = 4200.0
-REACTION_TIME = 1.0
-DECEL = 1.2
-WARNING_DIST = 150.0
+CLIP_KEYFRAME_S = 2.0     # keyframe spacing of the annotated video (event clips start on one)
+DECODE_BACKEND = "auto"   # video_decoder backend: auto | pyav | ffmpeg | opencv
+DECODE_MAX_SIDE = None    # e.g. 1280 to decode 4K input straight to 720p-class frames
+
+# braking / risk: reaction time, deceleration and warning distance live in the
+# risk_engine.ROLLING_STOCK profiles (shared with the track-fault service)
+K_CALIB = 4200.0          # distance = K_CALIB / bbox height, used when no camera profile is set
+CAMERA = None             # calibration.CAMERA_PROFILES name: per-camera, per-class distance tables
 BRAKE_DIST = 60.0
 PERSISTENCE_FRAMES = 3
-
-CLASS_WEIGHT = {
-    "person": 1.0, "car": 0.9, "truck": 1.1, "motorcycle": 0.95, "bicycle": 0.95,
-    "cow": 1.2, "buffalo": 1.2, "dog": 1.1, "sheep": 1.15, "goat": 1.15,
-    "elephant": 1.3, "train": 2.0, "animal": 1.3
-}
-WHITELIST_CLASSES = set(CLASS_WEIGHT.keys())
+ROLLING_STOCK = "default"
+
+# open-vocabulary prompt for YOLO-World weights; a deployment can override it with a
+# comma-separated TRACKGUARD_VOCAB (embeddings are cached per vocabulary, see vocab_cache)
+VOCABULARY = tuple(c.strip() for c in os.environ.get("TRACKGUARD_VOCAB", "").split(",") if c.strip()) \
+    or tuple(CLASS_WEIGHT.keys())
+# risk weight per accepted class: CLASS_WEIGHT plus the deployment vocabulary's own
+# classes (weight 1.0), so everything the model is prompted for passes the whitelist
+ACTIVE_CLASS_WEIGHT = {**{c.lower(): 1.0 for c in VOCABULARY}, **CLASS_WEIGHT}
+WHITELIST_CLASSES = set(ACTIVE_CLASS_WEIGHT)
 IGNORED_CLASSES = {"traffic light", "chair", "bottle", "banana"}
 MIN_CONF_DEFAULT = 0.40
 MIN_BBOX_HEIGHT_PX = 30
@@ -63,38 +96,59 @@ TRAIN_ROUTE = [
 def get_gps_from_route(frame_count):
     return TRAIN_ROUTE[frame_count % len(TRAIN_ROUTE)]
 
+def frame_navigation(frame_indices, fps, sim_speed, telemetry=None):
+    """
+    Speed (km/h) and (lat, lon) for a batch of 1-based frame numbers.
+    With a Telemetry log both are interpolated at the frames' timestamps in one call;
+    fields the log lacks fall back to `sim_speed` / the simulated route.
+    """
+    speeds = [float(sim_speed)] * len(frame_indices)
+    gps = [get_gps_from_route(i) for i in frame_indices]
+    if telemetry is not None and frame_indices:
+        nav = telemetry.sample((np.asarray(frame_indices, dtype=np.float64) - 1.0) / fps)
+        if nav["speed_kmph"] is not None:
+            speeds = nav["speed_kmph"].tolist()
+        if nav["lat"] is not None:
+            gps = list(zip(nav["lat"].tolist(), nav["lon"].tolist()))
+    return speeds, gps
+
 # ---------------- load model once ----------------
 # (Ultralytics will auto-download if model path is a known name, but we use local path)
-model = YOLO(MODEL_PATH)
+model = None
+
+def load_model(path=MODEL_PATH, vocabulary=VOCABULARY):
+    """
+    Load the YOLO model on first use and reuse it for every later call.
+    YOLO-World weights are restricted to `vocabulary` so the model only proposes rail classes.
+    """
+    global model
+    if model is None:
+        m = YOLO(path)
+        if vocabulary and is_world_model(path):
+            apply_vocabulary(m, vocabulary, path)
+        model = m
+    return model
+
+screen_model = None
+
+def load_detector(screen_path=SCREEN_MODEL_PATH):
+    """The shared model, behind a screening cascade when a screening model is configured."""
+    global screen_model
+    if not screen_path:
+        return load_model()
+    if screen_model is None:
+        screen_model = CascadeDetector(YOLO(screen_path), load_model(), has_candidates, SCREEN_CONF)
+    return screen_model
 
 # ---------------- helpers ----------------
+def estimate_distances(bboxes, k_calib=K_CALIB, min_cap=2.0, max_cap=300.0):
+    """Distance (m) for an (N, 4) array of xyxy boxes from their pixel heights."""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    h = np.maximum(1.0, bboxes[:, 3] - bboxes[:, 1])
+    return np.clip(k_calib / h, min_cap, max_cap)
+
 def estimate_distance_from_bbox(bbox, k_calib=K_CALIB, min_cap=2.0, max_cap=300.0):
-    x1, y1, x2, y2 = bbox
-    h = max(1.0, (y2 - y1))
-    d = k_calib / h
-    return float(np.clip(d, min_cap, max_cap))
-
-def stopping_distance(speed_kmph):
-    v = speed_kmph / 3.6
-    return v * REACTION_TIME + (v ** 2) / (2 * DECEL)
-
-def risk_score(distance, conf, cls, speed_kmph):
-    d_norm = np.clip(1.0 - (distance / 500.0), 0.0, 1.0)
-    c_norm = np.clip(conf, 0.0, 1.0)
-    s_norm = np.clip(speed_kmph / 200.0, 0.0, 1.0)
-    cw = CLASS_WEIGHT.get(cls, 1.0)
-    score = (0.6 * d_norm + 0.25 * c_norm + 0.15 * s_norm) * 100.0 * cw
-    return float(np.clip(score, 0, 100))
-
-def ai_decision(distance, ttc, speed_kmph, cls=None):
-    safe_stop = stopping_distance(speed_kmph)
-    if distance <= safe_stop * 0.8 or ttc <= 5:
-        return "BRAKE_EMERGENCY"
-    elif distance <= safe_stop * 1.5:
-        return "SLOW_DOWN"
-    elif distance <= WARNING_DIST:
-        return "CAUTION"
-    return "CLEAR"
+    return float(estimate_distances([bbox], k_calib, min_cap, max_cap)[0])
 
 def center_of_bbox(bbox):
     x1, y1, x2, y2 = bbox
@@ -104,24 +158,34 @@ def bbox_area(bbox):
     x1, y1, x2, y2 = bbox
     return max(0, x2 - x1) * max(0, y2 - y1)
 
-def is_in_rail_roi(bbox, frame_shape):
+def is_in_rail_roi(bbox, frame_shape, x_ratio=ROI_CENTER_X_RATIO, min_bottom_ratio=ROI_MIN_BOTTOM_RATIO):
     h, w = frame_shape[:2]
     cx, _ = center_of_bbox(bbox)
-    if not (ROI_CENTER_X_RATIO[0] * w <= cx <= ROI_CENTER_X_RATIO[1] * w):
+    if not (x_ratio[0] * w <= cx <= x_ratio[1] * w):
         return False
     _, _, _, y2 = bbox
-    if (y2 / h) < ROI_MIN_BOTTOM_RATIO:
+    if (y2 / h) < min_bottom_ratio:
         return False
     return True
 
+def scoring_params(k_calib=K_CALIB, class_weight=None, roi_x=ROI_CENTER_X_RATIO,
+                   roi_min_bottom=ROI_MIN_BOTTOM_RATIO, min_conf=MIN_CONF_DEFAULT):
+    """
+    Thresholds used by filtering and scoring, kept in the per-video state so a
+    re-scoring run (rescore.py) can override them; the whitelist is the class_weight keys
+    (ACTIVE_CLASS_WEIGHT by default).
+    """
+    return {"k_calib": float(k_calib), "class_weight": dict(ACTIVE_CLASS_WEIGHT if class_weight is None else class_weight),
+            "roi_x": tuple(roi_x), "roi_min_bottom": float(roi_min_bottom), "min_conf": float(min_conf)}
+
 # ---------------- HUD drawing ----------------
-def draw_hud(frame, speed_kmph, overall_decision, overall_risk, thumbnails):
+def draw_hud(frame, speed_kmph, overall_decision, overall_risk, thumbnails, thumb_total=None):
+    """Draw the HUD onto `frame` in place. `thumb_total` numbers the thumbnails (default len(thumbnails))."""
     h, w = frame.shape[:2]
-    # translucent panel on top
-    overlay = frame.copy()
-    cv2.rectangle(overlay, (0,0), (w,110), (10,10,10), -1)
+    # translucent panel on top: blend the panel rows with (10,10,10) in place (no full-frame overlay copy)
     alpha = 0.45
-    cv2.addWeighted(overlay, alpha, frame, 1-alpha, 0, frame)
+    panel = frame[:min(h, 111)]
+    cv2.addWeighted(panel, 1-alpha, panel, 0, alpha*10, dst=panel)
 
     # title
     cv2.putText(frame, "TrackGuard HUD", (12, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
@@ -158,6 +222,7 @@ def draw_hud(frame, speed_kmph, overall_decision, overall_risk, thumbnails):
 
     # Thumbnails
     thumb_x = w - 160; thumb_y = 120; thumb_w = 140; thumb_h = 80; spacing = 8
+    total = len(thumbnails) if thumb_total is None else thumb_total
     for i, img in enumerate(thumbnails[-5:]):
         try:
             th = cv2.resize(img, (thumb_w, thumb_h))
@@ -167,262 +232,194 @@ def draw_hud(frame, speed_kmph, overall_decision, overall_risk, thumbnails):
         if ty + thumb_h > h - 10: break
         frame[ty:ty+thumb_h, thumb_x:thumb_x+thumb_w] = th
         cv2.rectangle(frame, (thumb_x, ty), (thumb_x+thumb_w, ty+thumb_h), (200,200,200), 2)
-        cv2.putText(frame, f"#{len(thumbnails)-len(thumbnails[-5:])+i+1}", (thumb_x+6, ty+18), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 1)
+        cv2.putText(frame, f"#{total-len(thumbnails[-5:])+i+1}", (thumb_x+6, ty+18), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 1)
 
     return frame
 
-# ---------------- Main pipeline (exposed) ----------------
-def run_inference(input_path: str, sim_speed: float = 80.0, device: str = "cpu") -> dict:
+# ---------------- per-frame processing ----------------
+def has_candidates(r, min_conf=SCREEN_CONF):
+    """Cascade escalation test: any whitelisted detection whose box lies in the rail ROI."""
+    if getattr(r, "boxes", None) is None or len(r.boxes) == 0:
+        return False
+    h, w = r.orig_shape[:2]
+    names = r.names
+    xyxy = r.boxes.xyxy.cpu().numpy()
+    cls_ids = r.boxes.cls.cpu().numpy().astype(int)
+    confs = r.boxes.conf.cpu().numpy()
+    for box, cid, conf in zip(xyxy, cls_ids, confs):
+        cls_name = names.get(int(cid), str(cid)).lower()
+        if conf >= min_conf and cls_name in WHITELIST_CLASSES and is_in_rail_roi(box, (h, w)):
+            return True
+    return False
+
+def raw_detections(r):
+    """(xyxy in IMG_SIZE model coords as float32 (N, 4), lower-case class names, confs) of one YOLO result."""
+    if getattr(r, "boxes", None) is None or len(r.boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float32), [], np.zeros(0, dtype=np.float32)
+    names = r.names
+    cls_ids = r.boxes.cls.cpu().numpy().astype(int)
+    return (r.boxes.xyxy.cpu().numpy().astype(np.float32), [names.get(int(c), str(c)).lower() for c in cls_ids],
+            r.boxes.conf.cpu().numpy().astype(np.float32))
+
+def filter_detections(r, frame_shape, frame_idx, persistence, px_scale=1.0, params=None):
+    """Class/confidence/size/ROI filtering plus persistence for one YOLO result (see filter_boxes)."""
+    xyxy, cls_names, confs = raw_detections(r)
+    return filter_boxes(xyxy, cls_names, confs, frame_shape, frame_idx, persistence, px_scale, params)
+
+def filter_boxes(xyxy, cls_names, confs, frame_shape, frame_idx, persistence, px_scale=1.0, params=None):
     """
-    Run the full TrackGuard pipeline on a video file.
-    Returns dict with sessionized paths: video, csv, map, snaps_dir
+    Class/confidence/size/ROI filtering plus persistence for one frame's raw detections
+    (boxes in IMG_SIZE model coords; returned boxes are in frame coords).
+    `px_scale` is frame pixels per source pixel, so size limits hold for downscaled decodes.
+    `params` are the scoring_params() thresholds (module defaults when None).
     """
-    out_video = f"{OUT_DIR}/output.mp4"
-    out_csv = f"{OUT_DIR}/alerts.csv"
-    out_map = f"{OUT_DIR}/map.html"
-    snaps_dir = f"{OUT_DIR}/snaps"
-    os.makedirs(snaps_dir, exist_ok=True)
-
-    # Video reader/writer setup
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        raise RuntimeError(f"Cannot open input {input_path}")
-
-    out_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    out_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    out_fps = max(10, int(cap.get(cv2.CAP_PROP_FPS) or 20))
-    writer = cv2.VideoWriter(out_video, cv2.VideoWriter_fourcc(*"avc1"), out_fps, (out_w, out_h))
+    params = params or scoring_params()
+    whitelist = params["class_weight"]
+    filtered_dets = []
+    scale_x = frame_shape[1] / IMG_SIZE
+    scale_y = frame_shape[0] / IMG_SIZE
+
+    for box, cls_name, conf in zip(xyxy, cls_names, confs):
+        if cls_name in IGNORED_CLASSES:
+            continue
+        if cls_name not in whitelist:
+            continue
+        if conf < params["min_conf"]:
+            continue
 
-    alerts = []
-    persistence = {}   # (cls, gx, gy) -> {count, last_frame}
-    RECENT_THUMBNAILS = []
+        x1, y1, x2, y2 = box
+        x1 *= scale_x; x2 *= scale_x; y1 *= scale_y; y2 *= scale_y
+        bbox = [x1, y1, x2, y2]
 
-    batch_frames = []
-    batch_orig = []
-    frame_count = 0
-    start_t = time.time()
+        if (y2 - y1) < MIN_BBOX_HEIGHT_PX * px_scale or bbox_area(bbox) < MIN_BBOX_AREA_PX * px_scale**2:
+            continue
+        if not is_in_rail_roi(bbox, frame_shape, params["roi_x"], params["roi_min_bottom"]):
+            continue
 
-    try:
-        while True:
-            ok, frame = cap.read()
-            if not ok:
-                break
-            frame_count += 1
-            if frame_count % FRAME_SKIP != 0:
-                continue
+        gx = int(center_of_bbox(bbox)[0] // (20 * px_scale))
+        gy = int(center_of_bbox(bbox)[1] // (20 * px_scale))
+        key = (cls_name, gx, gy)
+        st = persistence.get(key, {"count":0, "last":0})
+        # forget stale
+        if frame_idx - st["last"] > FORGET_FRAMES:
+            st = {"count":0, "last":0}
 
-            orig = frame.copy()
-            h, w = orig.shape[:2]
-            resized = cv2.resize(orig, (IMG_SIZE, IMG_SIZE))
-            batch_frames.append(resized)
-            batch_orig.append(orig)
-
-            # When batch ready or at end
-            if len(batch_frames) >= BATCH_SIZE:
-                results = model.predict(batch_frames, imgsz=IMG_SIZE, conf=0.30, verbose=False, device=device)
-                for idx, r in enumerate(results):
-                    frame_orig = batch_orig[idx]
-                    scale_x = frame_orig.shape[1] / IMG_SIZE
-                    scale_y = frame_orig.shape[0] / IMG_SIZE
-
-                    filtered_dets = []
-                    if getattr(r, "boxes", None) is not None and len(r.boxes) > 0:
-                        xyxy = r.boxes.xyxy.cpu().numpy()
-                        cls_ids = r.boxes.cls.cpu().numpy().astype(int)
-                        confs = r.boxes.conf.cpu().numpy()
-                        names = r.names
-
-                        for box, cid, conf in zip(xyxy, cls_ids, confs):
-                            cls_name = names.get(int(cid), str(cid)).lower()
-                            if cls_name in IGNORED_CLASSES:
-                                continue
-                            if cls_name not in WHITELIST_CLASSES:
-                                continue
-                            if conf < MIN_CONF_DEFAULT:
-                                continue
-
-                            x1, y1, x2, y2 = box
-                            x1 *= scale_x; x2 *= scale_x; y1 *= scale_y; y2 *= scale_y
-                            bbox = [x1, y1, x2, y2]
-
-                            if (y2 - y1) < MIN_BBOX_HEIGHT_PX or bbox_area(bbox) < MIN_BBOX_AREA_PX:
-                                continue
-                            if not is_in_rail_roi(bbox, frame_orig.shape):
-                                continue
-
-                            gx = int(center_of_bbox(bbox)[0] // 20)
-                            gy = int(center_of_bbox(bbox)[1] // 20)
-                            key = (cls_name, gx, gy)
-                            st = persistence.get(key, {"count":0, "last":0})
-                            # forget stale
-                            if frame_count - st["last"] > FORGET_FRAMES:
-                                st = {"count":0, "last":0}
-
-                            st["count"] += 1
-                            st["last"] = frame_count
-                            persistence[key] = st
-
-                            if st["count"] >= PERSISTENCE_FRAMES:
-                                filtered_dets.append({"bbox": bbox, "cls": cls_name, "conf": float(conf)})
-
-                    # Draw + decisions for this frame
-                    draw_frame = frame_orig.copy()
-                    per_frame_risks = []
-                    per_frame_decisions = []
-                    for d in filtered_dets:
-                        dist = estimate_distance_from_bbox(d["bbox"])
-                        ttc = dist / max(0.1, sim_speed / 3.6)
-                        score = risk_score(dist, d["conf"], d["cls"], sim_speed)
-                        decision = ai_decision(dist, ttc, sim_speed, d["cls"])
-
-                        x1, y1, x2, y2 = map(int, d["bbox"])
-                        color = (0,255,0) if decision=="CLEAR" else (0,165,255) if decision in ["SLOW_DOWN","CAUTION"] else (0,0,255)
-                        cv2.rectangle(draw_frame, (x1,y1), (x2,y2), color, 2)
-                        cv2.putText(draw_frame, f"{d['cls']} {d['conf']:.2f} {decision}", (x1, max(20,y1-5)),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-
-                        if decision != "CLEAR":
-                            # save crop and thumbnail
-                            crop = frame_orig[max(0,y1):min(frame_orig.shape[0],y2), max(0,x1):min(frame_orig.shape[1],x2)]
-                            if crop.size > 0:
-                                crop_name = f"{snaps_dir}/{frame_count}_{d['cls']}_{uuid.uuid4().hex[:6]}.jpg"
-                                cv2.imwrite(crop_name, crop)
-                                try:
-                                    thumb = cv2.resize(crop, (140, 80))
-                                    RECENT_THUMBNAILS.append(thumb)
-                                except Exception:
-                                    pass
-
-                            alerts.append({
-                                "time_s": round(time.time()-start_t,2),
-                                "frame": frame_count,
-                                "label": d["cls"],
-                                "conf": round(d["conf"],2),
-                                "distance_m": round(dist,1),
-                                "ttc_s": round(ttc,1),
-                                "decision": decision,
-                                "risk_score": round(score,1),
-                                "lat": get_gps_from_route(frame_count)[0],
-                                "lon": get_gps_from_route(frame_count)[1],
-                            })
-
-                        per_frame_risks.append(score)
-                        per_frame_decisions.append(decision)
-
-                    # overall frame-level decision (worst-case)
-                    if not per_frame_risks:
-                        overall_risk = 0.0
-                        overall_decision = "CLEAR"
-                    else:
-                        overall_risk = float(np.clip(max(per_frame_risks), 0, 100))
-                        if any(d == "BRAKE_EMERGENCY" for d in per_frame_decisions):
-                            overall_decision = "BRAKE_EMERGENCY"
-                        elif any(d == "SLOW_DOWN" for d in per_frame_decisions):
-                            overall_decision = "SLOW_DOWN"
-                        elif any(d == "CAUTION" for d in per_frame_decisions):
-                            overall_decision = "CAUTION"
-                        else:
-                            overall_decision = "CLEAR"
-
-                    # draw HUD (uses RECENT_THUMBNAILS)
-                    hud_frame = draw_hud(draw_frame, sim_speed, overall_decision, overall_risk, RECENT_THUMBNAILS)
-                    writer.write(hud_frame)
-
-                # clear batch
-                batch_frames.clear()
-                batch_orig.clear()
-
-        # end while
-    finally:
-        cap.release()
-        writer.release()
+        st["count"] += 1
+        st["last"] = frame_idx
+        persistence[key] = st
 
-    # handle any leftover frames in batch (if any)
-    if batch_frames:
-        results = model.predict(batch_frames, imgsz=IMG_SIZE, conf=0.30, verbose=False, device=device)
-        for idx, r in enumerate(results):
-            frame_orig = batch_orig[idx]
-            scale_x = frame_orig.shape[1] / IMG_SIZE
-            scale_y = frame_orig.shape[0] / IMG_SIZE
-
-            filtered_dets = []
-            if getattr(r, "boxes", None) is not None and len(r.boxes) > 0:
-                xyxy = r.boxes.xyxy.cpu().numpy()
-                cls_ids = r.boxes.cls.cpu().numpy().astype(int)
-                confs = r.boxes.conf.cpu().numpy()
-                names = r.names
-
-                for box, cid, conf in zip(xyxy, cls_ids, confs):
-                    cls_name = names.get(int(cid), str(cid)).lower()
-                    if cls_name in IGNORED_CLASSES: continue
-                    if cls_name not in WHITELIST_CLASSES: continue
-                    if conf < MIN_CONF_DEFAULT: continue
-
-                    x1, y1, x2, y2 = box
-                    x1 *= scale_x; x2 *= scale_x; y1 *= scale_y; y2 *= scale_y
-                    bbox = [x1, y1, x2, y2]
-                    if (y2 - y1) < MIN_BBOX_HEIGHT_PX or bbox_area(bbox) < MIN_BBOX_AREA_PX: continue
-                    if not is_in_rail_roi(bbox, frame_orig.shape): continue
-
-                    gx = int(center_of_bbox(bbox)[0] // 20)
-                    gy = int(center_of_bbox(bbox)[1] // 20)
-                    key = (cls_name, gx, gy)
-                    st = persistence.get(key, {"count":0, "last":0})
-                    if frame_count - st["last"] > FORGET_FRAMES:
-                        st = {"count":0, "last":0}
-                    st["count"] += 1
-                    st["last"] = frame_count
-                    persistence[key] = st
-                    if st["count"] >= PERSISTENCE_FRAMES:
-                        filtered_dets.append({"bbox": bbox, "cls": cls_name, "conf": float(conf)})
-
-            # draw and write similar to above (simplified)
-            draw_frame = frame_orig.copy()
-            per_frame_risks = []; per_frame_decisions = []
-            for d in filtered_dets:
-                dist = estimate_distance_from_bbox(d["bbox"])
-                ttc = dist / max(0.1, sim_speed / 3.6)
-                score = risk_score(dist, d["conf"], d["cls"], sim_speed)
-                decision = ai_decision(dist, ttc, sim_speed, d["cls"])
-                x1,y1,x2,y2 = map(int, d["bbox"])
-                color = (0,255,0) if decision=="CLEAR" else (0,165,255) if decision in ["SLOW_DOWN","CAUTION"] else (0,0,255)
-                cv2.rectangle(draw_frame, (x1,y1), (x2,y2), color, 2)
-                cv2.putText(draw_frame, f"{d['cls']} {d['conf']:.2f} {decision}", (x1, max(20,y1-5)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-                if decision != "CLEAR":
-                    crop = frame_orig[max(0,y1):min(frame_orig.shape[0],y2), max(0,x1):min(frame_orig.shape[1],x2)]
-                    if crop.size > 0:
-                        crop_name = f"{snaps_dir}/{frame_count}_{d['cls']}_{uuid.uuid4().hex[:6]}.jpg"
-                        cv2.imwrite(crop_name, crop)
-                        try:
-                            RECENT_THUMBNAILS.append(cv2.resize(crop, (140,80)))
-                        except Exception:
-                            pass
-                    alerts.append({
-                        "time_s": round(time.time()-start_t,2),
-                        "frame": frame_count,
-                        "label": d["cls"],
-                        "conf": round(d["conf"],2),
-                        "distance_m": round(dist,1),
-                        "ttc_s": round(ttc,1),
-                        "decision": decision,
-                        "risk_score": round(score,1),
-                        "lat": get_gps_from_route(frame_count)[0],
-                        "lon": get_gps_from_route(frame_count)[1],
-                    })
-                per_frame_risks.append(score); per_frame_decisions.append(decision)
-
-            if not per_frame_risks:
-                overall_risk=0.0; overall_decision="CLEAR"
-            else:
-                overall_risk = float(np.clip(max(per_frame_risks),0,100))
-                if any(d=="BRAKE_EMERGENCY" for d in per_frame_decisions): overall_decision="BRAKE_EMERGENCY"
-                elif any(d=="SLOW_DOWN" for d in per_frame_decisions): overall_decision="SLOW_DOWN"
-                elif any(d=="CAUTION" for d in per_frame_decisions): overall_decision="CAUTION"
-                else: overall_decision="CLEAR"
-
-            hud_frame = draw_hud(draw_frame, sim_speed, overall_decision, overall_risk, RECENT_THUMBNAILS)
-            writer.write(hud_frame)
+        if st["count"] >= PERSISTENCE_FRAMES:
+            filtered_dets.append({"bbox": bbox, "cls": cls_name, "conf": float(conf)})
+    return filtered_dets
 
+def score_frame(filtered_dets, frame_idx, sim_speed, state, gps=None):
+    """
+    Distance, risk and decision for one frame's filtered detections; non-clear ones are
+    appended to state["alerts"]. Returns ([(det, decision, risk)], overall_risk, overall_decision).
+    """
+    px_scale = state.get("px_scale", 1.0)
+    params = state.get("scoring") or scoring_params()
+    boxes, classes = [d["bbox"] for d in filtered_dets], [d["cls"] for d in filtered_dets]
+    # score every detection of the frame in one vectorized pass: camera lookup tables when
+    # calibrated (built for the frame size), else K_CALIB (which is for source pixels)
+    lut = state.get("distance_lut")
+    dists = lut.distances(boxes, classes) if lut is not None else estimate_distances(boxes, params["k_calib"] * px_scale)
+    risks, codes, ttcs = risk_engine.score_detections(
+        dists, [d["conf"] for d in filtered_dets], classes,
+        sim_speed, state.get("rolling_stock", ROLLING_STOCK), params["class_weight"])
+    scored = []
+    for d, dist, ttc, score, code in zip(filtered_dets, dists, ttcs, risks, codes):
+        decision = risk_engine.DECISIONS[code]
+        scored.append((d, decision, score))
+
+        if decision != "CLEAR":
+            lat, lon = gps if gps is not None else get_gps_from_route(frame_idx)
+            state["alerts"].append({
+                "time_s": round(time.time()-state["start_t"],2),
+                "frame": frame_idx,
+                "pts_s": round((frame_idx - 1) / state.get("fps", 30.0), 3),
+                "video_t_s": round(state.get("written", 0) / state.get("out_fps", 30.0), 3),
+                "speed_kmph": round(float(sim_speed),1),
+                "label": d["cls"],
+                "conf": round(d["conf"],2),
+                "distance_m": round(float(dist),1),
+                "ttc_s": round(float(ttc),1),
+                "decision": decision,
+                "risk_score": round(float(score),1),
+                "lat": lat,
+                "lon": lon,
+            })
+
+    # overall frame-level decision (worst-case)
+    overall_risk, overall_decision = risk_engine.overall(risks, codes)
+    return scored, overall_risk, overall_decision
+
+def process_result(r, frame_orig, frame_idx, sim_speed, state, snaps_dir, tracer, gps=None, det_log=None):
+    """
+    Score one frame's detections, record alerts/snapshots into `state`
+    (persistence, alerts, thumbnails, start_t, rolling_stock, fps, px_scale, scoring) and return the
+    annotated HUD frame.
+    `sim_speed` and `gps` are the train's speed and (lat, lon) at this frame (see frame_navigation).
+    The frame's raw detections are also appended to `det_log` (a detection_log.DetectionLogWriter).
+    The HUD is drawn into `frame_orig` itself, which is also what is returned.
+    """
+    with tracer.stage("postprocess", frame_idx):
+        xyxy, cls_names, confs = raw_detections(r)
+        if det_log is not None:
+            det_log.append(frame_idx, state.get("written", 0), sim_speed,
+                           gps if gps is not None else get_gps_from_route(frame_idx), xyxy, cls_names, confs)
+        filtered_dets = filter_boxes(xyxy, cls_names, confs, frame_orig.shape, frame_idx, state["persistence"],
+                                     state.get("px_scale", 1.0), state.get("scoring"))
+        scored, overall_risk, overall_decision = score_frame(filtered_dets, frame_idx, sim_speed, state, gps)
+
+    # save crop and thumbnail for every non-clear detection
+    with tracer.stage("imwrite", frame_idx):
+        for d, decision, _ in scored:
+            if decision == "CLEAR":
+                continue
+            x1, y1, x2, y2 = map(int, d["bbox"])
+            crop = frame_orig[max(0,y1):min(frame_orig.shape[0],y2), max(0,x1):min(frame_orig.shape[1],x2)]
+            if crop.size > 0:
+                crop_name = f"{snaps_dir}/{frame_idx}_{d['cls']}_{uuid.uuid4().hex[:6]}.jpg"
+                cv2.imwrite(crop_name, crop)
+                try:
+                    state["thumbnails"].append(cv2.resize(crop, (140, 80)))
+                    state["thumb_count"] = state.get("thumb_count", 0) + 1
+                    del state["thumbnails"][:-5]  # the HUD shows the last 5; keep memory flat
+                except Exception:
+                    pass
+
+    # Draw boxes + HUD (uses the recent thumbnails) straight onto the frame; crops were taken above
+    with tracer.stage("hud", frame_idx):
+        draw_frame = frame_orig
+        for d, decision, _ in scored:
+            x1, y1, x2, y2 = map(int, d["bbox"])
+            color = (0,255,0) if decision=="CLEAR" else (0,165,255) if decision in ["SLOW_DOWN","CAUTION"] else (0,0,255)
+            cv2.rectangle(draw_frame, (x1,y1), (x2,y2), color, 2)
+            cv2.putText(draw_frame, f"{d['cls']} {d['conf']:.2f} {decision}", (x1, max(20,y1-5)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+        return draw_hud(draw_frame, sim_speed, overall_decision, overall_risk, state["thumbnails"],
+                        state.get("thumb_count"))
+
+# ---------------- job setup / artifacts ----------------
+def new_state(source, rolling_stock=ROLLING_STOCK, camera=CAMERA):
+    """
+    Per-video state for process_result; `source` is the video_decoder the frames come from.
+    `camera` is a calibration profile (name or dict); None estimates distances from K_CALIB.
+    """
+    # persistence: (cls, gx, gy) -> {count, last_frame}
+    return {"persistence": {}, "alerts": [], "thumbnails": [], "start_t": time.time(),
+            "rolling_stock": risk_engine.get_profile(rolling_stock), "fps": source.fps,
+            "px_scale": source.scale, "out_fps": max(10, int(source.fps)), "written": 0,
+            "scoring": scoring_params(),
+            "distance_lut": get_lut(camera, (source.height, source.width)) if camera else None}
+
+def write_artifacts(state, out_dir, out_video, tracer, telemetry=None):
+    """Alerts CSV, map, browser-playable video and event clips for a finished video."""
+    out_csv = f"{out_dir}/alerts.csv"
+    out_map = f"{out_dir}/map.html"
+    alerts = state["alerts"]
+    with tracer.stage("report"):
         # Save CSV
         if alerts:
             pd.DataFrame(alerts).to_csv(out_csv, index=False)
@@ -430,7 +427,11 @@ def run_inference(input_path: str, sim_speed: float = 80.0, device: str = "cpu")
             pd.DataFrame([{"frame":0, "event":"No issues"}]).to_csv(out_csv, index=False)
 
         # Save map with markers
-        m = folium.Map(location=TRAIN_ROUTE[0], zoom_start=14)
+        start = TRAIN_ROUTE[0]
+        if telemetry is not None and telemetry.has_position:
+            lat0, lon0, _ = telemetry.at(0.0)
+            start = (lat0, lon0)
+        m = folium.Map(location=start, zoom_start=14)
         for a in alerts:
             color = "red" if "BRAKE" in a["decision"] else ("orange" if a["decision"]=="SLOW_DOWN" else "green")
             folium.Marker([a["lat"], a["lon"]],
@@ -438,11 +439,232 @@ def run_inference(input_path: str, sim_speed: float = 80.0, device: str = "cpu")
                           icon=folium.Icon(color=color)).add_to(m)
         m.save(out_map)
 
-        # 🔧 Convert video for browser playback
-        final_video = f"{OUT_DIR}/output_avc1.mp4"
-        convert_to_avc1(out_video, final_video)
+    # 🔧 Convert video for browser playback
+    final_video = f"{out_dir}/output_avc1.mp4"
+    with tracer.stage("reencode"):
+        convert_to_avc1(out_video, final_video, keyint=state["out_fps"] * CLIP_KEYFRAME_S)
+
+    # short review clips around SLOW_DOWN / BRAKE_EMERGENCY alerts, cut from the annotated video
+    clips_dir = f"{out_dir}/clips"
+    with tracer.stage("clips"):
+        extract_event_clips(final_video, alerts, clips_dir, time_key="video_t_s")
+
+    return {"video": final_video, "csv": out_csv, "map": out_map, "snaps": f"{out_dir}/snaps", "clips": clips_dir}
 
-        return {"video": final_video, "csv": out_csv, "map": out_map, "snaps": snaps_dir}
+# ---------------- Main pipeline (exposed) ----------------
+def run_inference(input_path: str, sim_speed: float = 80.0, device: str = "cpu",
+                  out_dir: str = OUT_DIR, detector=None, trace_path: str = None, tracer=None,
+                  rolling_stock=ROLLING_STOCK, telemetry=None, decoder=DECODE_BACKEND,
+                  max_side=DECODE_MAX_SIDE, start_s=0.0, latency_budget_s=LATENCY_BUDGET_S,
+                  batch_size=BATCH_SIZE, checkpoint_interval_s=CHECKPOINT_INTERVAL_S,
+                  resume=True, detection_log=DETECTION_LOG, camera=CAMERA) -> dict:
+    """
+    Run the full TrackGuard pipeline on a video file.
+    `detector` is anything with a YOLO-style predict() (defaults to the shared model, or the
+    screening cascade when SCREEN_MODEL_PATH is set).
+    `rolling_stock` names a risk_engine.ROLLING_STOCK braking profile (or is a dict of overrides).
+    `camera` names a calibration.CAMERA_PROFILES profile for distance estimation (default K_CALIB).
+    `telemetry` is a telemetry.Telemetry (or a CSV/NMEA log path) giving the real speed and
+    position per frame; without it `sim_speed` and the simulated route are used.
+    `decoder` picks the video_decoder backend; `max_side` decodes (and writes) frames scaled
+    down to that long side, and `start_s` seeks before the first frame.
+    Batches start at `batch_size` frames and are resized to fit `latency_budget_s`
+    (see batching.AdaptiveBatcher).
+    Every `checkpoint_interval_s` progress is checkpointed to out_dir; with `resume` a job
+    restarted on the same input and settings continues from its last checkpoint.
+    With `detection_log` the raw detections are kept for offline re-scoring (see rescore.py).
+    Stage timings go to the /metrics histograms; `trace_path` additionally writes a
+    per-job JSON-lines trace (or pass a ready-made metrics.JobTracer as `tracer`).
+    Returns dict with sessionized paths: video, csv, map, snaps_dir, clips (dir with index.json)
+    and detections (the detection log dir, when enabled)
+    """
+    detector = detector if detector is not None else load_detector()
+    tracer = tracer if tracer is not None else JobTracer(uuid.uuid4().hex[:8], "obstacle", trace_path=trace_path)
+    out_video = f"{out_dir}/output.mp4"
+    snaps_dir = f"{out_dir}/snaps"
+    os.makedirs(snaps_dir, exist_ok=True)
+
+    # Video reader/writer setup
+    source = open_decoder(input_path, backend=decoder, max_side=max_side)
+    src_fps = source.fps
+    state = new_state(source, rolling_stock, camera)
+
+    if telemetry is not None and not isinstance(telemetry, Telemetry):
+        telemetry = Telemetry.from_file(telemetry)
+
+    # checkpoints: the annotated video is written in segments, closed at every checkpoint
+    signature = input_signature(
+        input_path, sim_speed=sim_speed, rolling_stock=rolling_stock, max_side=max_side, start_s=start_s,
+        frame_skip=FRAME_SKIP, detection_log=bool(detection_log), camera=camera,
+        telemetry=None if telemetry is None else [float(telemetry.t[0]), len(telemetry.t), telemetry.offset_s])
+    checkpointer = Checkpointer(out_dir, signature, checkpoint_interval_s)
+    saved = checkpointer.load() if resume else None
+    seg_dir = f"{out_dir}/{SEGMENT_DIR}"
+    last_frame = 0
+    if saved is not None:
+        restore_state(state, saved["state"])
+        last_frame = saved["last_frame"]
+        start_s = max(start_s, last_frame / src_fps)  # frame n is shown at (n - 1) / fps
+    writer = SegmentWriter(seg_dir, state["out_fps"], (source.width, source.height),
+                           segments=[f"{seg_dir}/{name}" for name in (saved or {}).get("segments", [])])
+    det_log = None
+    if detection_log:
+        det_log = DetectionLogWriter(
+            f"{out_dir}/{LOG_DIR}",
+            {"input": os.path.abspath(input_path), "fps": src_fps, "out_fps": state["out_fps"],
+             "px_scale": state["px_scale"], "frame_shape": [source.height, source.width], "img_size": IMG_SIZE,
+             "frame_skip": FRAME_SKIP, "rolling_stock": state["rolling_stock"],
+             "camera": get_camera(camera) if camera else None},
+            resume_frame=last_frame if saved is not None else None)
+
+    # frame memory: full-size + model-size buffers for one batch plus one frame in flight, all
+    # preallocated and reserved against the node-wide frame budget (waits if other jobs hold it)
+    full_shape, model_shape = (source.height, source.width, 3), (IMG_SIZE, IMG_SIZE, 3)
+    per_frame = frame_bytes(full_shape) + frame_bytes(model_shape)
+    max_batch = max(1, min(MAX_BATCH_SIZE, BUDGET.limit // per_frame - 1))
+    # both pools are reserved in one atomic call: a job never holds one pool's bytes while it
+    # waits for the other's, so concurrent jobs cannot deadlock on a part-used budget
+    reserved, held = (max_batch + 1) * per_frame, 0
+    try:
+        if BUDGET.limit < 2 * per_frame:  # one frame in the batch plus one in flight
+            raise MemoryError(
+                f"frame budget of {BUDGET.limit / 1024**2:.0f} MB is below the {2 * per_frame / 1024**2:.0f} MB "
+                f"needed for {source.width}x{source.height} frames; raise TRACKGUARD_FRAME_BUDGET_MB or decode "
+                f"with a smaller max_side")
+        BUDGET.reserve(reserved)
+        held = reserved
+        full_pool = FramePool(full_shape, max_batch + 1, budget=None)
+        model_pool = FramePool(model_shape, max_batch + 1, budget=None)
+    except BaseException:
+        BUDGET.release(held)
+        source.close()
+        writer.release()
+        if det_log is not None:
+            det_log.close()
+        raise
+    batcher = AdaptiveBatcher(latency_budget_s, max_size=max_batch, initial_size=min(batch_size, max_batch))
+
+    def run_batch(batch):
+        idxs = [idx for idx, _, _ in batch]
+        with tracer.stage("predict", idxs[-1]):
+            t0 = time.perf_counter()
+            results = detector.predict([resized for _, _, resized in batch], imgsz=IMG_SIZE, conf=0.30,
+                                       verbose=False, device=device)
+            batcher.record(len(batch), time.perf_counter() - t0)
+        speeds, gps = frame_navigation(idxs, src_fps, sim_speed, telemetry)
+        for r, (idx, frame_orig, _), speed, pos in zip(results, batch, speeds, gps):
+            hud_frame = process_result(r, frame_orig, idx, speed, state, snaps_dir, tracer, pos, det_log)
+            with tracer.stage("encode", idx):
+                writer.write(hud_frame)
+            state["written"] += 1
+            tracer.frame_done()
+
+    def release(batch):
+        for _, frame_orig, resized in batch:
+            full_pool.release(frame_orig)
+            model_pool.release(resized)
+
+    def run_and_release(batch):
+        try:
+            run_batch(batch)
+        finally:
+            release(batch)  # also on errors, so a reader waiting for a buffer can be stopped
+
+    def dispatch(batch):
+        run_and_release(batch)
+        if checkpointer.due():
+            with tracer.stage("checkpoint"):
+                if det_log is not None:
+                    det_log.flush()
+                checkpointer.save(batch[-1][0], state, writer)
+
+    # decoding runs on its own thread (held back by the frame pool) so that a stalled
+    # decoder cannot keep a partial batch past its latency budget: the loop below waits
+    # for frames at most batcher.wait_s() and then polls the batcher
+    decoded = queue.Queue()
+    stop = threading.Event()
+
+    def decode():
+        try:
+            # the decoder only hands over every FRAME_SKIP-th frame, already at output size
+            frames = source.frames(step=FRAME_SKIP, start_s=start_s, pool=full_pool)
+            while not stop.is_set():
+                # "decode" excludes time spent waiting for a free pool buffer (backpressure from
+                # inference), which is reported as "pool_wait"
+                waited, t0 = full_pool.wait_s, time.perf_counter()
+                item = next(frames, None)
+                waited = full_pool.wait_s - waited
+                tracer.record("decode", time.perf_counter() - t0 - waited, item[0] if item else None)
+                if waited:
+                    tracer.record("pool_wait", waited)
+                decoded.put(item)
+                if item is None:
+                    break
+        except BaseException as e:
+            decoded.put(e)
+
+    reader = threading.Thread(target=decode, name="decode", daemon=True)
+    with tracer:
+        try:
+            reader.start()
+            while True:
+                try:
+                    item = decoded.get(timeout=batcher.wait_s())
+                except queue.Empty:
+                    batch = batcher.poll()
+                    if batch:
+                        dispatch(batch)
+                    continue
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                frame_count, _, orig = item
+                if frame_count <= last_frame:  # already processed before the restart
+                    full_pool.release(orig)
+                    continue
+
+                with tracer.stage("resize", frame_count):
+                    resized = cv2.resize(orig, (IMG_SIZE, IMG_SIZE), dst=model_pool.acquire())
+                batch = batcher.add((frame_count, orig, resized))
+                QUEUE_DEPTH.set(len(batcher.items), queue="obstacle_batch")
+                if batch:
+                    dispatch(batch)
+
+            # end of stream: whatever is queued is just another partial batch
+            batch = batcher.flush()
+            if batch:
+                run_and_release(batch)
+        finally:
+            QUEUE_DEPTH.set(0, queue="obstacle_batch")
+            # stop the reader; handing back the frames still batched or queued unblocks it if it
+            # waits for a buffer
+            stop.set()
+            release(batcher.flush())
+            give_up = time.monotonic() + 5.0  # a decoder stuck in a read is cut off by source.close()
+            while reader.is_alive() and time.monotonic() < give_up:
+                try:
+                    item = decoded.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if isinstance(item, tuple):
+                    full_pool.release(item[2])
+            source.close()
+            writer.release()
+            full_pool.close()
+            model_pool.close()
+            BUDGET.release(reserved)
+            if det_log is not None:
+                det_log.close()
+
+        with tracer.stage("concat"):
+            writer.join(out_video)
+        paths = write_artifacts(state, out_dir, out_video, tracer, telemetry)
+        if det_log is not None:
+            paths["detections"] = det_log.finalize()
+        checkpointer.clear()
+
+    return paths
 
 # If you want to test this module standalone:
 if __name__ == "__main__":
@@ -452,4 +674,5 @@ if __name__ == "__main__":
         res = run_inference(demo_in, sim_speed=80.0, device="cpu")
         print("Done. Artifacts:", res)
     else:
-        print("No demo video found. Place a test_video.mp4 or call run_inference from your API.")
+        print("No demo video found. Place a test_video.mp4, call run_inference from your API "
+              "or run batch_cli.py on a directory of videos.")
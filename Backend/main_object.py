@@ -1,11 +1,16 @@
-from fastapi import FastAPI, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse, Response
 from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
+import json
 import shutil
-import mimetypes
 
 from inference import run_inference  # your inference function
+import metrics
+from file_serving import precompress, serve_file
+from risk_engine import ROLLING_STOCK
+from calibration import CAMERA_PROFILES
+from telemetry import Telemetry
 
 app = FastAPI(title="TrackGuard API", version="1.0")
 
@@ -16,35 +21,51 @@ OUT_DIR = BASE_DIR / "outputs"
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUT_DIR.mkdir(exist_ok=True)
 
-CHUNK_SIZE = 1024 * 1024  # 1MB
-STREAM_THRESHOLD = 10 * 1024 * 1024  # 10MB
-
-
-def iterfile(path: Path):
-    """Stream a file in chunks."""
-    with open(path, "rb") as f:
-        while chunk := f.read(CHUNK_SIZE):
-            yield chunk
-
-
 @app.post("/analyze")
-async def analyze_video(file: UploadFile, speed: float = Form(80.0)):
-    """Upload video -> run inference -> return artifact download URLs."""
+async def analyze_video(file: UploadFile, speed: float = Form(80.0), rolling_stock: str = Form("default"),
+                        telemetry: UploadFile = File(None), telemetry_offset: float = Form(0.0),
+                        camera: str = Form(None), detection_log: bool = Form(False)):
+    """
+    Upload video (+ optional CSV/NMEA telemetry log) -> run inference -> return artifact download URLs.
+    `telemetry_offset` is the telemetry time (s after its first sample) at which the video starts.
+    `camera` names the calibration profile of the camera that recorded the video.
+    `detection_log` keeps the raw detections for offline re-scoring (rescore.py).
+    """
+    if rolling_stock not in ROLLING_STOCK:
+        raise HTTPException(status_code=400, detail=f"Unknown rolling stock {rolling_stock!r}")
+    if camera and camera not in CAMERA_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown camera profile {camera!r}")
     dest = UPLOAD_DIR / Path(file.filename).name
 
     with open(dest, "wb") as out_f:
         shutil.copyfileobj(file.file, out_f)
 
+    log = None
+    if telemetry is not None and telemetry.filename:
+        log_path = UPLOAD_DIR / Path(telemetry.filename).name
+        with open(log_path, "wb") as out_f:
+            shutil.copyfileobj(telemetry.file, out_f)
+        try:
+            log = Telemetry.from_file(log_path, offset_s=telemetry_offset)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Bad telemetry log: {e}")
+
     # Run inference
     try:
-        results = await run_in_threadpool(run_inference, str(dest), float(speed), "cpu")
+        results = await run_in_threadpool(run_inference, str(dest), float(speed), "cpu",
+                                          rolling_stock=rolling_stock, telemetry=log, camera=camera or None,
+                                          detection_log=detection_log)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Inference error: {e}")
+    # gzip/brotli copies of the text artifacts, served by the download endpoints
+    for key in ("csv", "map"):
+        await run_in_threadpool(precompress, results[key])
 
     artifacts = {
         "video": "/download/video",
         "csv": "/download/csv",
         "map": "/download/map",
+        "clips": "/clips",
     }
 
     return JSONResponse(content={"message": "Analysis complete", "artifacts": artifacts})
@@ -53,31 +74,60 @@ async def analyze_video(file: UploadFile, speed: float = Form(80.0)):
 # ---------------- DOWNLOAD ENDPOINTS ---------------- #
 
 @app.get("/download/video")
-async def download_video():
-    """Download processed video (MP4, AVC1 browser-compatible)."""
+async def download_video(request: Request):
+    """Download processed video (MP4, AVC1 browser-compatible); supports Range for seeking."""
     video_file = OUT_DIR / "output_avc1.mp4"
     if not video_file.exists():
         raise HTTPException(status_code=404, detail="Video not found")
 
-    return FileResponse(
-        video_file,
+    return serve_file(
+        request, video_file,
         media_type="video/mp4",
         filename="output.mp4"   # still downloads as output.mp4, but codec-safe
     )
 
 @app.get("/download/csv")
-async def download_csv():
+async def download_csv(request: Request):
     """Download alerts CSV (fixed filename)."""
     csv_file = OUT_DIR / "alerts.csv"
     if not csv_file.exists():
         raise HTTPException(status_code=404, detail="CSV not found")
-    return FileResponse(csv_file, media_type="text/csv")
+    return serve_file(request, csv_file, media_type="text/csv")
 
 
 @app.get("/download/map")
-async def download_map():
+async def download_map(request: Request):
     """Download analysis map (fixed filename)."""
     map_file = OUT_DIR / "map.html"
     if not map_file.exists():
         raise HTTPException(status_code=404, detail="Map not found")
-    return FileResponse(map_file, media_type="text/html")
+    return serve_file(request, map_file, media_type="text/html")
+
+
+@app.get("/clips")
+async def list_clips():
+    """Event clips of the last analysis (one per merged SLOW_DOWN / BRAKE_EMERGENCY window)."""
+    index_file = OUT_DIR / "clips" / "index.json"
+    if not index_file.exists():
+        raise HTTPException(status_code=404, detail="No clips available")
+    index = json.loads(index_file.read_text())
+    for clip in index["clips"]:
+        clip["url"] = f"/download/clips/{clip['file']}"
+    return JSONResponse(content=index)
+
+
+@app.get("/download/clips/{name}")
+async def download_clip(name: str, request: Request):
+    """Download one event clip (Range supported)."""
+    clip_file = OUT_DIR / "clips" / Path(name).name
+    if clip_file.suffix != ".mp4" or not clip_file.exists():
+        raise HTTPException(status_code=404, detail="Clip not found")
+    return serve_file(request, clip_file, media_type="video/mp4")
+
+
+# ---------------- METRICS ---------------- #
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: per-stage timings, frames, jobs in flight, queue depths, per-job fps."""
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
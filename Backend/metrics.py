@@ -0,0 +1,215 @@
+# metrics.py
+"""
+Lightweight in-process metrics for the TrackGuard services.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock, so
+recording a sample costs a perf_counter() call and a dict update; `render()`
+produces the Prometheus text exposition format served by the `/metrics`
+endpoints. `JobTracer` wraps pipeline stages and can optionally append every
+stage timing to a per-job JSON-lines trace file.
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# seconds; covers sub-millisecond resizes up to multi-second re-encodes
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    parts = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + parts + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1.0, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_label_str(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_label_str(self.labels, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+                    break
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(s)) for k, s in self._series.items()]
+        lines = self._header()
+        for key, s in items:
+            cumulative = 0
+            for b, c in zip(self.buckets, s):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_label_str(self.labels + ('le',), key + (b,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(self.labels + ('le',), key + ('+Inf',))} {s[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {s[-2]}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {s[-1]}")
+        return lines
+
+
+def render():
+    """All registered metrics in Prometheus text format (version 0.0.4)."""
+    lines = []
+    for m in _registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---------------- shared metrics ----------------
+STAGE_SECONDS = Histogram("trackguard_stage_seconds", "Time spent per pipeline stage", labels=("service", "stage"))
+FRAMES_TOTAL = Counter("trackguard_frames_total", "Frames processed", labels=("service",))
+JOBS_TOTAL = Counter("trackguard_jobs_total", "Jobs finished", labels=("service", "status"))
+JOBS_IN_FLIGHT = Gauge("trackguard_jobs_in_flight", "Jobs currently running", labels=("service",))
+QUEUE_DEPTH = Gauge("trackguard_queue_depth", "Items waiting in an internal queue", labels=("queue",))
+JOB_FPS = Gauge("trackguard_job_fps", "Processing rate of running jobs (frames/s)", labels=("service", "job"))
+DEADLINE_MISSES = Counter("trackguard_deadline_misses_total", "Frames inferred after their stream deadline",
+                          labels=("stream",))
+CASCADE_FRAMES = Counter("trackguard_cascade_frames_total", "Frames seen by the detection cascade, per tier",
+                         labels=("tier",))
+FRAME_POOL_BYTES = Gauge("trackguard_frame_pool_bytes", "Frame buffer bytes reserved by running jobs")
+
+
+class JobTracer:
+    """
+    Stage timer for one job. Every `stage()` block is recorded in STAGE_SECONDS;
+    with `trace_path` each timing is also appended to a JSON-lines file, and with
+    `keep_samples` the raw durations are kept in `samples` (used by benchmark.py).
+    """
+
+    def __init__(self, job_id, service, trace_path=None, keep_samples=False):
+        self.job_id = job_id
+        self.service = service
+        self.frames = 0
+        self.totals = defaultdict(float)
+        self.samples = defaultdict(list) if keep_samples else None
+        self._trace = open(trace_path, "a", buffering=1024 * 1024) if trace_path else None
+        self._t0 = time.perf_counter()
+        self._last_fps_update = self._t0
+
+    def __enter__(self):
+        JOBS_IN_FLIGHT.inc(service=self.service)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        JOBS_IN_FLIGHT.dec(service=self.service)
+        JOB_FPS.remove(service=self.service, job=self.job_id)
+        JOBS_TOTAL.inc(service=self.service, status="error" if exc_type else "ok")
+        if self._trace is not None:
+            self._write({"event": "end", "frames": self.frames, "elapsed_s": self.elapsed(),
+                         "totals_s": dict(self.totals), "status": "error" if exc_type else "ok"})
+            self._trace.close()
+            self._trace = None
+        return False
+
+    def elapsed(self):
+        return time.perf_counter() - self._t0
+
+    def _write(self, record):
+        record["job"] = self.job_id
+        self._trace.write(json.dumps(record) + "\n")
+
+    @contextmanager
+    def stage(self, name, frame=None):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0, frame)
+
+    def record(self, name, seconds, frame=None):
+        STAGE_SECONDS.observe(seconds, service=self.service, stage=name)
+        self.totals[name] += seconds
+        if self.samples is not None:
+            self.samples[name].append(seconds)
+        if self._trace is not None:
+            self._write({"stage": name, "frame": frame, "t": round(self.elapsed(), 6), "dur": seconds})
+
+    def frame_done(self, n=1):
+        """Count processed frames and refresh the job's fps gauge (at most twice a second)."""
+        self.frames += n
+        FRAMES_TOTAL.inc(n, service=self.service)
+        now = time.perf_counter()
+        if now - self._last_fps_update >= 0.5:
+            self._last_fps_update = now
+            JOB_FPS.set(self.frames / max(1e-9, now - self._t0), service=self.service, job=self.job_id)
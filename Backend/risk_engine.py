@@ -0,0 +1,102 @@
+# risk_engine.py
+"""
+Shared risk engine for the obstacle (inference_object) and track-fault
+(track_yolo) services.
+
+Everything works on arrays with one element per detection, so a whole frame
+(or a whole batch of frames) is scored with a handful of NumPy operations.
+Decisions are returned as integer codes ordered by severity; DECISIONS maps
+them back to the labels used in alerts, CSVs and the HUD.
+"""
+import numpy as np # type: ignore
+
+DECISIONS = ("CLEAR", "CAUTION", "SLOW_DOWN", "BRAKE_EMERGENCY")  # index == severity
+CLEAR, CAUTION, SLOW_DOWN, BRAKE_EMERGENCY = range(len(DECISIONS))
+
+CLASS_WEIGHT = {
+    "person": 1.0, "car": 0.9, "truck": 1.1, "motorcycle": 0.95, "bicycle": 0.95,
+    "cow": 1.2, "buffalo": 1.2, "dog": 1.1, "sheep": 1.15, "goat": 1.15,
+    "elephant": 1.3, "train": 2.0, "animal": 1.3
+}
+
+# braking behaviour per rolling stock
+#   reaction_time  s before the brakes act
+#   decel          m/s^2 braking deceleration
+#   warning_dist   m, anything closer is at least CAUTION
+#   ttc_brake      s, time-to-collision that always triggers BRAKE_EMERGENCY
+ROLLING_STOCK = {
+    "default": {"reaction_time": 1.0, "decel": 1.2, "warning_dist": 150.0, "ttc_brake": 5.0},
+    "track_inspection": {"reaction_time": 1.0, "decel": 1.0, "warning_dist": 150.0, "ttc_brake": 5.0},
+    "freight": {"reaction_time": 1.5, "decel": 0.5, "warning_dist": 300.0, "ttc_brake": 8.0},
+}
+
+# risk score weights (distance, confidence, speed) and normalisation ranges
+RISK_WEIGHTS = (0.6, 0.25, 0.15)
+RISK_DIST_RANGE_M = 500.0
+RISK_SPEED_RANGE_KMPH = 200.0
+
+
+def get_profile(profile="default"):
+    """Resolve a rolling-stock name (or a dict of overrides on top of "default")."""
+    if isinstance(profile, dict):
+        return {**ROLLING_STOCK["default"], **profile}
+    try:
+        return ROLLING_STOCK[profile]
+    except KeyError:
+        raise ValueError(f"Unknown rolling stock profile {profile!r}; known: {sorted(ROLLING_STOCK)}")
+
+
+def class_weights(classes, weights=CLASS_WEIGHT):
+    """Per-detection class weights (unknown classes weigh 1.0)."""
+    return np.fromiter((weights.get(c, 1.0) for c in classes), dtype=np.float64, count=len(classes))
+
+
+def stopping_distance(speed_kmph, profile="default"):
+    """Reaction distance + braking distance (m) for scalar or array speeds."""
+    p = get_profile(profile)
+    v = np.maximum(np.asarray(speed_kmph, dtype=np.float64), 0.0) / 3.6
+    return v * p["reaction_time"] + v * v / (2.0 * max(0.1, p["decel"]))
+
+
+def time_to_collision(distance, speed_kmph):
+    return np.asarray(distance, dtype=np.float64) / np.maximum(0.1, np.asarray(speed_kmph, dtype=np.float64) / 3.6)
+
+
+def risk_scores(distance, conf, speed_kmph, weights=1.0):
+    """0-100 risk per detection from distance, confidence and speed, scaled by class weight."""
+    wd, wc, ws = RISK_WEIGHTS
+    d_norm = np.clip(1.0 - np.asarray(distance, dtype=np.float64) / RISK_DIST_RANGE_M, 0.0, 1.0)
+    c_norm = np.clip(np.asarray(conf, dtype=np.float64), 0.0, 1.0)
+    s_norm = np.clip(np.asarray(speed_kmph, dtype=np.float64) / RISK_SPEED_RANGE_KMPH, 0.0, 1.0)
+    return np.clip((wd * d_norm + wc * c_norm + ws * s_norm) * 100.0 * weights, 0.0, 100.0)
+
+
+def decisions(distance, speed_kmph, profile="default"):
+    """Severity code per detection (see DECISIONS)."""
+    p = get_profile(profile)
+    distance = np.asarray(distance, dtype=np.float64)
+    safe_stop = stopping_distance(speed_kmph, p)
+    ttc = time_to_collision(distance, speed_kmph)
+    codes = np.full(distance.shape, CLEAR, dtype=np.int8)
+    codes[distance <= p["warning_dist"]] = CAUTION
+    codes[distance <= safe_stop * 1.5] = SLOW_DOWN
+    codes[(distance <= safe_stop * 0.8) | (ttc <= p["ttc_brake"])] = BRAKE_EMERGENCY
+    return codes
+
+
+def score_detections(distance, conf, classes, speed_kmph, profile="default", weights=CLASS_WEIGHT):
+    """
+    Score all detections at once.
+    `speed_kmph` may be a scalar or one value per detection; `weights` maps class -> risk weight.
+    Returns (risk 0-100, decision codes, time-to-collision in s) as arrays.
+    """
+    distance = np.asarray(distance, dtype=np.float64)
+    risk = risk_scores(distance, conf, speed_kmph, class_weights(classes, weights))
+    return risk, decisions(distance, speed_kmph, profile), time_to_collision(distance, speed_kmph)
+
+
+def overall(risk, codes):
+    """Frame-level (worst-case) risk and decision label."""
+    if len(codes) == 0:
+        return 0.0, DECISIONS[CLEAR]
+    return float(np.max(risk)), DECISIONS[int(np.max(codes))]
@@ -0,0 +1,143 @@
+# scenario_engine.py
+"""
+Headless, vectorized version of the braking logic used by the Panda3D demos
+(train_fault_3dsimulation / train_obstacle_3dsimulation).
+
+Every argument may be a scalar or an array; they are broadcast together and all
+scenarios are stepped at once with the same fixed timestep the demos use, so a
+sweep over thousands of parameter combinations runs in well under a second and
+only the interesting cases need to be rendered.
+
+    from scenario_engine import scenario_grid, simulate_fault_approach
+    grid = scenario_grid(speed=np.linspace(1, 6, 50), decel=[0.2, 0.4, 0.6],
+                         gap=[150, 250], reaction_time=[0.0, 1.0, 2.0])
+    res = simulate_fault_approach(**grid)
+    risky = np.flatnonzero(res["collision"])
+"""
+import numpy as np # type: ignore
+
+# defaults mirror the demos
+SIM_DT = 1.0 / 30         # fixed timestep (SIM_FPS in the simulation modules)
+PLAN_DECEL = 0.5          # deceleration assumed by the braking decision: v^2 / (2 * 0.5)
+BRAKE_DECEL = 0.4         # deceleration actually applied once the brakes are on
+MIN_GAP = 60.0            # safety margin added to the stopping distance
+DETECTION_RANGE = 300.0   # camera range
+CONTACT_DISTANCE = 12.0   # two trains touch when their centres are two half-lengths (6 + 6) apart
+
+
+def scenario_grid(**axes):
+    """Cartesian product of parameter axes -> dict of flat, equally long float arrays."""
+    names = list(axes)
+    values = [np.atleast_1d(np.asarray(axes[n], dtype=np.float64)) for n in names]
+    mesh = np.meshgrid(*values, indexing="ij")
+    return {n: m.ravel() for n, m in zip(names, mesh)}
+
+
+def _as_arrays(*values):
+    arrays = np.broadcast_arrays(*[np.asarray(v, dtype=np.float64) for v in values])
+    return [a.astype(np.float64, copy=True) for a in arrays]
+
+
+def _brake_step(v, dist, decided_t, t, dt, det_range, reaction_time, min_gap, plan_decel, decel):
+    """One decision + braking step for a batch of trains (updates v / decided_t in place)."""
+    need = np.isnan(decided_t) & (dist < det_range) & (dist < v * v / (2.0 * plan_decel) + min_gap)
+    decided_t[need] = t
+    braking = (v > 0) & (t - decided_t >= reaction_time)  # NaN compares False: not decided yet
+    v[braking] = np.maximum(0.0, v[braking] - decel[braking] * dt)
+    return braking
+
+
+def simulate_fault_approach(gap, speed, decel=BRAKE_DECEL, detection_range=DETECTION_RANGE,
+                            reaction_time=0.0, min_gap=MIN_GAP, plan_decel=PLAN_DECEL,
+                            dt=SIM_DT, max_time=600.0):
+    """
+    A train `gap` metres from a stationary track fault, running at `speed` m/s.
+
+    The brake decision is taken once the fault is within `detection_range` and
+    closer than the planned stopping distance plus `min_gap`; braking at `decel`
+    starts `reaction_time` seconds later.
+
+    Returns a dict of arrays (one entry per scenario):
+      stop_margin  distance left to the fault when the train came to rest (< 0: overran)
+      collision    True when the train reached the fault
+      decision_t   time of the brake decision (NaN if never taken)
+      stop_t       time the train stopped (NaN if it ran onto the fault without stopping)
+    """
+    gap, speed, decel, det_range, reaction_time, min_gap, plan_decel = _as_arrays(
+        gap, speed, decel, detection_range, reaction_time, min_gap, plan_decel)
+    v = speed
+    travelled = np.zeros_like(gap)
+    decided_t = np.full_like(gap, np.nan)
+    stop_t = np.where(v <= 0, 0.0, np.nan)
+    overran = np.zeros(gap.shape, dtype=bool)
+
+    for step in range(int(np.ceil(max_time / dt))):
+        moving = v > 0
+        if not moving.any():
+            break
+        t = (step + 1) * dt
+        # same order as the demo's _update: move, then decide, then brake
+        travelled[moving] += v[moving] * dt
+        dist = np.abs(gap - travelled)
+        _brake_step(v, dist, decided_t, t, dt, det_range, reaction_time, min_gap, plan_decel, decel)
+        stop_t[moving & (v == 0)] = t
+        # a train that reached the fault without braking will never stop on its own
+        runaway = (v > 0) & (travelled >= gap) & np.isnan(decided_t)
+        overran |= runaway
+        v[runaway] = 0.0
+
+    stop_margin = gap - travelled
+    return {
+        "stop_margin": stop_margin,
+        "collision": overran | (stop_margin <= 0),
+        "decision_t": decided_t,
+        "stop_t": np.where(overran, np.nan, stop_t),
+    }
+
+
+def simulate_head_on(gap, speed_a, speed_b=None, decel=BRAKE_DECEL, decel_b=None,
+                     detection_range=DETECTION_RANGE, reaction_time=0.0, min_gap=MIN_GAP,
+                     plan_decel=PLAN_DECEL, contact_distance=CONTACT_DISTANCE,
+                     dt=SIM_DT, max_time=600.0):
+    """
+    Two trains on the same track approaching each other, centres `gap` metres apart.
+
+    Each train decides independently (as in TwoTrainSafetyDemo); train B uses
+    train A's speed/deceleration unless `speed_b` / `decel_b` are given.
+
+    Returns a dict of arrays:
+      final_gap    distance between the trains once both stopped (or at contact)
+      collision    True when the gap fell to `contact_distance`
+      stop_t_a / stop_t_b  time each train stopped (NaN if it never did)
+    """
+    speed_b = speed_a if speed_b is None else speed_b
+    decel_b = decel if decel_b is None else decel_b
+    (gap, va, vb, decel_a, decel_b, det_range, reaction_time, min_gap, plan_decel,
+     contact) = _as_arrays(gap, speed_a, speed_b, decel, decel_b, detection_range,
+                           reaction_time, min_gap, plan_decel, contact_distance)
+    decided_a = np.full_like(gap, np.nan)
+    decided_b = np.full_like(gap, np.nan)
+    stop_a = np.where(va <= 0, 0.0, np.nan)
+    stop_b = np.where(vb <= 0, 0.0, np.nan)
+    collision = gap <= contact
+
+    for step in range(int(np.ceil(max_time / dt))):
+        active = ((va > 0) | (vb > 0)) & ~collision
+        if not active.any():
+            break
+        t = (step + 1) * dt
+        moving_a = active & (va > 0)
+        moving_b = active & (vb > 0)
+        gap[active] -= (va[active] + vb[active]) * dt
+        collision |= active & (gap <= contact)
+        _brake_step(va, gap, decided_a, t, dt, det_range, reaction_time, min_gap, plan_decel, decel_a)
+        _brake_step(vb, gap, decided_b, t, dt, det_range, reaction_time, min_gap, plan_decel, decel_b)
+        stop_a[moving_a & (va == 0)] = t
+        stop_b[moving_b & (vb == 0)] = t
+
+    return {
+        "final_gap": gap,
+        "collision": collision,
+        "stop_t_a": np.where(collision, np.nan, stop_a),
+        "stop_t_b": np.where(collision, np.nan, stop_b),
+    }
@@ -0,0 +1,70 @@
+# sim_cache.py
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+class RenderCache:
+    """
+    On-disk cache of rendered simulation videos keyed by a hash of the scenario
+    parameters. Hits refresh the file's mtime, and the least recently used
+    entries are evicted once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, root="output/cache", max_bytes=2 * 1024**3, suffix=".mp4"):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(kind, params):
+        """Stable key for a simulation kind + parameter dict."""
+        blob = json.dumps({"kind": kind, **params}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:24]
+
+    def path(self, key):
+        return self.root / f"{key}{self.suffix}"
+
+    def staging_path(self, key):
+        """Where a renderer should write before `put` publishes the result."""
+        return self.root / f"{key}.render{self.suffix}"
+
+    def get(self, key):
+        """Return the cached file for `key` (and mark it recently used), or None."""
+        p = self.path(key)
+        try:
+            os.utime(p)
+        except FileNotFoundError:
+            return None
+        return p
+
+    def put(self, key, src):
+        """Move a finished render into the cache and evict old entries."""
+        dest = self.path(key)
+        os.replace(src, dest)
+        self.evict(keep=dest)
+        return dest
+
+    def evict(self, keep=None):
+        entries = []
+        for p in self.root.glob(f"*{self.suffix}"):
+            if "." in p.name[:-len(self.suffix)]:
+                continue  # not a published entry: in-progress render (<key>.render.mp4, <key>.render.part.mp4, ...)
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if keep is not None and p == keep:
+                continue
+            try:
+                p.unlink()
+                total -= size
+            except FileNotFoundError:
+                pass
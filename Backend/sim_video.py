@@ -0,0 +1,173 @@
+# sim_video.py
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import cv2 # type: ignore
+import numpy as np # type: ignore
+from panda3d.core import GraphicsOutput, Texture, WindowProperties # type: ignore
+
+from metrics import QUEUE_DEPTH
+
+# rawvideo pixel format for Panda3D RAM images (stored B, G, R[, A])
+_PIX_FMT = {3: "bgr24", 4: "bgra"}
+
+
+def set_window_size(base, width, height):
+    """Re-open a ShowBase's offscreen window at width x height (no-op if it already matches)."""
+    if base.win is not None and (base.win.getXSize(), base.win.getYSize()) == (width, height):
+        return
+    props = WindowProperties()
+    props.setSize(width, height)
+    base.openMainWindow(props=props, keepCamera=True)
+    base.camLens.setAspectRatio(width / float(height))
+
+
+class FrameCapture:
+    """
+    Render-to-texture capture of a ShowBase window.
+
+    Panda3D copies every rendered frame into the texture's RAM image, and
+    `view` wraps that image in a NumPy array without copying. The image is
+    bottom-up and in BGR(A) order; StreamingVideoWriter(flip=True) undoes both
+    in the encoder, so nothing is converted per frame here.
+    """
+
+    def __init__(self, base):
+        self.tex = Texture("frame_capture")
+        base.win.clearRenderTextures()
+        base.win.addRenderTexture(self.tex, GraphicsOutput.RTMCopyRam)
+
+    def view(self):
+        """(H, W, C) uint8 view of the last rendered frame, or None before the first render."""
+        if not self.tex.hasRamImage():
+            return None
+        arr = np.frombuffer(memoryview(self.tex.getRamImage()), dtype=np.uint8)
+        return arr.reshape((self.tex.getYSize(), self.tex.getXSize(), self.tex.getNumComponents()))
+
+
+class StreamingVideoWriter:
+    """
+    Encode simulation frames on a background thread while they are rendered.
+
+    `write` copies each frame into one of `max_queue` preallocated buffers and
+    hands it to the encoder thread, which returns the buffer once written, so
+    memory stays flat regardless of how long the simulation runs and there are
+    no per-frame allocations; `write` blocks when the encoder falls behind.
+    ffmpeg (H.264 via a rawvideo pipe) is used when it is on PATH, otherwise
+    OpenCV's mp4v writer. BGR and BGRA input are accepted; `flip=True` is for
+    bottom-up images (the vertical flip is done by the encoder). The file is
+    written under a temporary name and moved into place by `close`, so a
+    half-written video is never served.
+    """
+
+    def __init__(self, path, fps=30, max_queue=8, flip=False, crf=28):
+        self.path = path
+        self.fps = fps
+        self.flip = flip
+        self.crf = crf
+        self.max_queue = max_queue
+        root, ext = os.path.splitext(path)
+        self._tmp_path = f"{root}.part{ext or '.mp4'}"
+        self._queue = queue.Queue()
+        self._free = queue.Queue()
+        self._bgr = None
+        self._thread = None
+        self._proc = None
+        self._cv_writer = None
+        self._error = None
+        self.frames_written = 0
+
+    def write(self, frame):
+        """Copy one HxWx3 (BGR) or HxWx4 (BGRA) uint8 frame into the encode queue."""
+        if self._error is not None:
+            raise RuntimeError(f"video encoder failed: {self._error}")
+        if self._thread is None:
+            self._start(frame.shape)
+        buf = self._free.get()  # blocks while every buffer is waiting to be encoded
+        np.copyto(buf, frame)
+        self._queue.put(buf)
+        QUEUE_DEPTH.set(self._queue.qsize(), queue="sim_video")
+
+    def _start(self, shape):
+        h, w, channels = shape
+        for _ in range(self.max_queue):
+            self._free.put(np.empty(shape, dtype=np.uint8))
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if shutil.which("ffmpeg"):
+            cmd = [
+                "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                "-f", "rawvideo", "-pix_fmt", _PIX_FMT[channels],
+                "-s", f"{w}x{h}", "-r", str(self.fps), "-i", "-",
+            ]
+            if self.flip:
+                cmd += ["-vf", "vflip"]
+            cmd += [
+                "-vcodec", "libx264", "-crf", str(self.crf), "-preset", "fast",
+                "-pix_fmt", "yuv420p", "-f", "mp4", self._tmp_path,
+            ]
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        else:
+            # fallback: mp4v through OpenCV (less efficient, expects top-down BGR)
+            self._cv_writer = cv2.VideoWriter(self._tmp_path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (w, h))
+            if channels == 4 or self.flip:
+                self._bgr = np.empty((h, w, 3), dtype=np.uint8)
+        self._thread = threading.Thread(target=self._run, name="sim-video-writer", daemon=True)
+        self._thread.start()
+
+    def _to_bgr(self, frame):
+        # single pass into the reused scratch buffer for the OpenCV fallback
+        src = frame
+        if frame.shape[2] == 4:
+            cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR, dst=self._bgr)
+            src = self._bgr
+        if self.flip:
+            cv2.flip(src, 0, dst=self._bgr)
+        return self._bgr
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            try:
+                if self._error is not None:
+                    continue  # keep draining so producers never block forever
+                if self._proc is not None:
+                    self._proc.stdin.write(memoryview(frame).cast("B"))
+                else:
+                    self._cv_writer.write(frame if self._bgr is None else self._to_bgr(frame))
+                self.frames_written += 1
+            except Exception as e:
+                self._error = e
+            finally:
+                self._free.put(frame)
+
+    def close(self):
+        """Flush queued frames, finish the encoder and move the file into place."""
+        if self._thread is None:
+            return False
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            if self._proc.wait() != 0 and self._error is None:
+                self._error = RuntimeError(f"ffmpeg exited with code {self._proc.returncode}")
+            self._proc = None
+        if self._cv_writer is not None:
+            self._cv_writer.release()
+            self._cv_writer = None
+        if self._error is not None or not self.frames_written:
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+            return False
+        os.replace(self._tmp_path, self.path)
+        return True
@@ -0,0 +1,268 @@
+# stream_scheduler.py
+"""
+Run several camera streams (front / rear / under-carriage ...) through one
+shared detector.
+
+Every stream gets a decode thread that fills a small bounded queue with
+already-resized frames; the scheduler thread assembles cross-stream batches
+from the queue heads and runs one predict() per batch. Batches are filled
+round-robin so a busy stream cannot starve the others, streams are visited in
+order of their oldest frame's deadline (enqueue time + `deadline_s`), and a
+partial batch is flushed after `max_wait_s` so a slow stream never holds up the
+rest. Persistence, alerts, telemetry and output files stay per stream
+(inference_object.new_state / process_result / write_artifacts), so each stream
+ends up with the same artifacts as a single run_inference call.
+Frame buffers come from per-stream FramePools whose bytes are reserved from the
+node-wide frame budget in one go when run() starts, as in run_inference.
+"""
+import argparse
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+
+import cv2 # type: ignore
+
+import inference_object as pipeline
+from frame_pool import BUDGET, FramePool, frame_bytes
+from metrics import DEADLINE_MISSES, JobTracer, QUEUE_DEPTH
+from telemetry import Telemetry
+from video_decoder import open_decoder
+
+
+class _Stream:
+    def __init__(self, name, source, out_dir, sim_speed, rolling_stock, telemetry, deadline_s, start_s):
+        self.name = name
+        self.source = source
+        self.out_dir = out_dir
+        self.out_video = f"{out_dir}/output.mp4"
+        self.snaps_dir = f"{out_dir}/snaps"
+        self.sim_speed = sim_speed
+        self.telemetry = telemetry
+        self.deadline_s = deadline_s
+        self.start_s = start_s
+        self.state = pipeline.new_state(source, rolling_stock)
+        self.writer = None
+        self.full_pool = None      # FramePools, created by StreamScheduler.run
+        self.model_pool = None
+        self.tracer = JobTracer(f"{name}-{uuid.uuid4().hex[:6]}", "obstacle")
+        self.queue = deque()       # (frame_no, orig, resized, enqueued_at)
+        self.finished = False      # decode thread is done (queue may still hold frames)
+        self.error = None
+        self.result = None
+
+
+class StreamScheduler:
+    """
+    Usage:
+        sched = StreamScheduler()
+        sched.add_stream("front", "front.mp4", telemetry="loco.nmea")
+        sched.add_stream("rear", "rear.mp4", deadline_s=2.0)
+        paths = sched.run()   # {name: run_inference-style artifact dict, or {"error": ...}}
+    """
+
+    def __init__(self, detector=None, batch_size=pipeline.BATCH_SIZE, device="cpu", max_wait_s=0.02,
+                 queue_frames=None, finalize_workers=2):
+        self.detector = detector
+        self.batch_size = batch_size
+        self.device = device
+        self.max_wait_s = max_wait_s
+        self.queue_frames = queue_frames or 2 * batch_size
+        self.finalize_workers = finalize_workers
+        self.streams = []
+        self._cond = threading.Condition()
+        self._rr = 0  # round-robin start offset
+
+    def add_stream(self, name, input_path, out_dir=None, sim_speed=80.0, rolling_stock=pipeline.ROLLING_STOCK,
+                   telemetry=None, deadline_s=1.0, decoder=pipeline.DECODE_BACKEND, max_side=pipeline.DECODE_MAX_SIDE,
+                   start_s=0.0):
+        """Register a camera; `deadline_s` is how long its frames may wait for inference."""
+        if any(s.name == name for s in self.streams):
+            raise ValueError(f"Duplicate stream name {name!r}")
+        out_dir = out_dir or f"{pipeline.OUT_DIR}/streams/{name}"
+        if telemetry is not None and not isinstance(telemetry, Telemetry):
+            telemetry = Telemetry.from_file(telemetry)
+        source = open_decoder(input_path, backend=decoder, max_side=max_side)
+        stream = _Stream(name, source, out_dir, sim_speed, rolling_stock, telemetry, deadline_s, start_s)
+        self.streams.append(stream)
+        return stream
+
+    # ---------------- producers ----------------
+    def _decode(self, stream):
+        try:
+            for frame_no, _, orig in stream.source.frames(step=pipeline.FRAME_SKIP, start_s=stream.start_s,
+                                                          pool=stream.full_pool):
+                with stream.tracer.stage("resize", frame_no):
+                    resized = cv2.resize(orig, (pipeline.IMG_SIZE, pipeline.IMG_SIZE),
+                                         dst=stream.model_pool.acquire())
+                with self._cond:
+                    while len(stream.queue) >= self.queue_frames:
+                        self._cond.wait()
+                    stream.queue.append((frame_no, orig, resized, time.perf_counter()))
+                    QUEUE_DEPTH.set(len(stream.queue), queue=f"stream_{stream.name}")
+                    self._cond.notify_all()
+        except Exception as e:
+            stream.error = e
+        finally:
+            stream.source.close()
+            with self._cond:
+                stream.finished = True
+                self._cond.notify_all()
+
+    # ---------------- batching ----------------
+    def _take_batch(self):
+        """
+        Wait for frames and return [(stream, frame_no, orig, resized, enqueued_at)], or None when
+        every stream is drained. Called with self._cond held.
+        """
+        flush_at = None
+        while True:
+            ready = [s for s in self.streams if s.queue]
+            queued = sum(len(s.queue) for s in ready)
+            if not ready and all(s.finished for s in self.streams):
+                return None
+            now = time.perf_counter()
+            if ready and flush_at is None:
+                flush_at = now + self.max_wait_s
+            all_done = all(s.finished for s in self.streams if not s.queue)
+            overdue = any(s.queue[0][3] + s.deadline_s <= now for s in ready)
+            if queued >= self.batch_size or (ready and (now >= flush_at or all_done or overdue)):
+                break
+            self._cond.wait(timeout=None if flush_at is None else max(0.0, flush_at - now))
+
+        # earliest deadline first, rotated so ties do not always favour the first stream
+        n = len(ready)
+        ready = ready[self._rr % n:] + ready[:self._rr % n]
+        self._rr += 1
+        ready.sort(key=lambda s: s.queue[0][3] + s.deadline_s)
+        batch = []
+        while len(batch) < self.batch_size and any(s.queue for s in ready):
+            for s in ready:  # one frame per stream per round
+                if s.queue and len(batch) < self.batch_size:
+                    batch.append((s, *s.queue.popleft()))
+        for s in ready:
+            QUEUE_DEPTH.set(len(s.queue), queue=f"stream_{s.name}")
+        self._cond.notify_all()  # producers may refill
+        return batch
+
+    def _dispatch(self, batch, tracer):
+        with tracer.stage("predict"):
+            results = self.detector.predict([b[3] for b in batch], imgsz=pipeline.IMG_SIZE, conf=0.30,
+                                            verbose=False, device=self.device)
+        done_at = time.perf_counter()
+        # group per stream (batch order is kept inside a stream) for one telemetry lookup each
+        per_stream = {}
+        for r, (stream, frame_no, orig, _, enqueued_at) in zip(results, batch):
+            per_stream.setdefault(stream.name, (stream, []))[1].append((r, frame_no, orig))
+            if done_at - enqueued_at > stream.deadline_s:
+                DEADLINE_MISSES.inc(stream=stream.name)
+        for stream, items in per_stream.values():
+            idxs = [frame_no for _, frame_no, _ in items]
+            speeds, gps = pipeline.frame_navigation(idxs, stream.state["fps"], stream.sim_speed, stream.telemetry)
+            for (r, frame_no, orig), speed, pos in zip(items, speeds, gps):
+                hud_frame = pipeline.process_result(r, orig, frame_no, speed, stream.state, stream.snaps_dir,
+                                                    stream.tracer, pos)
+                with stream.tracer.stage("encode", frame_no):
+                    stream.writer.write(hud_frame)
+                stream.state["written"] += 1
+                stream.tracer.frame_done()
+        for stream, _, orig, resized, _ in batch:
+            stream.full_pool.release(orig)
+            stream.model_pool.release(resized)
+
+    def _finalize(self, stream):
+        stream.writer.release()
+        if stream.error is not None:
+            stream.result = {"error": repr(stream.error)}
+            return
+        stream.result = pipeline.write_artifacts(stream.state, stream.out_dir, stream.out_video,
+                                                 stream.tracer, stream.telemetry)
+
+    # ---------------- main loop ----------------
+    def run(self):
+        """Process every registered stream to the end; returns {name: artifact paths}."""
+        if not self.streams:
+            return {}
+        self.detector = self.detector if self.detector is not None else pipeline.load_detector()
+        # per stream: its queue, up to a full batch being dispatched and one frame waiting for queue room
+        count = self.queue_frames + self.batch_size + 1
+        model_shape = (pipeline.IMG_SIZE, pipeline.IMG_SIZE, 3)
+        shapes = [(s.source.height, s.source.width, 3) for s in self.streams]
+        reserved = sum(count * (frame_bytes(shape) + frame_bytes(model_shape)) for shape in shapes)
+        if reserved > BUDGET.limit:
+            raise MemoryError(f"{len(self.streams)} streams need {reserved / 1024**2:.0f} MB of frame buffers, "
+                              f"over the {BUDGET.limit / 1024**2:.0f} MB budget; lower queue_frames / batch_size "
+                              f"or decode with a smaller max_side")
+        BUDGET.reserve(reserved)  # all streams at once, so concurrent jobs cannot deadlock on a part-used budget
+        try:
+            return self._run(count, shapes, model_shape)
+        finally:
+            for s in self.streams:
+                for pool in (s.full_pool, s.model_pool):
+                    if pool is not None:
+                        pool.close()
+            BUDGET.release(reserved)
+
+    def _run(self, count, shapes, model_shape):
+        for s, shape in zip(self.streams, shapes):
+            s.full_pool = FramePool(shape, count, budget=None)
+            s.model_pool = FramePool(model_shape, count, budget=None)
+        for s in self.streams:
+            os.makedirs(s.snaps_dir, exist_ok=True)
+            s.writer = cv2.VideoWriter(s.out_video, cv2.VideoWriter_fourcc(*"avc1"), s.state["out_fps"],
+                                       (s.source.width, s.source.height))
+        tracer = JobTracer(uuid.uuid4().hex[:8], "stream_scheduler")
+        producers = [threading.Thread(target=self._decode, args=(s,), name=f"decode-{s.name}", daemon=True)
+                     for s in self.streams]
+        pending = set(s.name for s in self.streams)
+        futures = []
+        with ExitStack() as stack, ThreadPoolExecutor(self.finalize_workers) as finalizers:
+            stack.enter_context(tracer)
+            for s in self.streams:
+                stack.enter_context(s.tracer)
+            for t in producers:
+                t.start()
+            while True:
+                with self._cond:
+                    batch = self._take_batch()
+                    # streams whose decoder finished and whose frames are all dispatched
+                    drained = [s for s in self.streams if s.name in pending and s.finished and not s.queue]
+                if batch:
+                    self._dispatch(batch, tracer)
+                    tracer.frame_done(len(batch))
+                # finish (report, re-encode, clips) off the scheduler thread so other streams keep going
+                for s in drained:
+                    pending.discard(s.name)
+                    QUEUE_DEPTH.remove(queue=f"stream_{s.name}")
+                    futures.append(finalizers.submit(self._finalize, s))
+                if batch is None:
+                    break
+            for f in futures:
+                f.result()
+        for t in producers:
+            t.join()
+        return {s.name: s.result for s in self.streams}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Analyse several camera videos with one shared model")
+    ap.add_argument("videos", nargs="+", help="NAME=PATH or PATH (name = file stem)")
+    ap.add_argument("--out-dir", default=f"{pipeline.OUT_DIR}/streams")
+    ap.add_argument("--speed", type=float, default=80.0)
+    ap.add_argument("--deadline", type=float, default=1.0, help="seconds a frame may wait for inference")
+    ap.add_argument("--batch-size", type=int, default=pipeline.BATCH_SIZE)
+    ap.add_argument("--device", default="cpu")
+    args = ap.parse_args()
+
+    sched = StreamScheduler(batch_size=args.batch_size, device=args.device)
+    for spec in args.videos:
+        name, _, path = spec.rpartition("=")
+        name = name or Path(path).stem
+        sched.add_stream(name, path, out_dir=f"{args.out_dir}/{name}", sim_speed=args.speed,
+                         deadline_s=args.deadline)
+    for name, res in sched.run().items():
+        print(name, res)
@@ -0,0 +1,223 @@
+# telemetry.py
+"""
+Locomotive GPS / odometry telemetry, loaded once and sampled at video timestamps.
+
+Logs are CSV (a time column plus lat/lon and/or speed) or NMEA 0183 ($xxRMC,
+with $xxGGA as a position-only fallback). Samples are kept as sorted NumPy
+arrays; `sample(pts)` interpolates position and speed for any number of video
+timestamps at once (binary search, O(log n) per timestamp).
+
+Video PTS 0 is aligned with the first telemetry sample unless `offset_s` says
+otherwise (telemetry seconds after the first sample at which the video starts).
+"""
+import math
+from pathlib import Path
+
+import numpy as np # type: ignore
+import pandas as pd # type: ignore
+
+EARTH_RADIUS_M = 6371000.0
+KNOTS_TO_KMPH = 1.852
+
+_TIME_COLUMNS = ("timestamp", "time", "t", "time_s", "datetime")
+_LAT_COLUMNS = ("lat", "latitude")
+_LON_COLUMNS = ("lon", "lng", "long", "longitude")
+_SPEED_COLUMNS = {"speed_kmph": 1.0, "speed_kmh": 1.0, "speed": 1.0, "speed_mps": 3.6, "speed_ms": 3.6}
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class Telemetry:
+    def __init__(self, t, lat=None, lon=None, speed_kmph=None, offset_s=0.0):
+        t = np.asarray(t, dtype=np.float64)
+        if t.size == 0:
+            raise ValueError("Telemetry log has no samples")
+        order = np.argsort(t, kind="stable")
+        # drop repeated timestamps (keep the first sample of each)
+        keep = np.concatenate([[True], np.diff(t[order]) > 0])
+        order = order[keep]
+        self.t = t[order]
+        self.lat = None if lat is None else np.asarray(lat, dtype=np.float64)[order]
+        self.lon = None if lon is None else np.asarray(lon, dtype=np.float64)[order]
+        self.speed_kmph = None if speed_kmph is None else np.asarray(speed_kmph, dtype=np.float64)[order]
+        if self.speed_kmph is not None:
+            valid = np.isfinite(self.speed_kmph)
+            if not valid.any():
+                self.speed_kmph = None
+            elif not valid.all():
+                self.speed_kmph = np.interp(self.t, self.t[valid], self.speed_kmph[valid])
+        if self.speed_kmph is None and self.has_position and self.t.size > 1:
+            self.speed_kmph = self._speed_from_positions()
+        self.offset_s = float(offset_s)
+
+    def _speed_from_positions(self):
+        step_m = haversine_m(self.lat[:-1], self.lon[:-1], self.lat[1:], self.lon[1:])
+        step_s = np.diff(self.t)
+        seg_kmph = step_m / step_s * 3.6
+        # per-sample speed: mean of the adjacent segments
+        speed = np.empty_like(self.t)
+        speed[0], speed[-1] = seg_kmph[0], seg_kmph[-1]
+        speed[1:-1] = (seg_kmph[:-1] + seg_kmph[1:]) / 2.0
+        return speed
+
+    @property
+    def has_position(self):
+        return self.lat is not None and self.lon is not None
+
+    @property
+    def duration_s(self):
+        return float(self.t[-1] - self.t[0])
+
+    def sample(self, pts_s):
+        """
+        Interpolate at video timestamps (seconds from the start of the video).
+        Returns {"lat", "lon", "speed_kmph"} arrays (None where the log has no such data);
+        timestamps outside the log are clamped to its first/last sample.
+        """
+        q = self.t[0] + self.offset_s + np.asarray(pts_s, dtype=np.float64)
+        out = {"lat": None, "lon": None, "speed_kmph": None}
+        if self.has_position:
+            out["lat"] = np.interp(q, self.t, self.lat)
+            out["lon"] = np.interp(q, self.t, self.lon)
+        if self.speed_kmph is not None:
+            out["speed_kmph"] = np.interp(q, self.t, self.speed_kmph)
+        return out
+
+    def at(self, pts_s):
+        """(lat, lon, speed_kmph) at one timestamp; missing fields are None."""
+        s = self.sample([pts_s])
+        return tuple(None if v is None else float(v[0]) for v in (s["lat"], s["lon"], s["speed_kmph"]))
+
+    # ---------------- loaders ----------------
+    @classmethod
+    def from_file(cls, path, offset_s=0.0):
+        suffix = Path(path).suffix.lower()
+        if suffix == ".csv":
+            return cls.from_csv(path, offset_s=offset_s)
+        if suffix in (".nmea", ".txt", ".log", ".gps"):
+            return cls.from_nmea(path, offset_s=offset_s)
+        raise ValueError(f"Unsupported telemetry format: {suffix} (expected .csv or .nmea)")
+
+    @classmethod
+    def from_csv(cls, path, offset_s=0.0):
+        df = pd.read_csv(path)
+        cols = {c.lower().strip(): c for c in df.columns}
+
+        def pick(names):
+            return next((cols[n] for n in names if n in cols), None)
+
+        t_col = pick(_TIME_COLUMNS)
+        if t_col is None:
+            raise ValueError(f"Telemetry CSV needs a time column ({', '.join(_TIME_COLUMNS)})")
+        if pd.api.types.is_numeric_dtype(df[t_col]):
+            t = df[t_col].to_numpy(dtype=np.float64)
+        else:
+            # seconds since the epoch whatever the datetime64 unit (ns before pandas 3, us after)
+            ts = pd.to_datetime(df[t_col], utc=True)
+            t = ((ts - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+
+        lat_col, lon_col = pick(_LAT_COLUMNS), pick(_LON_COLUMNS)
+        lat = df[lat_col].to_numpy(dtype=np.float64) if lat_col and lon_col else None
+        lon = df[lon_col].to_numpy(dtype=np.float64) if lat_col and lon_col else None
+        speed = None
+        for name, factor in _SPEED_COLUMNS.items():
+            if name in cols:
+                speed = df[cols[name]].to_numpy(dtype=np.float64) * factor
+                break
+        if lat is None and speed is None:
+            raise ValueError("Telemetry CSV needs lat/lon and/or a speed column")
+        return cls(t, lat, lon, speed, offset_s=offset_s)
+
+    @classmethod
+    def from_nmea(cls, path, offset_s=0.0):
+        rmc, gga = [], []
+        with open(path, "r", errors="replace") as f:
+            for line in f:
+                fields = _nmea_fields(line)
+                if fields is None:
+                    continue
+                kind = fields[0][-3:]
+                if kind == "RMC":
+                    rec = _parse_rmc(fields)
+                    if rec is not None:
+                        rmc.append(rec)
+                elif kind == "GGA":
+                    rec = _parse_gga(fields)
+                    if rec is not None:
+                        gga.append(rec)
+        if rmc:
+            t, lat, lon, speed = (np.array(col, dtype=np.float64) for col in zip(*rmc))
+            return cls(t, lat, lon, speed, offset_s=offset_s)
+        if gga:
+            t, lat, lon = (np.array(col, dtype=np.float64) for col in zip(*gga))
+            # GGA has no date: unwrap midnight rollovers so time keeps increasing
+            t = t + 86400.0 * np.concatenate([[0], np.cumsum(np.diff(t) < -43200)])
+            return cls(t, lat, lon, None, offset_s=offset_s)
+        raise ValueError("No usable RMC/GGA sentences in NMEA log")
+
+
+# ---------------- NMEA helpers ----------------
+def _nmea_fields(line):
+    line = line.strip()
+    start = line.find("$")
+    if start < 0:
+        return None
+    line = line[start + 1:]
+    if "*" in line:
+        body, checksum = line.split("*", 1)
+        calc = 0
+        for ch in body:
+            calc ^= ord(ch)
+        try:
+            if calc != int(checksum[:2], 16):
+                return None
+        except ValueError:
+            return None
+    else:
+        body = line
+    return body.split(",")
+
+
+def _nmea_coord(value, hemi):
+    if not value:
+        return None
+    deg_len = 2 if hemi in ("N", "S") else 3
+    deg = float(value[:deg_len]) + float(value[deg_len:]) / 60.0
+    return -deg if hemi in ("S", "W") else deg
+
+
+def _nmea_seconds(hhmmss):
+    return int(hhmmss[0:2]) * 3600 + int(hhmmss[2:4]) * 60 + float(hhmmss[4:])
+
+
+def _parse_rmc(f):
+    # $xxRMC,hhmmss.ss,A,llll.ll,a,yyyyy.yy,a,knots,course,ddmmyy,...
+    try:
+        if len(f) < 10 or f[2] != "A" or not f[1] or not f[9]:
+            return None
+        day, month, year = int(f[9][0:2]), int(f[9][2:4]), 2000 + int(f[9][4:6])
+        epoch_day = pd.Timestamp(year=year, month=month, day=day, tz="UTC").value / 1e9
+        lat, lon = _nmea_coord(f[3], f[4]), _nmea_coord(f[5], f[6])
+        if lat is None or lon is None:
+            return None
+        speed = float(f[7]) * KNOTS_TO_KMPH if f[7] else math.nan
+        return epoch_day + _nmea_seconds(f[1]), lat, lon, speed
+    except (ValueError, IndexError):
+        return None
+
+
+def _parse_gga(f):
+    # $xxGGA,hhmmss.ss,llll.ll,a,yyyyy.yy,a,quality,...
+    try:
+        if len(f) < 7 or not f[1] or f[6] in ("", "0"):
+            return None
+        lat, lon = _nmea_coord(f[2], f[3]), _nmea_coord(f[4], f[5])
+        if lat is None or lon is None:
+            return None
+        return _nmea_seconds(f[1]), lat, lon
+    except (ValueError, IndexError):
+        return None
@@ -0,0 +1,24 @@
+# tests/test_file_serving.py
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from file_serving import _parse_range
+
+
+def test_valid_ranges():
+    assert _parse_range("bytes=0-99", 1000) == (0, 99)
+    assert _parse_range("bytes=900-", 1000) == (900, 999)
+    assert _parse_range("bytes=-100", 1000) == (900, 999)
+    assert _parse_range("bytes=500-5000", 1000) == (500, 999)
+
+
+def test_invalid_range_is_ignored():
+    # last < first is syntactically invalid: serve the full 200 response, not 416
+    assert _parse_range("bytes=5-2", 1000) is None
+    assert _parse_range("bytes=abc-def", 1000) is None
+
+
+def test_unsatisfiable_range():
+    assert _parse_range("bytes=1000-1100", 1000) == "unsatisfiable"
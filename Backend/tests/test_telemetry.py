@@ -0,0 +1,24 @@
+# tests/test_telemetry.py
+import sys
+from pathlib import Path
+
+import numpy as np # type: ignore
+import pytest # type: ignore
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telemetry import Telemetry
+
+
+def test_csv_iso_timestamps_keep_one_second_spacing(tmp_path):
+    log = tmp_path / "gps.csv"
+    log.write_text(
+        "timestamp,lat,lon,speed_kmph\n"
+        "2024-01-01T00:00:00Z,22.5726,88.3639,72.0\n"
+        "2024-01-01T00:00:01Z,22.5728,88.3641,73.0\n"
+        "2024-01-01T00:00:02Z,22.5730,88.3643,74.0\n"
+    )
+    tel = Telemetry.from_csv(log)
+    assert np.diff(tel.t) == pytest.approx([1.0, 1.0])
+    assert tel.duration_s == pytest.approx(2.0)
+    assert tel.sample(np.array([1.5]))["speed_kmph"][0] == pytest.approx(73.5)
@@ -1,13 +1,18 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.responses import JSONResponse, Response
 import uvicorn
-import cv2, os, time, shutil
+import cv2, os, time, shutil, uuid
 import numpy as np
 import pandas as pd
 from ultralytics import YOLO
 from pathlib import Path
 import folium
 
+import metrics
+import risk_engine
+from metrics import JobTracer
+from file_serving import precompress, serve_file
+
 # ====== FastAPI app ======
 app = FastAPI()
 
@@ -17,21 +22,10 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # ===== Distance & Risk Logic =====
-def braking_distance_m(speed_kmph, reaction_time_s, decel_mps2):
-    v = max(0.0, speed_kmph) / 3.6
-    return v * reaction_time_s + (v * v) / (2.0 * max(0.1, decel_mps2))
-
-def risk_score(distance_to_fault_m, speed_kmph, reaction_time_s, decel_mps2):
-    bd = braking_distance_m(speed_kmph, reaction_time_s, decel_mps2)
-    score = max(0.0, 100.0 * (1 - (distance_to_fault_m / (2 * bd))))
-    score = float(np.clip(score, 0, 100))
-    if distance_to_fault_m > 2 * bd:
-        level = "SAFE"
-    elif distance_to_fault_m > bd:
-        level = "CAUTION"
-    else:
-        level = "DANGER"
-    return level, score
+# scoring and decisions come from the shared risk_engine (same rules and level
+# names as the obstacle service); faults have no range estimate yet
+FAULT_DISTANCE_M = 50.0
+ROLLING_STOCK = "track_inspection"
 
 # Fake GPS
 train_route = [
@@ -62,7 +56,7 @@ def draw_boxes(frame, dets):
     for d in dets:
         x1, y1, x2, y2 = map(int, d["bbox"])
         risk = d.get("decision", "UNK")
-        color = (0,255,0) if risk=="SAFE" else (0,255,255) if risk=="CAUTION" else (0,0,255)
+        color = (0,255,0) if risk=="CLEAR" else (0,255,255) if risk in ("CAUTION", "SLOW_DOWN") else (0,0,255)
         txt = f'{d["cls"]} {d["conf"]:.2f} {risk} {d.get("risk_pct",0):.0f}%'
         cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
         cv2.putText(frame, txt, (x1, max(20, y1 - 5)),
@@ -70,93 +64,124 @@ def draw_boxes(frame, dets):
 
 # ===== Load Model (once) =====
 MODEL_PATH = r"C:\Users\SAPTARSHI MONDAL\SnakeGame\Model\track_fault_detection.pt"
-model = YOLO(MODEL_PATH)
-
-# ===== Analyze Endpoint =====
-@app.post("/analyze")
-async def analyze(file: UploadFile = File(...)):
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
+model = None
+
+def load_model(path=MODEL_PATH):
+    """Load the track-fault model on first use and reuse it afterwards."""
+    global model
+    if model is None:
+        model = YOLO(path)
+    return model
+
+# ===== Analysis =====
+def analyze_media(file_path, detector=None, out_dir=OUTPUT_DIR, trace_path=None, tracer=None):
+    """Run track-fault detection on a video or image; returns the artifact paths."""
+    detector = detector if detector is not None else load_model()
+    tracer = tracer if tracer is not None else JobTracer(uuid.uuid4().hex[:8], "track_fault", trace_path=trace_path)
     conf_th = 0.35
-    speed_kmph, reaction_time, decel = 80.0, 1.0, 1.0
+    speed_kmph = 80.0
 
     alerts = []
     frame_count = 0
     start_t = time.time()
 
     # Check type
-    is_video = file.filename.lower().endswith((".mp4", ".avi", ".mov"))
+    is_video = file_path.lower().endswith((".mp4", ".avi", ".mov"))
 
     out_video_path, out_image_path = None, None
 
     if is_video:
         cap = cv2.VideoCapture(file_path)
-        out_video_path = os.path.join(OUTPUT_DIR, "output_track_fault.mp4")
+        out_video_path = os.path.join(out_dir, "output_track_fault.mp4")
         out_video = cv2.VideoWriter(out_video_path,
                                     cv2.VideoWriter_fourcc(*"avc1"), 20,
                                     (int(cap.get(3)), int(cap.get(4))))
     else:
         image = cv2.imread(file_path)
-        out_image_path = os.path.join(OUTPUT_DIR, "output_track_fault.jpg")
+        out_image_path = os.path.join(out_dir, "output_track_fault.jpg")
         frames = [image]
 
-    while True:
-        if is_video:
-            ok, frame = cap.read()
+    with tracer:
+        while True:
+            with tracer.stage("decode"):
+                if is_video:
+                    ok, frame = cap.read()
+                else:
+                    ok = frame_count < len(frames)
+                    frame = frames[frame_count] if ok else None
             if not ok: break
-        else:
-            if frame_count >= len(frames): break
-            frame = frames[frame_count]
-
-        frame_count += 1
-        draw_frame = frame.copy()
-        detections = run_yolo(model, frame, conf=conf_th)
-
-        for d in detections:
-            dist = 50.0
-            d["distance_m"] = dist
-            d["decision"], d["risk_pct"] = risk_score(dist, speed_kmph, reaction_time, decel)
-
-        draw_boxes(draw_frame, detections)
-
-        gps_lat, gps_lon = get_gps_from_route(frame_count)
-        for d in detections:
-            alerts.append({
-                "t": round(time.time() - start_t, 2),
-                "label": d["cls"],
-                "distance_m": round(d["distance_m"], 1),
-                "decision": d["decision"],
-                "risk_pct": d["risk_pct"],
-                "lat": gps_lat,
-                "lon": gps_lon
-            })
+
+            frame_count += 1
+            with tracer.stage("predict", frame_count):
+                detections = run_yolo(detector, frame, conf=conf_th)
+
+            with tracer.stage("postprocess", frame_count):
+                dists = np.full(len(detections), FAULT_DISTANCE_M)
+                risks, codes, _ = risk_engine.score_detections(
+                    dists, [d["conf"] for d in detections], [d["cls"] for d in detections],
+                    speed_kmph, ROLLING_STOCK)
+                for d, dist, risk, code in zip(detections, dists, risks, codes):
+                    d["distance_m"] = float(dist)
+                    d["decision"] = risk_engine.DECISIONS[code]
+                    d["risk_pct"] = float(risk)
+
+                gps_lat, gps_lon = get_gps_from_route(frame_count)
+                for d in detections:
+                    alerts.append({
+                        "t": round(time.time() - start_t, 2),
+                        "label": d["cls"],
+                        "distance_m": round(d["distance_m"], 1),
+                        "decision": d["decision"],
+                        "risk_pct": d["risk_pct"],
+                        "lat": gps_lat,
+                        "lon": gps_lon
+                    })
+
+            with tracer.stage("hud", frame_count):
+                draw_frame = frame.copy()
+                draw_boxes(draw_frame, detections)
+
+            with tracer.stage("encode" if is_video else "imwrite", frame_count):
+                if is_video:
+                    out_video.write(draw_frame)
+                else:
+                    cv2.imwrite(out_image_path, draw_frame)
+            tracer.frame_done()
 
         if is_video:
-            out_video.write(draw_frame)
-        else:
-            cv2.imwrite(out_image_path, draw_frame)
+            cap.release()
+            out_video.release()
+
+        with tracer.stage("report"):
+            # Save CSV
+            csv_path = os.path.join(out_dir, "alerts_track_fault.csv")
+            pd.DataFrame(alerts).to_csv(csv_path, index=False)
+
+            # Save Map
+            map_path = os.path.join(out_dir, "track_fault_map.html")
+            m = folium.Map(location=[22.5726, 88.3639], zoom_start=14)
+            for alert in alerts:
+                color = "green" if alert["decision"]=="CLEAR" else "orange" if alert["decision"] in ("CAUTION", "SLOW_DOWN") else "red"
+                folium.Marker(
+                    location=[alert["lat"], alert["lon"]],
+                    popup=f"{alert['label']} - {alert['decision']} ({alert['risk_pct']:.0f}%) - {alert['distance_m']}m",
+                    icon=folium.Icon(color=color)
+                ).add_to(m)
+            m.save(map_path)
+
+    return {"csv": csv_path, "map": map_path, "video": out_video_path, "image": out_image_path}
 
-    if is_video:
-        cap.release()
-        out_video.release()
-
-    # Save CSV
-    csv_path = os.path.join(OUTPUT_DIR, "alerts_track_fault.csv")
-    pd.DataFrame(alerts).to_csv(csv_path, index=False)
-
-    # Save Map
-    map_path = os.path.join(OUTPUT_DIR, "track_fault_map.html")
-    m = folium.Map(location=[22.5726, 88.3639], zoom_start=14)
-    for alert in alerts:
-        color = "green" if alert["decision"]=="SAFE" else "orange" if alert["decision"]=="CAUTION" else "red"
-        folium.Marker(
-            location=[alert["lat"], alert["lon"]],
-            popup=f"{alert['label']} - {alert['decision']} ({alert['risk_pct']:.0f}%) - {alert['distance_m']}m",
-            icon=folium.Icon(color=color)
-        ).add_to(m)
-    m.save(map_path)
+# ===== Analyze Endpoint =====
+@app.post("/analyze")
+async def analyze(file: UploadFile = File(...)):
+    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+    results = analyze_media(file_path)
+    is_video = results["video"] is not None
+    for key in ("csv", "map"):
+        precompress(results[key])
 
     return JSONResponse({
         "message": "Analysis complete",
@@ -168,27 +193,38 @@ async def analyze(file: UploadFile = File(...)):
 
 # ===== Download Endpoints =====
 @app.get("/download/csv")
-async def download_csv():
-    return FileResponse(os.path.join(OUTPUT_DIR, "alerts_track_fault.csv"))
+async def download_csv(request: Request):
+    path = os.path.join(OUTPUT_DIR, "alerts_track_fault.csv")
+    if os.path.exists(path):
+        return serve_file(request, path, media_type="text/csv")
+    return JSONResponse({"error": "No CSV available"}, status_code=404)
 
 @app.get("/download/map")
-async def download_map():
-    return FileResponse(os.path.join(OUTPUT_DIR, "track_fault_map.html"))
+async def download_map(request: Request):
+    path = os.path.join(OUTPUT_DIR, "track_fault_map.html")
+    if os.path.exists(path):
+        return serve_file(request, path, media_type="text/html")
+    return JSONResponse({"error": "No map available"}, status_code=404)
 
 @app.get("/download/video")
-async def download_video():
+async def download_video(request: Request):
     path = os.path.join(OUTPUT_DIR, "output_track_fault.mp4")
     if os.path.exists(path):
-        return FileResponse(path)
+        return serve_file(request, path, media_type="video/mp4")
     return JSONResponse({"error": "No video available"}, status_code=404)
 
 @app.get("/download/image")
-async def download_image():
+async def download_image(request: Request):
     path = os.path.join(OUTPUT_DIR, "output_track_fault.jpg")
     if os.path.exists(path):
-        return FileResponse(path)
+        return serve_file(request, path, media_type="image/jpeg")
     return JSONResponse({"error": "No image available"}, status_code=404)
 
+# ===== Metrics =====
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
 # ===== Run =====
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -1,7 +1,8 @@
 # train_sim_api.py
 from fastapi import FastAPI
-from fastapi.responses import FileResponse
-import time, os, cv2, numpy as np, signal, shutil
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel, Field
+import time, os, signal
 
 from panda3d.core import (
     loadPrcFileData, AmbientLight, DirectionalLight, Vec4, LineSegs,
@@ -11,6 +12,11 @@ from direct.showbase.ShowBase import ShowBase
 from direct.task import Task
 from direct.gui.OnscreenText import OnscreenText
 
+import metrics
+from metrics import JobTracer
+from sim_cache import RenderCache
+from sim_video import FrameCapture, StreamingVideoWriter, set_window_size
+
 # === Panda3D offscreen settings ===
 loadPrcFileData("", "window-type offscreen")
 loadPrcFileData("", "audio-library-name null")
@@ -19,27 +25,20 @@ loadPrcFileData("", "win-size 1280 720")
 
 globalClock = ClockObject.getGlobalClock()
 VIDEO_PATH = "output/simulation.mp4"
+SIM_FPS = 30  # fixed-timestep rate (and video fps) when not running in real time
+MAX_SIM_TIME = 300.0  # seconds of simulated time before a run is cut off
+
+# default scenario (matches the original hard-coded demo)
+DEFAULT_SCENARIO = {
+    "train_y": -200.0, "speed": 3.0, "fault_y": 50.0, "decel": 0.4, "min_gap": 60.0,
+}
 
 class TrainSafetyDemo(ShowBase):
-    def __init__(self, record=False):
+    def __init__(self, record=False, fixed_dt=None, **scenario):
         # avoid Panda3D trying to install signal handlers (helpful when called from server)
         signal.signal = lambda *a, **k: None
         ShowBase.__init__(self)
 
-        self.record = record
-        self.frames = []
-        self.finished = False
-
-        # ===== simulation state =====
-        self.sim_time = 0.0
-        self._last_status_log_t = 0.0
-        self._status_interval = 0.25  # seconds between telemetry logs
-        self._fault_logged = False
-        self._brake_logged = False
-        self._stopped_logged = False
-        self._post_stop_hold = 1.5  # seconds to hold overlay after stop
-        self._stop_time = None
-
         # === visual overlay (OnscreenText) - will be included in offscreen renders
         self.log_lines = []
         self.log_label = OnscreenText(
@@ -56,26 +55,70 @@ class TrainSafetyDemo(ShowBase):
         self._setup_lights()
         self._create_track()
 
-        # track fault marker (bright red bar)
-        self.fault_y = 50
+        # track fault marker (bright red bar), positioned by reset()
         cm = CardMaker("fault_marker")
         cm.setFrame(-6, 6, -0.5, 0.5)
-        fault_marker = self.render.attachNewNode(cm.generate())
-        fault_marker.setPos(0, self.fault_y, -6.5)
-        fault_marker.setColor(1, 0, 0, 1)
+        self.fault_marker = self.render.attachNewNode(cm.generate())
+        self.fault_marker.setColor(1, 0, 0, 1)
 
         # train
         self.south_train = self._spawn_train("Southbound Train", (1, 0.3, 0.3, 1), (0, -200, 0))
-        self.vel_south = 3.0
+
+        self.writer = None
+        self.reset(record=record, fixed_dt=fixed_dt, **scenario)
+
+    def reset(self, record=False, fixed_dt=None, video_path=VIDEO_PATH, width=None, height=None,
+              **scenario):
+        """
+        Put the scene back at the start of a scenario so one ShowBase can render many runs.
+        `scenario` overrides DEFAULT_SCENARIO (train_y, speed, fault_y, decel, min_gap).
+        """
+        params = {**DEFAULT_SCENARIO, **scenario}
+        if width and height:
+            set_window_size(self, width, height)
+
+        self.record = record
+        # fixed_dt decouples simulation time from wall time: every step advances
+        # exactly fixed_dt seconds, so runs are reproducible and need no sleeping
+        self.fixed_dt = fixed_dt
+        video_fps = round(1.0 / fixed_dt) if fixed_dt else 30
+        # frames are streamed to the encoder as they are rendered (bounded queue); the capture
+        # texture is bottom-up BGRA, which the encoder flips/converts itself
+        self.video_path = str(video_path)
+        self.writer = StreamingVideoWriter(self.video_path, fps=video_fps, flip=True) if record else None
+        self.capture = FrameCapture(self) if record else None
+        self.finished = False
+
+        # ===== simulation state =====
+        self.sim_time = 0.0
+        self.trajectory = []  # (sim_time, train_y, velocity) per step
+        self.events = []      # (sim_time, message) for every logged message
+        self._last_status_log_t = 0.0
+        self._status_interval = 0.25  # seconds between telemetry logs
+        self._fault_logged = False
+        self._brake_logged = False
+        self._stopped_logged = False
+        self._post_stop_hold = 1.5  # seconds to hold overlay after stop
+        self._stop_time = None
+        self.log_lines = []
+        self.log_label.setText("")
+
+        self.fault_y = float(params["fault_y"])
+        self.fault_marker.setPos(0, self.fault_y, -6.5)
+        self.south_train.setPos(0, float(params["train_y"]), 0)
+        self.vel_south = float(params["speed"])
+        self.decel = float(params["decel"])
         self.brake_south = False
-        self.min_gap = 60.0
+        self.min_gap = float(params["min_gap"])
 
-        # add the update task
+        # (re)start the update task
+        self.taskMgr.remove("UpdateTask")
         self.taskMgr.add(self._update, "UpdateTask")
 
     def _log(self, msg):
         """Add a message to the overlay and print it (console)."""
         print(msg)
+        self.events.append((self.sim_time, msg))
         self.log_lines.append(msg)
         if len(self.log_lines) > 12:
             self.log_lines.pop(0)
@@ -117,12 +160,13 @@ class TrainSafetyDemo(ShowBase):
         return train
 
     def _update(self, task):
-        dt = globalClock.getDt()
+        dt = self.fixed_dt if self.fixed_dt is not None else globalClock.getDt()
         self.sim_time += dt
 
         # move the train if not fully stopped
         if self.vel_south > 0.0:
             self.south_train.setY(self.south_train.getY() + self.vel_south * dt)
+        self.trajectory.append((self.sim_time, self.south_train.getY(), self.vel_south))
 
         # compute distance and stopping distance
         train_y = self.south_train.getY()
@@ -143,87 +187,98 @@ class TrainSafetyDemo(ShowBase):
 
         # smooth braking when brake engaged
         if self.brake_south and self.vel_south > 0:
-            self.vel_south = max(0.0, self.vel_south - 0.4 * dt)
+            self.vel_south = max(0.0, self.vel_south - self.decel * dt)
             if self.vel_south == 0.0 and not self._stopped_logged:
                 self._log("✅ Train stopped safely before TRACK FAULT.")
                 self._stopped_logged = True
                 self._stop_time = self.sim_time
 
         # after stop, hold overlay for a short while so message is visible in the video
-        if self._stopped_logged and (self.sim_time - self._stop_time) >= self._post_stop_hold:
+        timed_out = self.sim_time >= MAX_SIM_TIME
+        if timed_out:
+            self._log("⏱ Simulation time limit reached.")
+        if timed_out or (self._stopped_logged and (self.sim_time - self._stop_time) >= self._post_stop_hold):
             # finalize video and end
             self._finalize_video()
             self.finished = True
             return Task.done
 
-        # record frame (grab offscreen buffer). Convert to contiguous array for OpenCV.
-        if self.record and self.win is not None:
-            tex = self.win.getScreenshot()
-            # getRamImageAs returns bytes in row-major, we reshape accordingly
-            arr = np.frombuffer(tex.getRamImageAs("RGB"), dtype=np.uint8)
-            try:
-                arr = arr.reshape((tex.getYSize(), tex.getXSize(), 3))
-            except Exception:
-                # fail-safe: try swapped shape
-                arr = arr.reshape((tex.getXSize(), tex.getYSize(), 3))
-            arr = np.flipud(arr).copy()  # flip vertical and make contiguous copy
-            self.frames.append(arr)
+        # record frame: view of the render-to-texture RAM image, copied once into a writer buffer
+        if self.capture is not None:
+            frame = self.capture.view()
+            if frame is not None:
+                self.writer.write(frame)
 
         return Task.cont
 
     def _finalize_video(self):
-        """Write frames to a temp AVI then compress with ffmpeg if present."""
-        if not self.record or not self.frames:
+        """Flush the streaming encoder and move the finished MP4 into place."""
+        if self.writer is None:
             return
-        os.makedirs("output", exist_ok=True)
-        h, w, _ = self.frames[0].shape
-
-        tmp_path = "output/tmp.avi"
-        out = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*"XVID"), 30, (w, h))
-        for f in self.frames:
-            out.write(f)
-        out.release()
-
-        ffmpeg_exists = shutil.which("ffmpeg") is not None
-        if ffmpeg_exists:
-            # compress & convert to MP4 H.264
-            cmd = f'ffmpeg -hide_banner -loglevel error -y -i "{tmp_path}" -vcodec libx264 -crf 28 -preset fast "{VIDEO_PATH}"'
-            os.system(cmd)
-            try:
-                os.remove(tmp_path)
-            except OSError:
-                pass
-            self._log(f"🎥 Compressed video saved to {VIDEO_PATH}")
-        else:
-            # fallback: write MP4 using mp4v codec (less efficient)
-            fallback_path = "output/simulation_fallback.mp4"
-            out2 = cv2.VideoWriter(fallback_path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (w, h))
-            for f in self.frames:
-                out2.write(f)
-            out2.release()
-            try:
-                os.replace(fallback_path, VIDEO_PATH)
-                os.remove(tmp_path)
-            except OSError:
-                pass
-            self._log(f"🎥 Video saved (fallback encoder) to {VIDEO_PATH}")
+        if self.writer.close():
+            self._log(f"🎥 Video saved to {self.video_path}")
 
 # FastAPI app
 app = FastAPI()
+cache = RenderCache("output/cache")
+_renderer = None
+
+
+def get_renderer():
+    """Panda3D allows one ShowBase per process, so every request reuses the same one."""
+    global _renderer
+    if _renderer is None:
+        _renderer = TrainSafetyDemo()
+    return _renderer
+
+
+class SimulationParams(BaseModel):
+    train_y: float = DEFAULT_SCENARIO["train_y"]
+    speed: float = Field(DEFAULT_SCENARIO["speed"], gt=0)
+    fault_y: float = DEFAULT_SCENARIO["fault_y"]
+    decel: float = Field(DEFAULT_SCENARIO["decel"], gt=0)
+    min_gap: float = Field(DEFAULT_SCENARIO["min_gap"], ge=0)
+    width: int = Field(1280, ge=64, le=3840, multiple_of=2)
+    height: int = Field(720, ge=64, le=2160, multiple_of=2)
+    fps: int = Field(SIM_FPS, ge=1, le=120)
+
 
 @app.post("/run_simulation")
-async def run_simulation():
+async def run_simulation(params: SimulationParams = SimulationParams(), realtime: bool = False):
     """
     Run an offscreen Panda3D simulation, record frames and return the produced MP4.
     This endpoint runs the simulation synchronously (blocks until done) and returns the final file.
+    By default the simulation uses a fixed timestep of 1/fps and runs as fast as rendering
+    allows; the result is cached by a hash of the parameters and repeated requests are served
+    straight from the cache. realtime=true uses wall-clock stepping at ~60Hz and is never cached.
     """
-    # create demo and step the Panda3D task manager until demo.finished is True
-    demo = TrainSafetyDemo(record=True)
+    p = params.dict()
+    fps = p.pop("fps")
+    key = cache.key("track_fault", {**p, "fps": fps})
+    if not realtime:
+        cached = cache.get(key)
+        if cached is not None:
+            return FileResponse(cached, media_type="video/mp4", filename="simulation.mp4")
+
+    # rendering runs on the event-loop thread, so requests never share the renderer concurrently
+    demo = get_renderer()
+    out_path = VIDEO_PATH if realtime else cache.staging_path(key)
+    demo.reset(record=True, fixed_dt=None if realtime else 1.0 / fps, video_path=out_path, **p)
     # step loop -- this runs inside the server process, synchronous
-    while not demo.finished:
-        demo.taskMgr.step()
-        time.sleep(1 / 60.0)  # step at ~60Hz
-    # at this point VIDEO_PATH should exist
-    if os.path.exists(VIDEO_PATH):
-        return FileResponse(VIDEO_PATH, media_type="video/mp4", filename="simulation.mp4")
-    return {"error": "Simulation finished but video file not found."}
+    with JobTracer(key[:8], "sim_track_fault") as tracer:
+        while not demo.finished:
+            with tracer.stage("step"):
+                demo.taskMgr.step()
+            tracer.frame_done()
+            if realtime:
+                time.sleep(1 / 60.0)  # step at ~60Hz
+    if not os.path.exists(out_path):
+        return {"error": "Simulation finished but video file not found."}
+    if not realtime:
+        out_path = cache.put(key, out_path)
+    return FileResponse(out_path, media_type="video/mp4", filename="simulation.mp4")
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
@@ -1,7 +1,8 @@
 # two_train_api.py
 from fastapi import FastAPI
-from fastapi.responses import FileResponse
-import time, os, cv2, numpy as np, signal, shutil
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel, Field
+import time, os, signal
 from panda3d.core import (
     loadPrcFileData, AmbientLight, DirectionalLight, Vec4, LineSegs,
     ClockObject, CardMaker, NodePath, TextNode
@@ -10,6 +11,11 @@ from direct.showbase.ShowBase import ShowBase
 from direct.task import Task
 from direct.gui.OnscreenText import OnscreenText
 
+import metrics
+from metrics import JobTracer
+from sim_cache import RenderCache
+from sim_video import FrameCapture, StreamingVideoWriter, set_window_size
+
 # ==== Panda3D Offscreen Mode ====
 loadPrcFileData("", "window-type offscreen")
 loadPrcFileData("", "audio-library-name null")
@@ -17,20 +23,20 @@ loadPrcFileData("", "win-size 1280 720")
 
 globalClock = ClockObject.getGlobalClock()
 VIDEO_PATH = "output/two_train_simulation.mp4"
+SIM_FPS = 30  # fixed-timestep rate (and video fps) when not running in real time
+MAX_SIM_TIME = 300.0
+
+DEFAULT_SCENARIO = {
+    "north_y": 200.0, "south_y": -200.0, "speed_north": 3.0, "speed_south": 3.0,
+    "decel": 0.4, "min_gap": 60.0,
+}
 
 class TwoTrainSafetyDemo(ShowBase):
-    def __init__(self, record=False):
+    def __init__(self, record=False, fixed_dt=None, **scenario):
         # Disable Panda3D's signal hook
         signal.signal = lambda *a, **k: None
         ShowBase.__init__(self)
 
-        self.record = record
-        self.frames = []
-        self.finished = False
-        self.sim_time = 0.0
-        self._post_stop_hold = 1.5
-        self._stop_time = None
-
         # Log overlay
         self.log_lines = []
         self.log_label = OnscreenText(
@@ -47,23 +53,56 @@ class TwoTrainSafetyDemo(ShowBase):
         self._setup_lights()
         self._create_track()
 
-        # Trains (opposite directions)
+        # Trains (opposite directions), positioned by reset()
         self.north_train = self._spawn_train("Northbound Train", (0.2, 0.7, 1, 1), (0, 200, 0))
         self.south_train = self._spawn_train("Southbound Train", (1, 0.3, 0.3, 1), (0, -200, 0))
 
+        self.writer = None
+        self.reset(record=record, fixed_dt=fixed_dt, **scenario)
+
+    def reset(self, record=False, fixed_dt=None, video_path=VIDEO_PATH, width=None, height=None,
+              **scenario):
+        """Restart the scene with `scenario` overriding DEFAULT_SCENARIO (reuses this ShowBase)."""
+        params = {**DEFAULT_SCENARIO, **scenario}
+        if width and height:
+            set_window_size(self, width, height)
+
+        self.record = record
+        # fixed_dt: advance exactly this many sim seconds per step (reproducible, no sleeping)
+        self.fixed_dt = fixed_dt
+        video_fps = round(1.0 / fixed_dt) if fixed_dt else 30
+        self.video_path = str(video_path)
+        # capture texture is bottom-up BGRA; the encoder flips/converts it
+        self.writer = StreamingVideoWriter(self.video_path, fps=video_fps, flip=True) if record else None
+        self.capture = FrameCapture(self) if record else None
+        self.finished = False
+        self.sim_time = 0.0
+        self.trajectory = []  # (sim_time, north_y, south_y, vel_north, vel_south)
+        self.events = []      # (sim_time, message)
+        self._post_stop_hold = 1.5
+        self._stop_time = None
+        self.log_lines = []
+        self.log_label.setText("")
+
+        self.north_train.setPos(0, float(params["north_y"]), 0)
+        self.south_train.setPos(0, float(params["south_y"]), 0)
+
         # Velocities
-        self.vel_north = -3.0
-        self.vel_south = 3.0
+        self.vel_north = -float(params["speed_north"])
+        self.vel_south = float(params["speed_south"])
+        self.decel = float(params["decel"])
 
         # Braking flags
         self.brake_north = False
         self.brake_south = False
-        self.min_gap = 60.0
+        self.min_gap = float(params["min_gap"])
 
+        self.taskMgr.remove("UpdateTask")
         self.taskMgr.add(self._update, "UpdateTask")
 
     def _log(self, msg):
         print(msg)
+        self.events.append((self.sim_time, msg))
         self.log_lines.append(msg)
         if len(self.log_lines) > 12:
             self.log_lines.pop(0)
@@ -105,7 +144,7 @@ class TwoTrainSafetyDemo(ShowBase):
         return train
 
     def _update(self, task):
-        dt = globalClock.getDt()
+        dt = self.fixed_dt if self.fixed_dt is not None else globalClock.getDt()
         self.sim_time += dt
 
         # Move trains
@@ -113,6 +152,8 @@ class TwoTrainSafetyDemo(ShowBase):
             self.north_train.setY(self.north_train.getY() + self.vel_north * dt)
         if self.vel_south > 0:
             self.south_train.setY(self.south_train.getY() + self.vel_south * dt)
+        self.trajectory.append((self.sim_time, self.north_train.getY(), self.south_train.getY(),
+                                self.vel_north, self.vel_south))
 
         # Distance and stopping distances
         dist = abs(self.north_train.getY() - self.south_train.getY())
@@ -134,15 +175,21 @@ class TwoTrainSafetyDemo(ShowBase):
 
         # Smooth braking
         if self.brake_north and self.vel_north < 0:
-            self.vel_north = min(0.0, self.vel_north + 0.4 * dt)
+            self.vel_north = min(0.0, self.vel_north + self.decel * dt)
             if self.vel_north == 0:
                 self._log("✅ Northbound Train stopped safely.")
 
         if self.brake_south and self.vel_south > 0:
-            self.vel_south = max(0.0, self.vel_south - 0.4 * dt)
+            self.vel_south = max(0.0, self.vel_south - self.decel * dt)
             if self.vel_south == 0:
                 self._log("✅ Southbound Train stopped safely.")
 
+        if self.sim_time >= MAX_SIM_TIME and not self.finished:
+            self._log("⏱ Simulation time limit reached.")
+            self._finalize_video()
+            self.finished = True
+            return Task.done
+
         # If both stopped, end sim after hold time
         if self.vel_north == 0 and self.vel_south == 0 and not self.finished:
             if self._stop_time is None:
@@ -152,41 +199,71 @@ class TwoTrainSafetyDemo(ShowBase):
                 self.finished = True
                 return Task.done
 
-        # Record frame
-        if self.record and self.win is not None:
-            tex = self.win.getScreenshot()
-            arr = np.frombuffer(tex.getRamImageAs("RGB"), dtype=np.uint8)
-            arr = arr.reshape((tex.getYSize(), tex.getXSize(), 3))
-            arr = np.flipud(arr).copy()
-            self.frames.append(arr)
+        # Record frame (zero-copy view of the capture texture)
+        if self.capture is not None:
+            frame = self.capture.view()
+            if frame is not None:
+                self.writer.write(frame)
 
         return Task.cont
 
     def _finalize_video(self):
-        if not self.record or not self.frames:
-            return
-        os.makedirs("output", exist_ok=True)
-        h, w, _ = self.frames[0].shape
-
-        tmp_path = "output/tmp.avi"
-        out = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*"XVID"), 30, (w, h))
-        for f in self.frames:
-            out.write(f)
-        out.release()
-
-        if shutil.which("ffmpeg"):
-            os.system(f'ffmpeg -y -i {tmp_path} -vcodec libx264 -crf 28 -preset fast {VIDEO_PATH}')
-            os.remove(tmp_path)
-        else:
-            os.rename(tmp_path, VIDEO_PATH)
+        if self.writer is not None:
+            self.writer.close()
 
 # ==== FastAPI App ====
 app = FastAPI()
+cache = RenderCache("output/cache")
+_renderer = None
+
+
+def get_renderer():
+    # one ShowBase per process: reuse it for every request
+    global _renderer
+    if _renderer is None:
+        _renderer = TwoTrainSafetyDemo()
+    return _renderer
+
+
+class SimulationParams(BaseModel):
+    north_y: float = DEFAULT_SCENARIO["north_y"]
+    south_y: float = DEFAULT_SCENARIO["south_y"]
+    speed_north: float = Field(DEFAULT_SCENARIO["speed_north"], gt=0)
+    speed_south: float = Field(DEFAULT_SCENARIO["speed_south"], gt=0)
+    decel: float = Field(DEFAULT_SCENARIO["decel"], gt=0)
+    min_gap: float = Field(DEFAULT_SCENARIO["min_gap"], ge=0)
+    width: int = Field(1280, ge=64, le=3840, multiple_of=2)
+    height: int = Field(720, ge=64, le=2160, multiple_of=2)
+    fps: int = Field(SIM_FPS, ge=1, le=120)
+
 
 @app.post("/run_simulation")
-async def run_simulation():
-    demo = TwoTrainSafetyDemo(record=True)
-    while not demo.finished:
-        demo.taskMgr.step()
-        time.sleep(1/60)
-    return FileResponse(VIDEO_PATH, media_type="video/mp4", filename="two_train_simulation.mp4")
\ No newline at end of file
+async def run_simulation(params: SimulationParams = SimulationParams(), realtime: bool = False):
+    # fixed 1/fps timestep and cached by parameter hash, unless realtime=true
+    # (wall-clock dt, ~60Hz stepping, never cached)
+    p = params.dict()
+    fps = p.pop("fps")
+    key = cache.key("two_train", {**p, "fps": fps})
+    if not realtime:
+        cached = cache.get(key)
+        if cached is not None:
+            return FileResponse(cached, media_type="video/mp4", filename="two_train_simulation.mp4")
+
+    demo = get_renderer()
+    out_path = VIDEO_PATH if realtime else cache.staging_path(key)
+    demo.reset(record=True, fixed_dt=None if realtime else 1.0 / fps, video_path=out_path, **p)
+    with JobTracer(key[:8], "sim_two_train") as tracer:
+        while not demo.finished:
+            with tracer.stage("step"):
+                demo.taskMgr.step()
+            tracer.frame_done()
+            if realtime:
+                time.sleep(1/60)
+    if not realtime and os.path.exists(out_path):
+        out_path = cache.put(key, out_path)
+    return FileResponse(out_path, media_type="video/mp4", filename="two_train_simulation.mp4")
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,245 @@
+# video_decoder.py
+"""
+Frame sources for the analysis pipelines.
+
+All decoders yield `(frame_no, pts_s, frame)` for every `step`-th frame, where
+`frame_no` is 1-based (frame_no % step == 0, matching FRAME_SKIP in
+inference_object) and `frame` is an owned HxWx3 BGR uint8 array. Frames in
+between are decoded, because inter-coded video needs them, but they are never
+colour-converted, scaled or copied to Python. `max_side` scales the output
+during decode (swscale / the ffmpeg scale filter), so a 4K source can be
+handed over at 1280 px without a full-size BGR frame ever existing.
+`start_s` seeks before decoding. With `pool` (a frame_pool.FramePool of the
+output shape) frames are written into pooled buffers instead of new arrays;
+the caller releases them.
+
+Backends:
+  pyav    - PyAV (libav* in-process), used when the `av` package is installed
+  ffmpeg  - ffmpeg subprocess writing rawvideo to a pipe (select + scale filters)
+  opencv  - cv2.VideoCapture; skipped frames use grab() without retrieve()
+"""
+import json
+import shutil
+import subprocess
+
+import cv2 # type: ignore
+import numpy as np # type: ignore
+
+try:
+    import av # type: ignore
+except ImportError:  # optional
+    av = None
+
+BACKENDS = ("pyav", "ffmpeg", "opencv")
+
+
+def output_size(src_w, src_h, max_side=None):
+    """Decode size that keeps the aspect ratio with the long side <= max_side (even dimensions)."""
+    if not max_side or max(src_w, src_h) <= max_side:
+        return src_w, src_h
+    scale = max_side / float(max(src_w, src_h))
+    return max(2, int(round(src_w * scale / 2)) * 2), max(2, int(round(src_h * scale / 2)) * 2)
+
+
+class VideoDecoder:
+    """Common interface: src/out size, fps, frame_count, frames(), close(), context manager."""
+
+    def __init__(self, path, max_side=None):
+        self.path = str(path)
+        self.max_side = max_side
+        self.src_width = self.src_height = 0
+        self.width = self.height = 0
+        self.fps = 0.0
+        self.frame_count = 0
+
+    def _set_size(self, src_w, src_h):
+        self.src_width, self.src_height = int(src_w), int(src_h)
+        self.width, self.height = output_size(self.src_width, self.src_height, self.max_side)
+
+    @property
+    def scale(self):
+        """Output pixels per source pixel."""
+        return self.height / float(self.src_height) if self.src_height else 1.0
+
+    def frames(self, step=1, start_s=0.0, pool=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class OpenCVDecoder(VideoDecoder):
+    def __init__(self, path, max_side=None):
+        super().__init__(path, max_side)
+        self.cap = cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Cannot open input {path}")
+        self._set_size(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH), self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 20.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+
+    def frames(self, step=1, start_s=0.0, pool=None):
+        frame_no = 0
+        if start_s > 0:
+            self.cap.set(cv2.CAP_PROP_POS_MSEC, start_s * 1000.0)
+            frame_no = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        resize = (self.width, self.height) != (self.src_width, self.src_height)
+        scratch = None  # full-size retrieve target when scaling into pooled buffers
+        while self.cap.grab():
+            frame_no += 1
+            if frame_no % step != 0:
+                continue  # grabbed (decoded) but never converted to BGR
+            buf = pool.acquire() if pool is not None else None
+            if resize:
+                ok, scratch = self.cap.retrieve(scratch)
+                frame = cv2.resize(scratch, (self.width, self.height), dst=buf, interpolation=cv2.INTER_AREA) \
+                    if ok else None
+            else:
+                ok, frame = self.cap.retrieve(buf)
+            if not ok:
+                if buf is not None:
+                    pool.release(buf)
+                break
+            yield frame_no, (frame_no - 1) / self.fps, frame
+
+    def close(self):
+        self.cap.release()
+
+
+class PyAVDecoder(VideoDecoder):
+    def __init__(self, path, max_side=None, threads="AUTO"):
+        if av is None:
+            raise RuntimeError("PyAV is not installed")
+        super().__init__(path, max_side)
+        self.container = av.open(self.path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = threads  # frame + slice threading inside libavcodec
+        ctx = self.stream.codec_context
+        self._set_size(ctx.width, ctx.height)
+        self.fps = float(self.stream.average_rate or self.stream.guessed_rate or 20.0)
+        self.frame_count = int(self.stream.frames or 0)
+
+    def frames(self, step=1, start_s=0.0, pool=None):
+        tb = float(self.stream.time_base)
+        t0 = float(self.stream.start_time or 0) * tb
+        if start_s > 0:
+            # lands on the keyframe at or before start_s; earlier frames are dropped below
+            self.container.seek(int((t0 + start_s) / tb), stream=self.stream, backward=True)
+        for frame in self.container.decode(self.stream):
+            pts_s = (frame.pts * tb - t0) if frame.pts is not None else frame.time
+            if pts_s is None or pts_s < start_s - 0.5 / self.fps:
+                continue
+            frame_no = int(round(pts_s * self.fps)) + 1
+            if frame_no % step != 0:
+                continue  # decoded YUV frame is dropped without conversion
+            img = frame.reformat(width=self.width, height=self.height, format="bgr24").to_ndarray()
+            if pool is not None:
+                buf = pool.acquire()
+                np.copyto(buf, img)
+                img = buf
+            yield frame_no, pts_s, img
+
+    def close(self):
+        self.container.close()
+
+
+class FFmpegPipeDecoder(VideoDecoder):
+    def __init__(self, path, max_side=None, hwaccel=None):
+        if not shutil.which("ffmpeg"):
+            raise RuntimeError("ffmpeg is not on PATH")
+        super().__init__(path, max_side)
+        self.hwaccel = hwaccel
+        self._proc = None
+        self._probe()
+
+    def _probe(self):
+        if shutil.which("ffprobe"):
+            out = subprocess.run([
+                "ffprobe", "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "stream=width,height,avg_frame_rate,nb_frames", "-of", "json", self.path,
+            ], capture_output=True, check=True).stdout
+            st = json.loads(out)["streams"][0]
+            num, _, den = st.get("avg_frame_rate", "0/1").partition("/")
+            self._set_size(st["width"], st["height"])
+            self.fps = (float(num) / float(den or 1)) if float(num or 0) else 20.0
+            self.frame_count = int(st.get("nb_frames") or 0)
+        else:
+            cap = cv2.VideoCapture(self.path)
+            if not cap.isOpened():
+                raise RuntimeError(f"Cannot open input {self.path}")
+            self._set_size(cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self.fps = cap.get(cv2.CAP_PROP_FPS) or 20.0
+            self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+            cap.release()
+
+    def frames(self, step=1, start_s=0.0, pool=None):
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin"]
+        if self.hwaccel:
+            cmd += ["-hwaccel", self.hwaccel]
+        if start_s > 0:
+            cmd += ["-ss", f"{start_s:.3f}"]
+        # frame n (0-based after the seek) is frame_no base+n+1; keep those divisible by step
+        base = int(round(start_s * self.fps))
+        first = (step - 1 - base) % step
+        filters = [f"select=eq(mod(n\\,{step})\\,{first})"] if step > 1 else []
+        if (self.width, self.height) != (self.src_width, self.src_height):
+            filters.append(f"scale={self.width}:{self.height}:flags=area")
+        cmd += ["-i", self.path]
+        if filters:
+            cmd += ["-vf", ",".join(filters)]
+        cmd += ["-vsync", "0", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"]
+
+        frame_bytes = self.width * self.height * 3
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=frame_bytes)
+        frame_no = base + first + 1
+        try:
+            while True:
+                img = pool.acquire() if pool is not None else np.empty((self.height, self.width, 3), dtype=np.uint8)
+                view = memoryview(img).cast("B")
+                got = 0
+                while got < frame_bytes:
+                    n = self._proc.stdout.readinto(view[got:])
+                    if not n:
+                        break
+                    got += n
+                if got < frame_bytes:
+                    if pool is not None:
+                        pool.release(img)
+                    break
+                yield frame_no, (frame_no - 1) / self.fps, img
+                frame_no += step
+            if self._proc.wait() != 0:
+                raise RuntimeError(f"ffmpeg could not decode {self.path} (exit code {self._proc.returncode})")
+        finally:
+            self.close()
+
+    def close(self):
+        if self._proc is not None:
+            self._proc.stdout.close()
+            if self._proc.poll() is None:
+                self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+
+
+def open_decoder(path, backend="auto", max_side=None, **kwargs):
+    """
+    Open `path` with the named backend; "auto" prefers PyAV, then the ffmpeg
+    pipe, then OpenCV.
+    """
+    if backend == "auto":
+        backend = "pyav" if av is not None else "ffmpeg" if shutil.which("ffmpeg") else "opencv"
+    if backend == "pyav":
+        return PyAVDecoder(path, max_side=max_side, **kwargs)
+    if backend == "ffmpeg":
+        return FFmpegPipeDecoder(path, max_side=max_side, **kwargs)
+    if backend == "opencv":
+        return OpenCVDecoder(path, max_side=max_side)
+    raise ValueError(f"Unknown decoder backend {backend!r}; known: {BACKENDS}")
@@ -0,0 +1,76 @@
+# vocab_cache.py
+"""
+On-disk cache of YOLO-World text embeddings.
+
+`set_classes` runs every class name through the CLIP text encoder (and loads
+CLIP to do it). The resulting embedding tensor depends only on the weights and
+the vocabulary, so it is saved under a hash of both; later loads install the
+tensor directly and never touch CLIP. Each deployment vocabulary gets its own
+file, so switching between them is free after the first run.
+
+    python vocab_cache.py yolov8m-worldv2.pt person car cow   # warm the cache
+"""
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+VOCAB_CACHE_DIR = Path(__file__).parent.resolve() / "cache" / "vocab"
+
+
+def is_world_model(weights):
+    return "world" in Path(str(weights)).stem.lower()
+
+
+def vocab_key(weights, vocabulary):
+    blob = json.dumps({"weights": Path(str(weights)).name, "vocab": list(vocabulary)}, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:24]
+
+
+def _install(model, vocabulary, txt_feats):
+    # mirrors YOLOWorld.set_classes / WorldModel.set_classes without the text encoder
+    names = list(vocabulary)
+    inner = model.model
+    inner.txt_feats = txt_feats
+    inner.model[-1].nc = len(names)
+    inner.names = names
+    if getattr(model, "predictor", None) is not None:
+        model.predictor.model.names = names
+
+
+def apply_vocabulary(model, vocabulary, weights, cache_dir=VOCAB_CACHE_DIR):
+    """
+    Restrict a YOLO-World model to `vocabulary`, using cached embeddings when available.
+    Returns "cache" or "computed".
+    """
+    import torch # type: ignore
+
+    vocabulary = list(vocabulary)
+    path = Path(cache_dir) / f"{vocab_key(weights, vocabulary)}.pt"
+    if path.exists():
+        try:
+            txt_feats = torch.load(path, map_location="cpu")
+            if txt_feats.shape[-2] == len(vocabulary):
+                _install(model, vocabulary, txt_feats)
+                return "cache"
+        except Exception:
+            pass  # unreadable / stale entry: recompute below
+    model.set_classes(vocabulary)
+    txt_feats = getattr(model.model, "txt_feats", None)
+    if txt_feats is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".part")
+        torch.save(txt_feats.detach().cpu().clone(), tmp)
+        os.replace(tmp, path)
+    return "computed"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Precompute YOLO-World embeddings for a vocabulary")
+    ap.add_argument("weights")
+    ap.add_argument("classes", nargs="+")
+    args = ap.parse_args()
+
+    from ultralytics import YOLO # type: ignore
+    print(apply_vocabulary(YOLO(args.weights), args.classes, args.weights), vocab_key(args.weights, args.classes))